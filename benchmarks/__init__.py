@@ -0,0 +1,9 @@
+"""
+Benchmarks for intelmq-webinput-csv
+
+SPDX-FileCopyrightText: 2026 Bundesamt für Sicherheit in der Informationstechnik
+SPDX-License-Identifier: AGPL-3.0-or-later
+Software engineering by Intevation GmbH <https://intevation.de>
+
+Run from the repository root with: python -m benchmarks.run --help
+"""
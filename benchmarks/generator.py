@@ -0,0 +1,92 @@
+"""
+Synthetic upload data for the benchmarks
+
+SPDX-FileCopyrightText: 2026 Bundesamt für Sicherheit in der Informationstechnik
+SPDX-License-Identifier: AGPL-3.0-or-later
+Software engineering by Intevation GmbH <https://intevation.de>
+
+The rows look like the rows the frontend sends after parsing a CSV file:
+dictionaries of field names and string values.
+"""
+import csv
+import io
+import random
+from typing import Callable, Iterator, List, Tuple
+
+# (field name, generator of a valid value, generator of an invalid value)
+FIELDS: List[Tuple[str, Callable[[random.Random], str], Callable[[random.Random], str]]] = [
+    ('source.ip',
+     lambda rnd: f'198.51.{rnd.randrange(256)}.{rnd.randrange(256)}',
+     lambda rnd: f'1270.0.0.{rnd.randrange(256)}'),
+    ('time.source',
+     lambda rnd: f'2023-06-{rnd.randrange(1, 29):02d} {rnd.randrange(24):02d}:{rnd.randrange(60):02d}:{rnd.randrange(60):02d}',
+     lambda rnd: 'yesterday-ish'),
+    ('source.asn',
+     lambda rnd: str(rnd.randrange(1, 65536)),
+     lambda rnd: 'AS-unknown'),
+    ('source.port',
+     lambda rnd: str(rnd.randrange(1, 65536)),
+     lambda rnd: str(rnd.randrange(70000, 80000))),
+    ('source.url',
+     lambda rnd: f'http://host{rnd.randrange(1000)}.example.com/path/{rnd.randrange(1000)}',
+     lambda rnd: 'no url'),
+    ('source.as_name',
+     lambda rnd: f'Example AS {rnd.randrange(100)}',
+     lambda rnd: ''),
+    ('classification.type',
+     lambda rnd: rnd.choice(['scanner', 'infected-system', 'brute-force', 'phishing']),
+     lambda rnd: 'no-such-type'),
+    ('protocol.transport',
+     lambda rnd: rnd.choice(['tcp', 'udp']),
+     lambda rnd: 'carrier-pigeon'),
+    ('destination.ip',
+     lambda rnd: f'203.0.113.{rnd.randrange(256)}',
+     lambda rnd: '203.0.113.256'),
+    ('destination.port',
+     lambda rnd: str(rnd.randrange(1, 65536)),
+     lambda rnd: '-1'),
+    ('time.observation',
+     lambda rnd: f'2023-06-29T{rnd.randrange(24):02d}:{rnd.randrange(60):02d}:00+00:00',
+     lambda rnd: '29.06.2023 25:61'),
+    ('malware.name',
+     lambda rnd: rnd.choice(['mirai', 'emotet', 'qakbot']),
+     lambda rnd: ''),
+]
+
+
+def columns(width: int) -> List[str]:
+    """
+    Returns the field names of the columns, extra fields are used for widths beyond the known fields
+    """
+    return [FIELDS[index][0] if index < len(FIELDS) else f'extra.column_{index}'
+            for index in range(width)]
+
+
+def generate_rows(count: int, width: int = 6, error_rate: float = 0.0, seed: int = 0) -> Iterator[dict]:
+    """
+    Yields count rows with width columns.
+    A share of error_rate of the rows has one invalid value, the results are reproducible with the seed.
+    """
+    rnd = random.Random(seed)
+    for _ in range(count):
+        row = {}
+        for index, field in enumerate(columns(width)):
+            if index < len(FIELDS):
+                row[field] = FIELDS[index][1](rnd)
+            else:
+                row[field] = f'value {rnd.randrange(10000)}'
+        if error_rate and rnd.random() < error_rate:
+            index = rnd.randrange(min(width, len(FIELDS)))
+            row[FIELDS[index][0]] = FIELDS[index][2](rnd)
+        yield row
+
+
+def to_csv(rows: List[dict], width: int) -> str:
+    """
+    Returns the rows as CSV file with header, as uploaded to /api/upload/csv
+    """
+    output = io.StringIO()
+    writer = csv.DictWriter(output, fieldnames=columns(width))
+    writer.writeheader()
+    writer.writerows(rows)
+    return output.getvalue()
@@ -0,0 +1,327 @@
+"""
+Benchmarks of the upload, bot and SQL output hot paths
+
+SPDX-FileCopyrightText: 2026 Bundesamt für Sicherheit in der Informationstechnik
+SPDX-License-Identifier: AGPL-3.0-or-later
+Software engineering by Intevation GmbH <https://intevation.de>
+
+Run from the repository root with the configuration of the tests (see the developers guide).
+The results are written as JSON, runs can be compared with --compare:
+
+    python -m benchmarks.run --rows 10000 --output before.json
+    python -m benchmarks.run --rows 10000 --output after.json --compare before.json
+
+The uploads are sent to a fakeredis pipeline, if fakeredis is installed,
+otherwise to the Redis server given with --redis.
+The SQL output bot inserts into a temporary table of the PostgreSQL database
+given with --postgres. Without, it runs against a stand-in connection, which
+quotes the values like psycopg2 and discards the statements.
+"""
+import argparse
+import datetime
+import json
+import platform
+import statistics
+import sys
+import time
+from collections import defaultdict
+from contextlib import ExitStack
+from subprocess import run
+from typing import Callable, Optional
+from unittest import mock
+
+from hug import test
+from intelmq import __version__ as intelmq_version
+from intelmq.lib.bot import BotLibSettings
+from intelmq.lib.harmonization import DateTime
+
+import intelmq_webinput_csv.serve
+from intelmq_webinput_csv.columns import ColumnPlan
+from intelmq_webinput_csv.pool import Pool
+from intelmq_webinput_csv.sql_output import WebinputSQLOutputBot
+from intelmq_webinput_csv.version import __version__
+from tests.test_bots import BOTS_CONFIG
+from tests.test_main import CONFIG
+
+from .generator import columns, generate_rows, to_csv
+
+try:
+    import fakeredis
+except ImportError:
+    fakeredis = None
+else:
+    class FakeRedis(fakeredis.FakeRedis):
+        """
+        fakeredis does not implement INFO, which the IntelMQ pipeline uses for the server version
+        """
+
+        def execute_command(self, *args, **options):
+            if args[0] == 'INFO':
+                return {'redis_version': '7.0.0'}
+            return super().execute_command(*args, **options)
+try:
+    from psycopg2 import connect
+    from psycopg2.extensions import adapt
+except ImportError:
+    connect = adapt = None
+
+BENCHMARKS = {}
+
+
+def benchmark(function: Callable) -> Callable:
+    """
+    Registers the benchmark
+    A benchmark gets the parsed arguments and the rows, and returns the function to time,
+    or a string with the reason why it is skipped.
+    """
+    BENCHMARKS[function.__name__] = function
+    return function
+
+
+class NullCursor:
+    """
+    Stand-in for a psycopg2 cursor without database server
+    The values are quoted like psycopg2 does, the statements are discarded.
+    """
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def mogrify(self, query, args=None):
+        if isinstance(query, str):
+            query = query.encode()
+        if args is None:
+            return query
+        return query % tuple(adapt(arg).getquoted() for arg in args)
+
+    def execute(self, query, args=None):
+        self.connection.statements += 1
+        if args is not None:
+            self.mogrify(query, args)
+
+    def fetchall(self):
+        return []
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+
+class NullConnection:
+    autocommit = False
+    encoding = 'UTF8'
+
+    def __init__(self):
+        self.statements = 0
+
+    def cursor(self, cursor_factory=None):
+        return NullCursor(self)
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+
+def convert(rows: list, body: dict) -> list:
+    """
+    Converts the rows to events like upload_data does, returns the valid events
+    """
+    time_observation = DateTime().generate_datetime_now()
+    column_plan = ColumnPlan(intelmq_webinput_csv.serve.EVENT_HARMONIZATION, intelmq_webinput_csv.serve.HARMONIZATION_CONF)
+    base_event = intelmq_webinput_csv.serve.BaseEvent(body, time_observation)
+    timestamp_parsers = {}
+    retval = defaultdict(dict)
+    events = []
+    for lineno, item in enumerate(rows):
+        event, line_valid = intelmq_webinput_csv.serve.row_to_event(item, body, retval, lineno, time_observation,
+                                                                    timestamp_parsers, column_plan, base_event)
+        if line_valid:
+            events.append(event)
+    return events
+
+
+def upload_body(args) -> dict:
+    return {'custom': {}, 'dryrun': True, 'submit': True, 'timezone': '+00:00'}
+
+
+@benchmark
+def row_to_event(args, rows: list):
+    body = upload_body(args)
+    return lambda: convert(rows, body)
+
+
+def pipeline_patches(args) -> ExitStack:
+    """
+    Patches the destination pipeline to fakeredis or the given Redis server, and disables the authentication
+    """
+    stack = ExitStack()
+    host, _, port = args.redis.partition(':')
+    config = CONFIG | {'intelmq': CONFIG['intelmq'] | {'destination_pipeline_host': host,
+                                                       'destination_pipeline_port': int(port or 6379)}}
+    if fakeredis is not None:
+        server = fakeredis.FakeServer()
+        stack.enter_context(mock.patch('intelmq.lib.pipeline.redis.Redis',
+                                       new=lambda db=0, **kwargs: FakeRedis(server=server, db=db)))
+    stack.enter_context(mock.patch('webinput_session.session.skip_authentication', new=True))
+    stack.enter_context(mock.patch('intelmq_webinput_csv.serve.session.session_store'))
+    stack.enter_context(mock.patch('webinput_session.session.skip_verify_user', new=True))
+    stack.enter_context(mock.patch('intelmq_webinput_csv.serve.CONFIG', new=config))
+    stack.enter_context(mock.patch('intelmq_webinput_csv.serve.destination_pipeline_pool',
+                                   new=Pool(intelmq_webinput_csv.serve.create_destination_pipeline)))
+    return stack
+
+
+@benchmark
+def upload(args, rows: list):
+    body = upload_body(args) | {'data': rows}
+
+    def run_upload():
+        with pipeline_patches(args):
+            result = test.call('POST', intelmq_webinput_csv.serve, '/api/upload', body=body)
+        if result.status != '200 OK':
+            raise RuntimeError(f'Upload failed: {result.status} {result.data}')
+    return run_upload
+
+
+@benchmark
+def upload_csv(args, rows: list):
+    data = to_csv(rows, args.width)
+    headers = {'content-type': 'text/csv',
+               'X-Webinput-Parameters': json.dumps(upload_body(args) | {'columns': columns(args.width)})}
+
+    def run_upload():
+        with pipeline_patches(args):
+            result = test.call('POST', intelmq_webinput_csv.serve, '/api/upload/csv', body=data, headers=headers)
+        if result.status != '200 OK':
+            raise RuntimeError(f'Upload failed: {result.status} {result.data}')
+    return run_upload
+
+
+@benchmark
+def bot_chain(args, rows: list):
+    events = convert(rows, upload_body(args))
+    bots = intelmq_webinput_csv.serve.create_bot_chain(BOTS_CONFIG['bots'], intelmq_webinput_csv.serve.BOT_UPLOAD_SETTINGS)
+
+    def process():
+        for start in range(0, len(events), args.batch_size):
+            bots.process_batch([event.copy() for event in events[start:start + args.batch_size]])
+    return process
+
+
+@benchmark
+def sql_output(args, rows: list):
+    if connect is None:
+        return 'psycopg2 is not installed'
+    events = convert(rows, upload_body(args))
+    if args.postgres:
+        connection = connect(args.postgres)
+        fields = sorted({key for event in events for key in event.to_dict(jsondict_as_string=True)})
+        with connection.cursor() as cur:
+            cur.execute('CREATE TEMPORARY TABLE webinput_benchmark_events ({})'.format(
+                ', '.join(f'"{field}" {"json" if field == "extra" else "text"}' for field in fields)))
+        connection.commit()
+    else:
+        connection = NullConnection()
+    settings = BotLibSettings | {'engine': 'postgresql', 'table': 'webinput_benchmark_events'}
+    bot = WebinputSQLOutputBot('sql-benchmark', settings=settings, connection=connection)
+
+    def insert():
+        bot.bind(connection)
+        for start in range(0, len(events), args.batch_size):
+            bot.process_batch(events[start:start + args.batch_size])
+        connection.rollback()
+    return insert
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return run(['git', 'rev-parse', 'HEAD'], capture_output=True, check=True, text=True).stdout.strip()
+    except Exception:
+        return None
+
+
+def time_benchmark(function: Callable, repeat: int, rows: int) -> dict:
+    runs = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        runs.append(time.perf_counter() - start)
+    return {'runs': runs,
+            'min': min(runs),
+            'median': statistics.median(runs),
+            'rows': rows,
+            'rows_per_second': rows / min(runs) if min(runs) else None,
+            }
+
+
+def compare(results: dict, previous: dict):
+    """
+    Prints the change of the minimal times relative to the previous results
+    """
+    for name, result in results['results'].items():
+        before = previous.get('results', {}).get(name, {}).get('min')
+        if before and 'min' in result:
+            print(f'{name}: {before:.4f}s -> {result["min"]:.4f}s ({(result["min"] / before - 1) * 100:+.1f}%)', file=sys.stderr)
+
+
+def main(argv: Optional[list] = None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.run', description=__doc__.split('\n\n')[1])
+    parser.add_argument('--rows', type=int, default=1000, help='number of rows of the upload, default: 1000')
+    parser.add_argument('--width', type=int, default=6, help='number of columns of the upload, default: 6')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='share of rows with an invalid value, default: 0')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the data generator, default: 0')
+    parser.add_argument('--repeat', type=int, default=5, help='number of runs per benchmark, default: 5')
+    parser.add_argument('--batch-size', type=int, default=100, help='number of events per batch of the bots, default: 100')
+    parser.add_argument('--redis', default='localhost:6379', help='Redis server of the pipeline if fakeredis is not installed')
+    parser.add_argument('--postgres', help='libpq connection string of a database for the SQL output bot')
+    parser.add_argument('--output', help='file to write the results to, default: standard output')
+    parser.add_argument('--compare', help='file with previous results to compare with')
+    parser.add_argument('benchmarks', nargs='*', metavar='BENCHMARK',
+                        help=f'the benchmarks to run, default: all ({", ".join(BENCHMARKS)})')
+    args = parser.parse_args(argv)
+    for name in args.benchmarks:
+        if name not in BENCHMARKS:
+            parser.error(f'unknown benchmark {name!r}')
+
+    rows = list(generate_rows(args.rows, args.width, args.error_rate, args.seed))
+    results = {
+        'parameters': {key: value for key, value in vars(args).items() if key not in ('output', 'compare', 'postgres')},
+        'environment': {
+            'date': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'intelmq': intelmq_version,
+            'intelmq_webinput_csv': __version__,
+            'revision': git_revision(),
+            'pipeline': 'fakeredis' if fakeredis is not None else 'redis',
+            'database': 'postgresql' if args.postgres else 'stand-in',
+        },
+        'results': {},
+    }
+    for name in args.benchmarks or BENCHMARKS:
+        function = BENCHMARKS[name](args, rows)
+        if isinstance(function, str):
+            results['results'][name] = {'skipped': function}
+            continue
+        results['results'][name] = time_benchmark(function, args.repeat, args.rows)
+
+    output = json.dumps(results, indent=4)
+    if args.output:
+        with open(args.output, 'w') as handle:
+            handle.write(output + '\n')
+    else:
+        print(output)
+    if args.compare:
+        with open(args.compare) as handle:
+            compare(results, json.load(handle))
+
+
+if __name__ == '__main__':
+    main()
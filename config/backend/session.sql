@@ -4,13 +4,14 @@
 -- SPDX-License-Identifier: AGPL-3.0-or-later
 
 CREATE TABLE version (version INTEGER);
-INSERT INTO version (version) VALUES (1);
+INSERT INTO version (version) VALUES (2);
 
 CREATE TABLE session (
     session_id TEXT PRIMARY KEY,
-    modified TIMESTAMP,
+    expires INTEGER NOT NULL,
     data BLOB
 );
+CREATE INDEX session_expires ON session (expires);
 
 CREATE TABLE user(
     username TEXT PRIMARY KEY,
@@ -0,0 +1,243 @@
+"""
+SPDX-FileCopyrightText: 2026 Bundesamt für Sicherheit in der Informationstechnik
+SPDX-License-Identifier: AGPL-3.0-or-later
+Software engineering by Intevation GmbH <https://intevation.de>
+
+Reuse of the configured IntelMQ bots across requests
+
+Initializing bots can be expensive, e.g. compiling templates or loading lookup
+data. The bot chains are therefore created once and kept in pools. A chain is
+used by one request at a time, as the bots keep state while processing.
+"""
+import json
+import logging
+import threading
+import time
+import traceback
+from contextlib import contextmanager
+from itertools import chain
+from typing import Callable, Optional
+
+from intelmq.lib.datatypes import BotType
+
+from intelmq_webinput_csv.metrics import StageTimer
+from intelmq_webinput_csv.pool import Pool
+
+log = logging.getLogger(__name__)
+
+
+class BatchResult:
+    """
+    Result of the bot chain for one input event
+
+    outputs are the resulting events, tracebacks the errors raised by the bots.
+    If a bot raised errors for all events of this input and produced none,
+    failed_bot is the ID of this bot and the chain stopped there.
+    """
+    __slots__ = ('outputs', 'tracebacks', 'failed_bot')
+
+    def __init__(self, event):
+        self.outputs = [event]
+        self.tracebacks = []
+        self.failed_bot = None
+
+
+def clear_outputs(bot):
+    """
+    Drops the messages the bot sent before raising an error.
+    process_message only clears the destination queues if the bot did not raise,
+    otherwise the next call, possibly of another request, would return them.
+    """
+    pipeline = getattr(bot, '_Bot__destination_pipeline', None)
+    if pipeline is not None:
+        # in library mode, the source queues are in the same state, the failed message is still to be acknowledged
+        for queue in set(chain.from_iterable(pipeline.destination_queues.values())):
+            pipeline.clear_queue(queue)
+
+
+def process_stage(bot, messages: list) -> list:
+    """
+    Processes the messages with one bot.
+    Returns a list of (output messages, traceback) tuples, one per message,
+    the traceback is None if the bot did not raise an error.
+
+    If the bot has a method process_batch, it is called with all messages and
+    must return a list of output messages per input message. If it raises,
+    the messages are processed one by one to find the failing ones.
+    Otherwise, process_message is called for every message.
+    """
+    if messages and hasattr(bot, 'process_batch'):
+        try:
+            return [(outputs, None) for outputs in bot.process_batch(messages)]
+        except Exception:
+            # the messages queued by the failed batch would be returned by the first process_message
+            clear_outputs(bot)
+    results = []
+    for message in messages:
+        try:
+            queues = bot.process_message(message)
+        except Exception:
+            results.append(([], traceback.format_exc()))
+            clear_outputs(bot)
+        else:
+            results.append((queues.get('output', []), None))
+    return results
+
+
+class BotChain:
+    """
+    The instances of the configured bots, in the configured order
+
+    init_log contains the log output of the bots' initialization.
+    """
+
+    def __init__(self, bots: list, init_log: str = ''):
+        # list of (bot id, bot instance) tuples
+        self.bots = bots
+        self.init_log = init_log
+        # the pool the chain belongs to
+        self.pool = None
+
+    def bind(self, connection: Optional['psycopg2.extensions.connection']):  # noqa: F821
+        """
+        Binds the database connection of the current request to all bots using one
+        """
+        for _, bot in self.bots:
+            if hasattr(bot, 'bind'):
+                bot.bind(connection)
+
+    def process_batch(self, events: list, timer: Optional[StageTimer] = None) -> list:
+        """
+        Pushes the events through all bots, stage by stage.
+        Returns a BatchResult per event, in the same order.
+        If given, the time spent in each bot is added to the timer.
+
+        The outputs of output bots are their inputs.
+        """
+        results = [BatchResult(event) for event in events]
+        active = results
+        for bot_id, bot in self.bots:
+            start = time.perf_counter()
+            stage_results = iter(process_stage(bot, [message for result in active for message in result.outputs]))
+            if timer is not None:
+                timer.add(f'bot.{bot_id}', time.perf_counter() - start)
+            still_active = []
+            for result in active:
+                outputs = []
+                raised = False
+                for _ in range(len(result.outputs)):
+                    messages, error = next(stage_results)
+                    if error is None:
+                        outputs.extend(messages)
+                    else:
+                        raised = True
+                        result.tracebacks.append(error)
+                if bot.bottype is BotType.OUTPUT:
+                    # for output bots, the output queue is empty, don't consider it
+                    outputs = result.outputs
+                if not outputs and raised:
+                    result.outputs = []
+                    result.failed_bot = bot_id
+                    continue
+                result.outputs = outputs
+                still_active.append(result)
+            active = still_active
+        return results
+
+    def shutdown(self):
+        """
+        Shuts the bots down, when the chain is discarded by its pool
+        """
+        for bot_id, bot in self.bots:
+            try:
+                bot.shutdown()
+            except Exception:
+                log.exception('Shutting down bot %s failed', bot_id)
+
+    def __iter__(self):
+        return iter(self.bots)
+
+    def __len__(self):
+        return len(self.bots)
+
+
+class BotChainCache:
+    """
+    Pools of bot chains, keyed on the bots configuration and additional settings
+
+    If the bots configuration changes, the chains of the old configuration are discarded.
+    """
+
+    def __init__(self, size: int = 4, timeout: float = 30):
+        self.size = size
+        self.timeout = timeout
+        # key: (bots configuration key, pool)
+        self.pools = {}
+        self.lock = threading.Lock()
+
+    def get_pool(self, bots_config: dict, settings: dict, create: Callable[[], BotChain]) -> Pool:
+        config_key = json.dumps(bots_config, sort_keys=True, default=str)
+        key = json.dumps(settings, sort_keys=True, default=str) + config_key
+        with self.lock:
+            try:
+                return self.pools[key][1]
+            except KeyError:
+                pass
+            for old_key, (old_config_key, old_pool) in list(self.pools.items()):
+                if old_config_key != config_key:
+                    old_pool.close()
+                    del self.pools[old_key]
+            pool = Pool(create, size=self.size, timeout=self.timeout, close=BotChain.shutdown)
+            self.pools[key] = (config_key, pool)
+            return pool
+
+    def acquire(self, bots_config: dict, settings: dict, create: Callable[[], BotChain],
+                connection: Optional['psycopg2.extensions.connection'] = None) -> BotChain:  # noqa: F821
+        """
+        Lends out a bot chain for the configuration, created with create if none is available.
+        The connection is bound to the chain until it is released.
+        """
+        pool = self.get_pool(bots_config, settings, create)
+        bot_chain = pool.acquire()
+        # the chain goes back to this pool, even if the configuration changed in the meantime
+        bot_chain.pool = pool
+        bot_chain.bind(connection)
+        return bot_chain
+
+    def release(self, bot_chain: BotChain, suspect: bool = False):
+        bot_chain.bind(None)
+        bot_chain.pool.release(bot_chain, suspect=suspect)
+
+    @contextmanager
+    def lease(self, bots_config: dict, settings: dict, create: Callable[[], BotChain],
+              connection: Optional['psycopg2.extensions.connection'] = None):  # noqa: F821
+        """
+        Context manager for acquire and release
+        """
+        bot_chain = self.acquire(bots_config, settings, create, connection)
+        try:
+            yield bot_chain
+        except BaseException:
+            self.release(bot_chain, suspect=True)
+            raise
+        else:
+            self.release(bot_chain)
+
+    def stats(self) -> dict:
+        """
+        Returns the sums of the statistics of all pools
+        """
+        stats = {'pools': 0, 'size': 0, 'created': 0, 'idle': 0, 'in_use': 0}
+        with self.lock:
+            pools = [pool for _, pool in self.pools.values()]
+        for pool in pools:
+            stats['pools'] += 1
+            for key, value in pool.stats().items():
+                stats[key] += value
+        return stats
+
+    def clear(self):
+        with self.lock:
+            for _, pool in self.pools.values():
+                pool.close()
+            self.pools = {}
@@ -0,0 +1,58 @@
+"""
+SPDX-FileCopyrightText: 2026 Bundesamt für Sicherheit in der Informationstechnik
+SPDX-License-Identifier: AGPL-3.0-or-later
+Software engineering by Intevation GmbH <https://intevation.de>
+
+A small, thread-safe cache for results of expensive lookups, e.g. database queries
+"""
+import threading
+import time
+from typing import Any, Callable, Hashable, Optional
+
+
+class TTLCache:
+    """
+    Caches values for `duration` seconds.
+
+    Concurrent lookups of the same missing key compute the value only once.
+    Exceptions of the computation are not cached.
+    """
+
+    def __init__(self, duration: float = 300):
+        self.duration = duration
+        # key: (expiry time, value)
+        self.values = {}
+        self.lock = threading.Lock()
+        # key: lock held while the value is computed
+        self.computing = {}
+
+    def get(self, key: Hashable, compute: Callable[[], Any]) -> Any:
+        """
+        Returns the cached value for key, computing it with compute if missing or expired
+        """
+        try:
+            expires, value = self.values[key]
+        except KeyError:
+            pass
+        else:
+            if expires > time.monotonic():
+                return value
+        with self.lock:
+            key_lock = self.computing.setdefault(key, threading.Lock())
+        with key_lock:
+            # another thread may have computed the value in the meantime
+            cached = self.values.get(key)
+            if cached is not None and cached[0] > time.monotonic():
+                return cached[1]
+            value = compute()
+            self.values[key] = (time.monotonic() + self.duration, value)
+            return value
+
+    def invalidate(self, key: Optional[Hashable] = None):
+        """
+        Drops the value for key, or all values if key is None
+        """
+        if key is None:
+            self.values = {}
+        else:
+            self.values.pop(key, None)
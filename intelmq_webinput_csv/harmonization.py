@@ -0,0 +1,107 @@
+"""
+SPDX-FileCopyrightText: 2026 Bundesamt für Sicherheit in der Informationstechnik
+SPDX-License-Identifier: AGPL-3.0-or-later
+Software engineering by Intevation GmbH <https://intevation.de>
+
+Loading of the IntelMQ harmonization with a snapshot
+
+IntelMQ parses the harmonization configuration with a pure-Python YAML parser,
+which takes a noticeable part of the startup time of each backend process.
+The parsed harmonization and the harmonization filtered by the allowed event
+fields are stored as JSON snapshot, which is used as long as the modification
+time and size of the harmonization file and the allowed fields are unchanged.
+"""
+import json
+import logging
+import os
+from pathlib import Path
+from typing import Iterable, Optional, Set, Tuple
+
+from intelmq.lib.utils import load_configuration
+
+log = logging.getLogger(__name__)
+
+# increased if the format of the snapshot changes
+SNAPSHOT_VERSION = 1
+
+# snapshots which could not be written, the failure is logged only once per path
+unwritable_snapshots: Set[Path] = set()
+
+
+def filter_harmonization(harmonization: dict, allowed_fields: Optional[Iterable[str]]) -> dict:
+    """
+    Returns the harmonization of events restricted to the allowed fields, or the harmonization itself if all are allowed
+    """
+    if not allowed_fields:
+        return harmonization
+    return {'event': {key: value for key, value in harmonization['event'].items() if key in allowed_fields}}
+
+
+def snapshot_key(source: Path, allowed_fields: Optional[Iterable[str]]) -> dict:
+    stat = source.stat()
+    return {'version': SNAPSHOT_VERSION,
+            'source': str(source),
+            'mtime_ns': stat.st_mtime_ns,
+            'size': stat.st_size,
+            'allowed_event_fields': sorted(allowed_fields) if allowed_fields else None}
+
+
+def read_snapshot(path: Path, key: dict) -> Optional[dict]:
+    try:
+        with path.open(encoding='utf-8') as handle:
+            snapshot = json.load(handle)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(snapshot, dict) or snapshot.get('key') != key:
+        return None
+    return snapshot
+
+
+def write_snapshot(path: Path, snapshot: dict):
+    """
+    Writes the snapshot atomically, failures are only logged as the snapshot is optional
+    """
+    path = Path(path)
+    temporary = path.with_name(f'.{path.name}.{os.getpid()}')
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with temporary.open('w', encoding='utf-8') as handle:
+            json.dump(snapshot, handle)
+        os.replace(temporary, path)
+    except OSError as exc:
+        if path not in unwritable_snapshots:
+            unwritable_snapshots.add(path)
+            log.warning('Could not write the harmonization snapshot %s, the harmonization is parsed on every startup: %s', path, exc)
+        try:
+            temporary.unlink()
+        except OSError:
+            pass
+
+
+def load_harmonization(source: Path, allowed_fields: Optional[Iterable[str]] = None,
+                       snapshot_path: Optional[Path] = None) -> Tuple[dict, dict]:
+    """
+    Returns the harmonization and the harmonization of the allowed event fields
+
+    If snapshot_path is given, the snapshot is used if it is up to date, and written otherwise.
+    """
+    key = None
+    if snapshot_path is not None:
+        try:
+            key = snapshot_key(Path(source), allowed_fields)
+        except OSError:
+            # e.g. the harmonization is not a regular file, the snapshot can't be validated
+            pass
+        else:
+            snapshot = read_snapshot(Path(snapshot_path), key)
+            if snapshot is not None:
+                harmonization = snapshot['harmonization']
+                return harmonization, snapshot['event_harmonization'] or harmonization
+
+    harmonization = load_configuration(source)
+    event_harmonization = filter_harmonization(harmonization, allowed_fields)
+    if key is not None:
+        write_snapshot(Path(snapshot_path), {'key': key,
+                                             'harmonization': harmonization,
+                                             'event_harmonization': None if event_harmonization is harmonization else event_harmonization})
+    return harmonization, event_harmonization
@@ -0,0 +1,96 @@
+"""
+SPDX-FileCopyrightText: 2026 Bundesamt für Sicherheit in der Informationstechnik
+SPDX-License-Identifier: AGPL-3.0-or-later
+Software engineering by Intevation GmbH <https://intevation.de>
+
+Background jobs for long-running uploads
+
+The jobs are kept in memory of the backend process which started them.
+"""
+import logging
+import os
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional
+
+log = logging.getLogger(__name__)
+
+
+class Job:
+    """
+    State of one background job
+
+    The job function is called with the keyword argument `progress`, a dictionary
+    which the function can update while it runs. Its return value is the result of the job.
+    """
+
+    def __init__(self):
+        self.id = os.urandom(16).hex()
+        self.status = 'queued'
+        self.progress = {}
+        self.result = None
+        self.error = None
+        self.finished = None
+
+    def run(self, function: Callable, *args, **kwargs):
+        self.status = 'running'
+        try:
+            self.result = function(*args, progress=self.progress, **kwargs)
+        except Exception as exc:
+            log.exception('Job %s failed', self.id)
+            self.error = f'{exc!s}\n{traceback.format_exc()}'
+            self.status = 'failed'
+        else:
+            self.status = 'finished'
+        finally:
+            self.finished = time.monotonic()
+
+    def to_dict(self) -> dict:
+        retval = {'id': self.id,
+                  'status': self.status,
+                  'progress': dict(self.progress)}
+        if self.status == 'finished':
+            retval['result'] = self.result
+        elif self.status == 'failed':
+            retval['error'] = self.error
+        return retval
+
+
+class JobManager:
+    """
+    Runs jobs in a pool of worker threads and keeps their state
+    for `retention` seconds after they finished
+    """
+
+    def __init__(self, workers: int = 2, retention: int = 3600):
+        self.executor = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix='webinput-job')
+        self.retention = retention
+        self.jobs = {}
+        self.lock = threading.Lock()
+
+    def submit(self, function: Callable, *args, **kwargs) -> Job:
+        job = Job()
+        with self.lock:
+            self.expire()
+            self.jobs[job.id] = job
+        self.executor.submit(job.run, function, *args, **kwargs)
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self.lock:
+            self.expire()
+            return self.jobs.get(job_id)
+
+    def expire(self):
+        """
+        Forgets finished jobs after the retention time. Must be called with the lock held.
+        """
+        now = time.monotonic()
+        for job_id in [job_id for job_id, job in self.jobs.items()
+                       if job.finished is not None and now - job.finished > self.retention]:
+            del self.jobs[job_id]
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False)
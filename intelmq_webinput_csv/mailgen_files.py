@@ -0,0 +1,128 @@
+"""
+SPDX-FileCopyrightText: 2026 Bundesamt für Sicherheit in der Informationstechnik
+SPDX-License-Identifier: AGPL-3.0-or-later
+Software engineering by Intevation GmbH <https://intevation.de>
+
+Cache of the mailgen configuration and templates
+
+The files are read again only if their modification time, size or inode changed.
+"""
+import hashlib
+import json
+import os
+import threading
+from pathlib import Path
+from typing import Callable, Optional, Tuple
+
+# the files read by intelmqmail.cb.read_configuration
+DEFAULT_MAILGEN_CONFIG_FILE = '/etc/intelmq/intelmq-mailgen.conf'
+USER_MAILGEN_CONFIG_FILE = '~/.intelmq/intelmq-mailgen.conf'
+
+
+def file_signature(path: str) -> Optional[Tuple[int, int, int]]:
+    """
+    Returns modification time, size and inode of the file, None if it does not exist
+    """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+
+
+class TemplateDirectory:
+    """
+    The templates of one directory, with their signatures and an ETag of all templates
+    """
+
+    def __init__(self):
+        # key: template name, value: (signature, content)
+        self.templates = {}
+        self.etag = None
+
+    def update_etag(self):
+        digest = hashlib.sha256(json.dumps(sorted((name, content) for name, (_, content) in self.templates.items())).encode())
+        self.etag = f'"{digest.hexdigest()[:32]}"'
+
+
+class MailgenFiles:
+    """
+    Caches the mailgen configuration and the contents of the template directories.
+
+    The returned configuration is shared and must not be modified.
+    """
+
+    def __init__(self, read: Optional[Callable[[Optional[str]], dict]] = None):
+        self.read = read
+        self.lock = threading.Lock()
+        # key: configuration file path, value: (signatures, configuration)
+        self.configs = {}
+        # key: template directory, value: TemplateDirectory
+        self.directories = {}
+
+    def config(self, conf_file_path: Optional[str] = None) -> dict:
+        """
+        Returns the mailgen configuration like intelmqmail.cb.read_configuration
+        """
+        signatures = (file_signature(os.path.expanduser(conf_file_path or DEFAULT_MAILGEN_CONFIG_FILE)),
+                      file_signature(os.path.expanduser(USER_MAILGEN_CONFIG_FILE)))
+        cached = self.configs.get(conf_file_path)
+        if cached is not None and cached[0] == signatures:
+            return cached[1]
+        if self.read is not None:
+            config = self.read(conf_file_path)
+        else:
+            # imported on first use, like in serve
+            from intelmqmail.cb import read_configuration
+            config = read_configuration(conf_file_path)
+        self.configs[conf_file_path] = (signatures, config)
+        return config
+
+    def templates(self, template_dir: Path) -> Tuple[dict, str]:
+        """
+        Returns the templates in the directory by name, and their ETag
+        Only new and changed templates are read.
+        """
+        with self.lock:
+            directory = self.directories.setdefault(str(template_dir), TemplateDirectory())
+            changed = False
+            seen = set()
+            with os.scandir(template_dir) as entries:
+                for entry in entries:
+                    # all files, like Path.glob('*') before, including hidden ones
+                    if not entry.is_file():
+                        continue
+                    seen.add(entry.name)
+                    signature = file_signature(entry.path)
+                    cached = directory.templates.get(entry.name)
+                    if cached is None or cached[0] != signature:
+                        directory.templates[entry.name] = (signature, Path(entry.path).read_text())
+                        changed = True
+            for name in directory.templates.keys() - seen:
+                del directory.templates[name]
+                changed = True
+            if changed or directory.etag is None:
+                directory.update_etag()
+            return {name: content for name, (_, content) in directory.templates.items()}, directory.etag
+
+    def write_template(self, template_dir: Path, name: str, body: str):
+        """
+        Writes the template and updates the cache
+        """
+        path = template_dir / name
+        path.write_text(body, encoding='utf8')
+        with self.lock:
+            directory = self.directories.get(str(template_dir))
+            if directory is not None:
+                directory.templates[name] = (file_signature(str(path)), body)
+                directory.update_etag()
+
+    def delete_template(self, template_dir: Path, name: str):
+        """
+        Deletes the template and updates the cache
+        """
+        (template_dir / name).unlink()
+        with self.lock:
+            directory = self.directories.get(str(template_dir))
+            if directory is not None and directory.templates.pop(name, None) is not None:
+                directory.update_etag()
@@ -0,0 +1,208 @@
+"""
+SPDX-FileCopyrightText: 2026 Bundesamt für Sicherheit in der Informationstechnik
+SPDX-License-Identifier: AGPL-3.0-or-later
+Software engineering by Intevation GmbH <https://intevation.de>
+
+Timing instrumentation and metrics in the Prometheus text format
+
+The durations of the stages of a request are collected by a StageTimer and
+observed once per request, when it is finished. They are also available as
+Server-Timing header. Values only known when the metrics are requested, like
+the usage of the pools, are provided by collectors.
+"""
+import re
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, Optional, Tuple
+
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+# characters not allowed in the names of Server-Timing metrics
+SERVER_TIMING_INVALID_RE = re.compile(r"[^!#$%&'*+\-.^_`|~0-9A-Za-z]")
+
+
+def escape_label_value(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def format_labels(labels: Iterable[Tuple[str, str]]) -> str:
+    labels = ','.join(f'{name}="{escape_label_value(value)}"' for name, value in labels)
+    return f'{{{labels}}}' if labels else ''
+
+
+def format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    """
+    A metric with values per combination of label values
+    """
+    kind = 'untyped'
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.lock = threading.Lock()
+        # key: tuple of label values
+        self.values = {}
+
+    def label_values(self, labels: dict) -> tuple:
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def header(self) -> list:
+        return [f'# HELP {self.name} {self.documentation}',
+                f'# TYPE {self.name} {self.kind}']
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount: float = 1, **labels):
+        key = self.label_values(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def render(self, const_labels: Tuple[Tuple[str, str], ...] = ()) -> list:
+        lines = self.header()
+        with self.lock:
+            values = list(self.values.items())
+        for key, value in values:
+            lines.append(f'{self.name}{format_labels(const_labels + tuple(zip(self.labelnames, key)))} {format_value(value)}')
+        return lines
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self.label_values(labels)
+        with self.lock:
+            try:
+                counts, total = self.values[key]
+            except KeyError:
+                counts, total = [0] * (len(self.buckets) + 1), 0.0
+            # the last count is for the +Inf bucket
+            counts[bisect_left(self.buckets, value)] += 1
+            self.values[key] = (counts, total + value)
+
+    def render(self, const_labels: Tuple[Tuple[str, str], ...] = ()) -> list:
+        lines = self.header()
+        with self.lock:
+            values = [(key, list(counts), total) for key, (counts, total) in self.values.items()]
+        for key, counts, total in values:
+            labels = list(const_labels) + list(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'), ), counts):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{format_labels(labels + [("le", format_value(float(bound)))])} {cumulative}')
+            lines.append(f'{self.name}_sum{format_labels(labels)} {format_value(total)}')
+            lines.append(f'{self.name}_count{format_labels(labels)} {cumulative}')
+        return lines
+
+
+class Registry:
+    """
+    The metrics and collectors of the application
+
+    A collector returns a list of (name, documentation, kind, samples) tuples,
+    with samples being a list of (labels dictionary, value) tuples.
+    const_labels are added to all samples, e.g. to tell the processes of a server apart.
+    """
+
+    def __init__(self):
+        self.metrics = []
+        self.collectors = []
+
+    def register(self, metric: Metric) -> Metric:
+        self.metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector: Callable[[], list]):
+        self.collectors.append(collector)
+
+    def render(self, const_labels: Optional[dict] = None) -> str:
+        const_labels = tuple((const_labels or {}).items())
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render(const_labels))
+        for collector in self.collectors:
+            for name, documentation, kind, samples in collector():
+                lines.append(f'# HELP {name} {documentation}')
+                lines.append(f'# TYPE {name} {kind}')
+                for labels, value in samples:
+                    lines.append(f'{name}{format_labels(const_labels + tuple(labels.items()))} {format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+STAGE_DURATION = REGISTRY.register(Histogram('webinput_stage_duration_seconds',
+                                             'Time spent per request in the stages of the endpoints',
+                                             ('endpoint', 'stage')))
+BOT_DURATION = REGISTRY.register(Histogram('webinput_bot_duration_seconds',
+                                           'Time spent per request in the configured bots',
+                                           ('endpoint', 'bot')))
+ROWS = REGISTRY.register(Counter('webinput_rows_total',
+                                 'Number of processed input rows',
+                                 ('endpoint', 'status')))
+EVENTS = REGISTRY.register(Counter('webinput_events_total',
+                                   'Number of output events, and of events submitted to the pipeline',
+                                   ('endpoint', 'status')))
+
+
+class StageTimer:
+    """
+    Collects the time spent in the stages of one request
+
+    The durations of a stage are summed up. finish observes them in the histograms,
+    stages named bot.<bot id> in the one of the bots.
+    """
+
+    def __init__(self, endpoint: str, start: Optional[float] = None):
+        self.endpoint = endpoint
+        self.start = time.perf_counter() if start is None else start
+        # key: stage, value: seconds, in the order of the first occurrence
+        self.durations: Dict[str, float] = {}
+        self.finished = False
+
+    def add(self, stage: str, seconds: float):
+        self.durations[stage] = self.durations.get(stage, 0.0) + seconds
+
+    @contextmanager
+    def measure(self, stage: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(stage, time.perf_counter() - start)
+
+    def finish(self):
+        """
+        Observes the durations and the total time since the start, only once
+        """
+        if self.finished:
+            return
+        self.finished = True
+        self.durations['total'] = time.perf_counter() - self.start
+        for stage, seconds in self.durations.items():
+            if stage.startswith('bot.'):
+                BOT_DURATION.observe(seconds, endpoint=self.endpoint, bot=stage[4:])
+            else:
+                STAGE_DURATION.observe(seconds, endpoint=self.endpoint, stage=stage)
+
+    def server_timing(self) -> str:
+        """
+        Returns the durations as value of a Server-Timing header
+        """
+        return ', '.join(f'{SERVER_TIMING_INVALID_RE.sub("_", stage)};dur={seconds * 1000:.3f}'
+                         for stage, seconds in self.durations.items())
@@ -0,0 +1,152 @@
+"""
+SPDX-FileCopyrightText: 2026 Bundesamt für Sicherheit in der Informationstechnik
+SPDX-License-Identifier: AGPL-3.0-or-later
+Software engineering by Intevation GmbH <https://intevation.de>
+
+A small, thread-safe pool for expensive resources like pipeline or database connections
+"""
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Optional
+
+
+class PoolTimeout(Exception):
+    """
+    Raised if no resource became available in time
+    """
+
+
+class Pool:
+    """
+    Lends out reusable resources, at most `size` at the same time.
+
+    Resources are created lazily with `create`. When a resource is checked out
+    after being idle for more than `check_interval` seconds, or after the previous
+    borrower raised an exception, `check` is called first. If it returns False or
+    raises, the resource is closed with `close` and replaced by a new one.
+    If all resources are in use, the checkout waits up to `timeout` seconds
+    before raising PoolTimeout.
+    """
+
+    def __init__(self, create: Callable[[], Any], size: int = 4,
+                 check: Optional[Callable[[Any], bool]] = None,
+                 close: Optional[Callable[[Any], None]] = None,
+                 check_interval: float = 10, timeout: float = 30):
+        self.create = create
+        self.size = max(1, size)
+        self.check = check
+        self.close_resource = close
+        self.check_interval = check_interval
+        self.timeout = timeout
+        self.created = 0
+        # stack of (resource, time of last use, needs check) tuples, the most recently used resource is reused first
+        self.idle = []
+        self.condition = threading.Condition()
+
+    def acquire(self) -> Any:
+        deadline = time.monotonic() + self.timeout
+        with self.condition:
+            while not self.idle and self.created >= self.size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise PoolTimeout(f'All {self.size} resources of the pool are in use.')
+                self.condition.wait(remaining)
+            if self.idle:
+                resource, last_used, suspect = self.idle.pop()
+            else:
+                resource = None
+                self.created += 1
+
+        if resource is not None:
+            if not (suspect or time.monotonic() - last_used > self.check_interval) or self.is_healthy(resource):
+                return resource
+            self.discard(resource, release_slot=False)
+        try:
+            return self.create()
+        except BaseException:
+            with self.condition:
+                self.created -= 1
+                self.condition.notify()
+            raise
+
+    def release(self, resource: Any, suspect: bool = False):
+        """
+        Returns a resource to the pool.
+        If suspect is true, the resource is checked before it is lent out again.
+        """
+        with self.condition:
+            self.idle.append((resource, time.monotonic(), suspect))
+            self.condition.notify()
+
+    def discard(self, resource: Any, release_slot: bool = True):
+        """
+        Closes a resource instead of returning it to the pool
+        """
+        if self.close_resource:
+            try:
+                self.close_resource(resource)
+            except Exception:
+                pass
+        if release_slot:
+            with self.condition:
+                self.created -= 1
+                self.condition.notify()
+
+    def is_healthy(self, resource: Any) -> bool:
+        if self.check is None:
+            return True
+        try:
+            return bool(self.check(resource))
+        except Exception:
+            return False
+
+    @contextmanager
+    def lease(self):
+        """
+        Context manager lending out a resource for the duration of the block
+        """
+        resource = self.acquire()
+        try:
+            yield resource
+        except BaseException:
+            self.release(resource, suspect=True)
+            raise
+        else:
+            self.release(resource)
+
+    def close(self):
+        """
+        Closes all idle resources. Resources currently lent out are not affected.
+        """
+        with self.condition:
+            idle, self.idle = self.idle, []
+            self.created -= len(idle)
+        for resource, _, _ in idle:
+            self.discard(resource, release_slot=False)
+
+    def stats(self) -> dict:
+        with self.condition:
+            return {'size': self.size,
+                    'created': self.created,
+                    'idle': len(self.idle),
+                    'in_use': self.created - len(self.idle)}
+
+
+class UnclosableConnection:
+    """
+    Proxy for a pooled database connection, given to code which closes the connection when done.
+    close() only rolls back the transaction, the connection stays open for the pool.
+    """
+
+    def __init__(self, connection):
+        object.__setattr__(self, '_connection', connection)
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._connection, name)
+
+    def __setattr__(self, name: str, value: Any):
+        setattr(self._connection, name, value)
+
+    def close(self):
+        self._connection.rollback()
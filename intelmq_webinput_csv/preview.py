@@ -0,0 +1,251 @@
+"""
+SPDX-FileCopyrightText: 2026 Bundesamt für Sicherheit in der Informationstechnik
+SPDX-License-Identifier: AGPL-3.0-or-later
+Software engineering by Intevation GmbH <https://intevation.de>
+
+Rendering of mailgen previews without the database
+
+Mailgen loads the events and directives from the database. For a preview, the
+example event would have to be inserted, processed and rolled back again. Instead,
+the mailgen scripts are run here with a ScriptContext serving the example event and
+its directives from memory. Ticket numbers are placeholders, as no number is drawn.
+If a script uses the database in any other way, the preview is not rendered and
+the caller has to fall back to the database.
+"""
+import datetime
+import glob
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+from typing import Callable, Hashable, Optional
+
+import dateutil.parser
+from intelmq.lib.message import Event
+
+from intelmq_webinput_csv.mailgen_files import file_signature
+
+try:
+    import gpg
+    from intelmqmail.cb import load_script_entry_points
+    from intelmqmail.notification import Directive, ScriptContext, Postponed
+    from intelmqmail.templates import Template
+except ImportError:
+    gpg = load_script_entry_points = Directive = Postponed = Template = None
+    ScriptContext = object
+
+log = logging.getLogger('intelmqmail.preview')
+
+
+class DatabaseRequired(Exception):
+    """
+    A mailgen script accessed the database while rendering a preview in memory
+    """
+
+
+class PreparedEvent:
+    """
+    The example event of a preview, prepared for the database and for rendering in memory
+
+    values are the columns for an INSERT into the events table, row is the event
+    like intelmqmail.db.load_events returns it and directives the aggregated
+    directives like intelmqmail.db.get_pending_notifications returns them.
+    """
+    __slots__ = ('values', 'row', 'directives')
+
+    def __init__(self, event: Event):
+        # this converts extra-keys to a single dict, so the INSERT works
+        self.values = event.to_dict(jsondict_as_string=True)
+        self.row = dict(self.values)
+        if 'extra' in self.row:
+            self.row['extra'] = json.loads(self.row['extra'])
+        for key, value in self.row.items():
+            if key.startswith('time.'):
+                self.row[key] = dateutil.parser.isoparse(value)
+        self.directives = directives_from_row(self.row)
+
+
+def aggregate_value(value) -> Optional[str]:
+    """
+    Converts a value of an aggregate identifier to text, as the database does
+    """
+    if value is None or isinstance(value, str):
+        return value
+    return json.dumps(value)
+
+
+def directives_from_row(row: dict) -> list:
+    """
+    Returns the pending email directives of the event, aggregated as in the database
+
+    This mirrors the directives inserted by the intelmq-certbund-contact output bot and the
+    PENDING_DIRECTIVES_QUERY of intelmqmail.db, and has to follow changes there.
+    event_ids, directive_ids and inserted_at are placeholders, as nothing is inserted.
+    tests/test_mailgen.py compares the result with the preview rendered with the database.
+    """
+    directives = OrderedDict()
+    inserted_at = datetime.datetime.now(datetime.timezone.utc)
+    certbund = row.get('extra', {}).get('certbund', {})
+    for index, directive in enumerate(certbund.get('source_directives', [])):
+        if directive.get('medium') != 'email':
+            continue
+        aggregate_identifier = {key: aggregate_value(value) for key, value in (directive.get('aggregate_identifier') or {}).items()}
+        key = (directive.get('recipient_address'), directive.get('template_name'), directive.get('notification_format'),
+               directive.get('event_data_format'), json.dumps(aggregate_identifier, sort_keys=True))
+        interval = datetime.timedelta(seconds=directive.get('notification_interval') or 0)
+        aggregated = directives.setdefault(key, {
+            'recipient_address': key[0],
+            'template_name': key[1],
+            'notification_format': key[2],
+            'event_data_format': key[3],
+            'aggregate_identifier': aggregate_identifier,
+            'event_ids': [0],
+            'directive_ids': [],
+            'inserted_at': inserted_at,
+            'notification_interval': interval,
+            'last_sent': None,
+        })
+        aggregated['directive_ids'].append(index)
+        aggregated['notification_interval'] = max(aggregated['notification_interval'], interval)
+    return list(directives.values())
+
+
+def template_from_string(template: str) -> 'Template':
+    """
+    Converts a template string to a Template like intelmqmail.cb.mailgen
+    """
+    template = template.strip()
+    subject = template[:template.find('\n')]  # first line
+    body = template[template.find('\n') + 1:] + '\n'  # rest plus trailing newline
+    return Template.from_strings(subject, body)
+
+
+class PreviewScriptContext(ScriptContext):
+    """
+    ScriptContext for one event in memory
+
+    Loading the event and drawing a ticket number are answered without the database.
+    Any other access of the database cursor raises DatabaseRequired and sets database_required,
+    also if the script catches the exception.
+    """
+
+    def __init__(self, config, gpgme_ctx, directive, logger, row: dict, **kwargs):
+        self.database_required = False
+        super().__init__(config, None, gpgme_ctx, directive, logger, **kwargs)
+        self.row = row
+
+    @property
+    def db_cursor(self):
+        self.database_required = True
+        raise DatabaseRequired('The preview needs the database.')
+
+    @db_cursor.setter
+    def db_cursor(self, value):
+        pass
+
+    def new_ticket_number(self):
+        # same format as intelmqmail.db.new_ticket_number
+        return f'{self.now:%Y%m%d}-00000000'
+
+    def load_events(self, columns=None):
+        if columns is None:
+            return [dict(self.row)]
+        return [{column: self.row.get(column) for column in columns}]
+
+
+class PreviewRenderer:
+    """
+    Renders mailgen previews in memory
+
+    The prepared example events and format specifications are cached for up to
+    cache_size different inputs each, the scripts until they change.
+    """
+
+    def __init__(self, cache_size: int = 32):
+        self.cache_size = cache_size
+        self.lock = threading.Lock()
+        # key: input, value: PreparedEvent or TableFormat, least recently used first
+        self.events = OrderedDict()
+        self.format_specs = OrderedDict()
+        # key: script directory, value: (signatures, scripts)
+        self.scripts = {}
+
+    def _cached(self, cache: OrderedDict, key: Hashable, compute: Callable):
+        with self.lock:
+            try:
+                cache.move_to_end(key)
+                return cache[key]
+            except KeyError:
+                pass
+        value = compute()
+        with self.lock:
+            cache[key] = value
+            while len(cache) > self.cache_size:
+                cache.popitem(last=False)
+        return value
+
+    def prepared_event(self, key: Hashable, create_event: Callable[[], Event]) -> PreparedEvent:
+        """
+        Returns the prepared example event for the key, created with create_event if missing
+        """
+        return self._cached(self.events, key, lambda: PreparedEvent(create_event()))
+
+    def format_spec(self, key: Hashable, build: Callable):
+        """
+        Returns the format specification for the key, built with build if missing
+        """
+        return self._cached(self.format_specs, key, build)
+
+    def load_scripts(self, config: dict) -> list:
+        """
+        Returns the mailgen scripts, loaded again only if a script file changed
+        """
+        script_directory = config['script_directory']
+        signatures = tuple((filename, file_signature(filename))
+                           for filename in sorted(glob.glob(os.path.join(glob.escape(script_directory), '[0-9][0-9]*.py'))))
+        cached = self.scripts.get(script_directory)
+        if cached is not None and cached[0] == signatures:
+            return cached[1]
+        scripts = load_script_entry_points(config)
+        self.scripts[script_directory] = (signatures, scripts)
+        return scripts
+
+    def render(self, config: dict, prepared: PreparedEvent, template: Optional[str], format_spec=None) -> Optional[str]:
+        """
+        Returns the first notification for the prepared event as string.
+        Returns None if the preview cannot be rendered in memory, then the database is required.
+        """
+        if Directive is None or not prepared.directives:
+            return None
+        if "openpgp" not in config or {"always_sign", "gnupg_home", "signing_key"} != config["openpgp"].keys():
+            # mailgen exits, let it report this
+            return None
+        scripts = self.load_scripts(config)
+        if not scripts:
+            return None
+        gpgme_ctx = None
+        if config["openpgp"]["always_sign"]:
+            gpgme_ctx = gpg.Context(home_dir=config["openpgp"]["gnupg_home"])
+            gpgme_ctx.signers = [gpgme_ctx.get_key(config["openpgp"]["signing_key"])]
+
+        # like the preview with the database, only the first directive is rendered. The database returns
+        # the aggregated directives in no particular order, the example event usually has only one.
+        context = PreviewScriptContext(config, gpgme_ctx, Directive(**prepared.directives[0]), log, prepared.row,
+                                       template=template_from_string(template) if template else None,
+                                       default_format_spec=format_spec)
+        for script in scripts:
+            try:
+                notifications = script(context)
+            except Exception:
+                if context.database_required:
+                    return None
+                log.exception("Error while running entry point of script %r", script.filename)
+                continue
+            if context.database_required:
+                return None
+            if notifications is Postponed:
+                return None
+            if notifications:
+                return str(notifications[0].email)
+        return None
@@ -0,0 +1,83 @@
+"""
+SPDX-FileCopyrightText: 2026 Bundesamt für Sicherheit in der Informationstechnik
+SPDX-License-Identifier: AGPL-3.0-or-later
+Software engineering by Intevation GmbH <https://intevation.de>
+
+Profiling of single requests on demand
+
+The profile of a request is stored in the configured directory as
+<profile id>.prof, readable with pstats or e.g. snakeviz, and a summary as
+<profile id>.txt with the functions with the highest cumulative time and,
+if requested, the lines with the largest memory allocations.
+"""
+import cProfile
+import datetime
+import io
+import logging
+import os
+import pstats
+import threading
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Any, Callable, Tuple
+
+log = logging.getLogger(__name__)
+
+
+class Profiler:
+    """
+    Runs functions under cProfile and optionally tracemalloc
+
+    Only one function is profiled at a time per process, as tracemalloc
+    traces all threads and only one profiler can be active.
+    """
+
+    def __init__(self, directory: str, top: int = 50):
+        self.directory = Path(directory)
+        self.top = top
+        self.lock = threading.Lock()
+
+    def new_id(self, label: str) -> str:
+        return f'{datetime.datetime.now():%Y%m%dT%H%M%S}-{label}-{os.urandom(4).hex()}'
+
+    def call(self, label: str, function: Callable, *args, memory: bool = False, **kwargs) -> Tuple[Any, str]:
+        """
+        Calls the function with the arguments, returns its result and the id of the stored profile
+        The profile is also stored if the function raises an exception.
+        """
+        profile_id = self.new_id(label)
+        with self.lock:
+            profile = cProfile.Profile()
+            snapshot = None
+            if memory:
+                tracemalloc.start()
+            start = time.perf_counter()
+            try:
+                result = profile.runcall(function, *args, **kwargs)
+            finally:
+                duration = time.perf_counter() - start
+                if memory:
+                    snapshot = tracemalloc.take_snapshot()
+                    tracemalloc.stop()
+                self.store(profile_id, profile, snapshot, duration)
+        return result, profile_id
+
+    def store(self, profile_id: str, profile: cProfile.Profile,
+              snapshot: 'tracemalloc.Snapshot' = None, duration: float = 0.0):
+        try:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            profile.dump_stats(self.directory / f'{profile_id}.prof')
+            summary = io.StringIO()
+            summary.write(f'Profile {profile_id}, duration {duration:.3f}s\n\n')
+            pstats.Stats(profile, stream=summary).sort_stats(pstats.SortKey.CUMULATIVE).print_stats(self.top)
+            if snapshot is not None:
+                statistics = snapshot.filter_traces((tracemalloc.Filter(False, tracemalloc.__file__), )).statistics('lineno')
+                summary.write(f'Top {self.top} allocation sites of {sum(stat.size for stat in statistics) / 1024:.1f} KiB:\n')
+                for stat in statistics[:self.top]:
+                    summary.write(f'{stat}\n')
+            (self.directory / f'{profile_id}.txt').write_text(summary.getvalue(), encoding='utf-8')
+        except OSError:
+            log.exception('Storing profile %s failed', profile_id)
+        else:
+            log.info('Stored profile %s in %s', profile_id, self.directory)
@@ -32,19 +32,27 @@ Author(s):
     * Sebastian Wagner <swagner@intevation.de>
 """
 
+import csv
+import gc
 import io
 import json
 import logging
 import os
 import sys
+import threading
+import time
 import traceback
-from collections import defaultdict
-from itertools import chain
+from collections import Counter, defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import ExitStack, contextmanager, nullcontext
+from functools import partial
+from itertools import chain, islice
 from importlib import import_module
+from importlib.util import find_spec
 from pathlib import Path
 from re import compile
 from subprocess import run
-from typing import Optional
+from typing import Callable, Iterable, Iterator, Optional
 try:
     from importlib.metadata import version as importlib_version
 except ImportError:  # Ubuntu 20.04 and Ubuntu 22.04 with Python 3.7-3.8 has issues with importlib.resources
@@ -62,48 +70,42 @@ import dateutil.parser
 import falcon
 import hug
 from intelmq import CONFIG_DIR, HARMONIZATION_CONF_FILE
-from intelmq.bots.experts.taxonomy.expert import TAXONOMY
-try:
-    from intelmq.lib.bot import BotLibSettings, Bot
-except ImportError:
-    BotLibSettings = None
-    Bot = None
-from intelmq.lib.exceptions import InvalidValue, IntelMQException, InvalidKey
+from intelmq.lib.exceptions import InvalidValue, IntelMQException, InvalidKey, PipelineError
 from intelmq.lib.harmonization import DateTime
 from intelmq.lib.message import Event, MessageFactory
-from intelmq.lib.pipeline import PipelineFactory
-from intelmq.lib.utils import load_configuration, LOG_FORMAT_STREAM, get_bot_module_name
-from intelmq.lib.datatypes import BotType
+from intelmq.lib.pipeline import PipelineFactory, Redis
+from intelmq.lib.utils import LOG_FORMAT_STREAM, get_bot_module_name, encode
 
 from webinput_session import config, session
-from intelmq_webinput_csv.sql_output import WebinputSQLOutputBot
-try:
-    from .data import EXAMPLE_CERTBUND_EVENT
-except ImportError:  # attempted relative import with no known parent package
-    exec(Path(__file__).with_name('data.py').read_text(encoding='utf-8'))
+from intelmq_webinput_csv.pool import Pool, PoolTimeout, UnclosableConnection
+from intelmq_webinput_csv.jobs import JobManager
+from intelmq_webinput_csv.timestamps import TimestampParser
+from intelmq_webinput_csv.columns import ColumnPlan
+from intelmq_webinput_csv.bots import BotChain, BotChainCache
+from intelmq_webinput_csv.cache import TTLCache
+from intelmq_webinput_csv.mailgen_files import MailgenFiles
+from intelmq_webinput_csv.metrics import EVENTS, REGISTRY, ROWS, StageTimer
+from intelmq_webinput_csv.profiling import Profiler
+from intelmq_webinput_csv.harmonization import load_harmonization
 
 from psycopg2.extras import RealDictConnection, Json
-from psycopg2 import connect, InterfaceError
+from psycopg2 import connect
 from psycopg2.extensions import register_adapter
 
-try:
-    from intelmqmail import cb
-    from intelmqmail.db import open_db_connection
-    from intelmqmail.tableformat import build_table_format
-except ImportError:
-    cb = None
+# intelmqmail and the bots are imported on first use, see mailgen() and bot_library()
+MAILGEN_INSTALLED = find_spec('intelmqmail') is not None
+cb = open_db_connection = build_table_format = None
 
 
 # automatic conversion of python dicts to postgres' json
 register_adapter(dict, Json)
-try:
-    HARMONIZATION_CONF = load_configuration(HARMONIZATION_CONF_FILE)
-except ValueError:
-    # Fallback to internal harmonization file
-    if importlib_resources:  # Ubuntu 22.04
-        HARMONIZATION_CONF = load_configuration(importlib_resources.files('intelmq') / 'etc/harmonization.conf')
-    else:  # Ubuntu 20.04
-        HARMONIZATION_CONF = load_configuration(resource_filename('intelmq', 'etc/harmonization.conf'))
+if os.path.exists(HARMONIZATION_CONF_FILE):
+    HARMONIZATION_CONF_SOURCE = HARMONIZATION_CONF_FILE
+# Fallback to internal harmonization file
+elif importlib_resources:  # Ubuntu 22.04
+    HARMONIZATION_CONF_SOURCE = importlib_resources.files('intelmq') / 'etc/harmonization.conf'
+else:  # Ubuntu 20.04
+    HARMONIZATION_CONF_SOURCE = resource_filename('intelmq', 'etc/harmonization.conf')
 
 # Logging
 logging.basicConfig(format='%(asctime)s %(name)s %(levelname)s - %(message)s')
@@ -138,26 +140,257 @@ for path in configfiles:
                 ENDPOINT_PREFIX = ENDPOINT_PREFIX[:-1]
 
 CONSTANTS = CONFIG.get('constant_fields', '{}')
-ALLOWED_EVENT_FIELDS = CONFIG.get('allowed_event_fields', {})
-if ALLOWED_EVENT_FIELDS:
-    EVENT_HARMONIZATION = {
-        'event': {k: v for (k, v) in HARMONIZATION_CONF['event'].items() if k in ALLOWED_EVENT_FIELDS}
-    }
-else:
-    EVENT_HARMONIZATION = HARMONIZATION_CONF
+# the parsed harmonization is kept in a snapshot, if harmonization_snapshot is set
+HARMONIZATION_SNAPSHOT = CONFIG.get('harmonization_snapshot') or None
+HARMONIZATION_CONF, EVENT_HARMONIZATION = load_harmonization(HARMONIZATION_CONF_SOURCE, CONFIG.get('allowed_event_fields'),
+                                                             HARMONIZATION_SNAPSHOT)
 ALLOWED_EVENT_FIELDS = EVENT_HARMONIZATION['event'].keys()
 FIELD_TEST_EVENT = Event(harmonization=EVENT_HARMONIZATION)
+# template for new events
+EMPTY_EVENT = Event(harmonization=HARMONIZATION_CONF)
 
 # 255 bytes is a safe maximum length to allow
 FILENAME_RE = compile('^[a-zA-Z0-9. _-][a-zA-Z0-9. _-]{,254}$')
 
 FALLBACK_ASSIGNED_COLUMNS = ("source.asn", "source.ip", "time.source", "source.port", "destination.ip", "destination.port", "destination.fqdn", "protocol.transport")
 
+# number of events pushed to the destination pipeline in one operation
+DEFAULT_DESTINATION_PIPELINE_BATCH_SIZE = 1000
+# maximum number of simultaneous connections to the destination pipeline per process
+DEFAULT_DESTINATION_PIPELINE_POOL_SIZE = 4
+
+# number of worker threads for uploads in the background
+DEFAULT_UPLOAD_WORKERS = 2
+# seconds to keep the results of finished background uploads
+DEFAULT_UPLOAD_JOB_RETENTION = 3600
+
+# number of rows converted to events per task in the conversion processes
+DEFAULT_CONVERSION_CHUNK_SIZE = 500
+
+# maximum number of instances of the bot chain per process
+DEFAULT_BOT_CHAIN_POOL_SIZE = 4
+# number of events processed by the bots in one batch
+DEFAULT_BOT_BATCH_SIZE = 100
+# settings of the bots in addition to their parameters
+BOT_UPLOAD_SETTINGS = {}
+BOT_PROCESS_SETTINGS = {'logging_level': 'DEBUG'}
+
+# maximum number of simultaneous connections to the mailgen database per process
+DEFAULT_MAILGEN_DB_POOL_SIZE = 4
+# maximum number of simultaneous connections to the contactdb per process
+DEFAULT_CONTACTDB_POOL_SIZE = 2
+# seconds to cache the target groups
+DEFAULT_TARGET_GROUPS_CACHE_DURATION = 300
+
+# created at startup
+destination_pipeline_pool: Optional[Pool] = None
+upload_jobs: Optional[JobManager] = None
+conversion_pool: Optional[ProcessPoolExecutor] = None
+bot_chains: Optional[BotChainCache] = None
+contactdb_pool: Optional[Pool] = None
+mailgen_db_pool: Optional[Pool] = None
+target_groups_cache: Optional[TTLCache] = None
+# only if profiling_directory is configured
+profiler: Optional[Profiler] = None
+# the mailgen configuration and templates, read again when the files change
+mailgen_files = MailgenFiles()
+# the prepared example events and format specifications of mailgen previews, created on first use
+preview_renderer: Optional['PreviewRenderer'] = None  # noqa: F821
+# the process in which setup created the resources above, set once all exist
+setup_pid: Optional[int] = None
+# serializes setup, concurrent first requests of a forked process must not create the resources twice
+setup_lock = threading.RLock()
+
 
 @hug.startup()
 def setup(api):
+    """
+    Creates the resources of the process: the session store, pools, caches and workers
+    This is the post-fork phase for preforking servers, see create_app.
+    """
+    global setup_pid
+    with setup_lock:
+        create_resources()
+        setup_pid = os.getpid()
+
+
+def create_resources():
+    """
+    Creates the session store and the missing resources of the process, called by setup with setup_lock held
+    """
+    global destination_pipeline_pool, upload_jobs, conversion_pool, bot_chains, contactdb_pool, mailgen_db_pool, target_groups_cache, profiler
     session.initialize_sessions(session_config)
-    pass
+    if destination_pipeline_pool is None:
+        destination_pipeline_pool = Pool(create_destination_pipeline,
+                                         size=CONFIG.get('destination_pipeline_pool_size', DEFAULT_DESTINATION_PIPELINE_POOL_SIZE),
+                                         check=check_destination_pipeline,
+                                         close=close_destination_pipeline)
+    if upload_jobs is None:
+        upload_jobs = JobManager(workers=CONFIG.get('upload_workers', DEFAULT_UPLOAD_WORKERS),
+                                 retention=CONFIG.get('upload_job_retention', DEFAULT_UPLOAD_JOB_RETENTION))
+    if conversion_pool is None and CONFIG.get('conversion_processes', 0) > 0:
+        conversion_pool = ProcessPoolExecutor(max_workers=CONFIG['conversion_processes'])
+    if bot_chains is None:
+        bot_chains = BotChainCache(size=CONFIG.get('bot_chain_pool_size', DEFAULT_BOT_CHAIN_POOL_SIZE))
+    if contactdb_pool is None:
+        contactdb_pool = Pool(create_contactdb_connection,
+                              size=CONFIG.get('target_groups', {}).get('pool_size', DEFAULT_CONTACTDB_POOL_SIZE),
+                              check=check_db_connection,
+                              close=close_db_connection)
+    if mailgen_db_pool is None:
+        mailgen_db_pool = Pool(create_mailgen_db_connection,
+                               size=CONFIG.get('mailgen_db_pool_size', DEFAULT_MAILGEN_DB_POOL_SIZE),
+                               check=check_db_connection,
+                               close=close_db_connection)
+    if target_groups_cache is None:
+        target_groups_cache = TTLCache(CONFIG.get('target_groups', {}).get('cache_duration', DEFAULT_TARGET_GROUPS_CACHE_DURATION))
+    if profiler is None and CONFIG.get('profiling_directory'):
+        profiler = Profiler(CONFIG['profiling_directory'])
+
+
+def reset_after_fork():
+    """
+    Drops the resources inherited from the parent process, in the child after a fork
+
+    Connections, sockets, threads and locks can't be shared with the parent. The
+    connections are not closed, as that would also end them for the parent. The
+    resources are created again by setup on the first request of the child.
+    """
+    global destination_pipeline_pool, upload_jobs, conversion_pool, bot_chains, contactdb_pool, mailgen_db_pool, target_groups_cache, profiler
+    global mailgen_files, preview_renderer, setup_lock
+    destination_pipeline_pool = upload_jobs = conversion_pool = bot_chains = None
+    contactdb_pool = mailgen_db_pool = target_groups_cache = profiler = preview_renderer = None
+    mailgen_files = MailgenFiles()
+    # another thread of the parent may have held the lock during the fork
+    setup_lock = threading.RLock()
+    session.session_store = None
+
+
+if hasattr(os, 'register_at_fork'):  # not available on Windows
+    os.register_at_fork(after_in_child=reset_after_fork)
+
+
+def preload():
+    """
+    Loads the state shared by the processes of preforking servers, before the fork
+
+    The configuration and the harmonization are already loaded on import. This imports
+    intelmqmail and the configured bots and prepares the example event of the previews,
+    which would otherwise happen in each process on first use. Afterwards, the objects are
+    excluded from the garbage collection, so the memory pages stay shared with the processes.
+    No connections are opened.
+    """
+    if mailgen():
+        get_preview_renderer()
+        example_certbund_event()
+    bot_library()
+    from intelmq.bots.experts.taxonomy.expert import TAXONOMY  # noqa: F401
+    for bot_id, bot_config in CONFIG.get('bots', {}).items():
+        try:
+            bot_class(bot_config['module'])
+        except Exception:
+            log.exception('Importing bot %s failed', bot_id)
+    # the preloaded objects are not modified, don't touch their pages in the collections of the processes
+    gc.freeze()
+
+
+def create_app(preload_shared: bool = True):
+    """
+    Application factory for WSGI servers, returns the WSGI application
+
+    Pre-fork phase, in the process importing the application: the configuration, the
+    harmonization and, with preload_shared, the state loaded by preload.
+    Post-fork phase, on the first request in each process: setup creates the
+    session store, the pools and the workers.
+    """
+    if preload_shared:
+        preload()
+    return sys.modules[__name__].__hug_wsgi__
+
+
+@hug.request_middleware()
+def record_request_start(request, response):
+    """
+    The start of the request, before the body is parsed, for the timing of the stages
+    """
+    request.context['start'] = time.perf_counter()
+
+
+@hug.request_middleware()
+def setup_forked_process(request, response):
+    """
+    The process has been forked after the startup, the resources are created for this process
+    """
+    if setup_pid != os.getpid():
+        with setup_lock:
+            # another request may have finished the setup while waiting for the lock
+            if setup_pid != os.getpid():
+                setup(hug.API(__name__))
+
+
+def collect_stats() -> list:
+    """
+    Usage of the pools, the background uploads and the session store, for the metrics
+    """
+    pools = {'destination_pipeline': destination_pipeline_pool,
+             'mailgen_db': mailgen_db_pool,
+             'contactdb': contactdb_pool,
+             'bot_chains': bot_chains}
+    pool_stats = {name: pool.stats() for name, pool in pools.items() if pool is not None}
+    metrics = [
+        ('webinput_pool_size', 'Maximum number of resources of the pools', 'gauge',
+         [({'pool': name}, stats['size']) for name, stats in pool_stats.items()]),
+        ('webinput_pool_resources', 'Number of resources of the pools', 'gauge',
+         [({'pool': name, 'state': state}, stats[state]) for name, stats in pool_stats.items() for state in ('idle', 'in_use')]),
+    ]
+    if upload_jobs is not None:
+        with upload_jobs.lock:
+            statuses = Counter(job.status for job in upload_jobs.jobs.values())
+        metrics.append(('webinput_upload_jobs', 'Number of background uploads', 'gauge',
+                        [({'status': status}, statuses[status]) for status in ('queued', 'running', 'finished', 'failed')]))
+    if session.session_store is not None:
+        for name, value in session.session_store.stats().items():
+            metrics.append((f'webinput_session_{name}', f'Session store: {name.replace("_", " ")}', 'gauge', [({}, value)]))
+    return metrics
+
+
+REGISTRY.add_collector(collect_stats)
+
+
+@hug.get(ENDPOINT_PREFIX + '/api/metrics', output=hug.output_format.text)
+def metrics(response):
+    """
+    Metrics of this process in the Prometheus text format, if enabled with metrics_enabled
+    """
+    if not CONFIG.get('metrics_enabled', False):
+        response.status = falcon.HTTP_404
+        return 'The metrics are not enabled.'
+    # with several processes, every request reaches one of them
+    return REGISTRY.render({'pid': os.getpid()})
+
+
+def profiling_allowed(request) -> bool:
+    """
+    Profiling is configured and the user of the session is one of the profiling_users
+    """
+    user = request.context.get('user')
+    return profiler is not None and isinstance(user, dict) and user.get('username') in CONFIG.get('profiling_users', [])
+
+
+def profiled(label: str, body: dict, function: Callable) -> Callable:
+    """
+    Returns the function, running under the profiler if the body has the parameter profile.
+    The id of the profile is added to the result.
+    """
+    if not body.get('profile', False):
+        return function
+
+    def run_profiled(*args, **kwargs):
+        result, profile_id = profiler.call(label, function, *args, memory=body.get('profile_memory', False), **kwargs)
+        if isinstance(result, dict):
+            result['profile_id'] = profile_id
+        return result
+    return run_profiled
 
 
 @hug.post(ENDPOINT_PREFIX + '/api/login')
@@ -179,153 +412,674 @@ def login(username: str, password: str):
 
 def row_to_event(item: dict, body: dict,
                  retval: Optional[defaultdict] = None,
-                 lineno: int = 0, time_observation: Optional[str] = None) -> Event:
+                 lineno: int = 0, time_observation: Optional[str] = None,
+                 timestamp_parsers: Optional[dict] = None,
+                 column_plan: Optional[ColumnPlan] = None,
+                 base_event: Optional['BaseEvent'] = None) -> Event:
     """
     Processes a row of the data
+    timestamp_parsers is a dictionary of TimestampParser per field name,
+    kept by the caller for all rows of the data, like the BaseEvent.
+    If column_plan is given, invalid field names are only recorded in its column_errors
+    and not for every line.
     """
     if not time_observation:
         time_observation = DateTime().generate_datetime_now()
     if retval is None:
         # is not used then, but to keep the code below cleaner
         retval = defaultdict(dict)
-
-    event = Event()
+    if timestamp_parsers is None:
+        timestamp_parsers = {}
+    own_column_plan = column_plan is None
+    if own_column_plan:
+        column_plan = ColumnPlan(EVENT_HARMONIZATION, HARMONIZATION_CONF)
+    if base_event is None:
+        base_event = BaseEvent(body, time_observation)
+
+    event = new_event()
     line_valid = True
     lineerrors = defaultdict(list)
-    for key in item:
-        value = item[key]
-        if key.startswith('time.') and value:
+    for key, value in item.items():
+        column = column_plan.get(key)
+        if column is None:
+            line_valid = False
+            if own_column_plan:
+                lineerrors[key].append(f"Failed to add data {value!r} as field {key!r}: {column_plan.column_errors[key]}")
+            continue
+        if column.is_time and value:
             try:
-                parsed = dateutil.parser.parse(value, fuzzy=True)
-                if not parsed.tzinfo:
-                    value += body['timezone']
-                    parsed = dateutil.parser.parse(value)
-                value = parsed.isoformat()
-            except ValueError as exc:
-                lineerrors[key].append(f"Failed to parse {value!r} as time for field {key!r}: {exc!s}")
-                line_valid = False
+                timestamp_parser = timestamp_parsers[key]
+            except KeyError:
+                timestamp_parser = timestamp_parsers[key] = TimestampParser(body.get('timezone'))
+            parsed_value = timestamp_parser.parse(value)
+            if parsed_value is not None:
+                value = parsed_value
+            else:
+                original_value = value
+                try:
+                    parsed = dateutil.parser.parse(value, fuzzy=True)
+                    if not parsed.tzinfo:
+                        value += body['timezone']
+                        parsed = dateutil.parser.parse(value)
+                    value = parsed.isoformat()
+                    timestamp_parser.learn(original_value, value)
+                except ValueError as exc:
+                    lineerrors[key].append(f"Failed to parse {value!r} as time for field {key!r}: {exc!s}")
+                    line_valid = False
         try:
-            FIELD_TEST_EVENT.is_valid(key, None, sanitize=False)  # raises InvalidKey if key is not in list of allowed keys
-            event.add(key, value)
+            column.add(event, value)
         except IntelMQException as exc:
             lineerrors[key].append(f"Failed to add data {value!r} as field {key!r}: {exc!s}")
             line_valid = False
-    for key, value in body['custom'].items():
-        if key.startswith('custom_') and key[7:] not in event:
-            key = key[7:]
-            try:
-                event.add(key, value)
-            except InvalidValue as exc:
-                lineerrors[-1].append(f"Failed to add data {value!r} as field {key!r}: {exc!s}")
-                line_valid = False
-    for key in CONSTANTS:
-        if key not in event:
-            try:
-                event.add(key, CONSTANTS[key])
-            except InvalidValue as exc:
-                lineerrors[-1].append(f"Failed to add data {CONSTANTS[key]!r} as field {key!r}: {exc!s}")
-                line_valid = False
+    line_valid = base_event.merge(event, lineerrors) and line_valid
 
     retval[lineno] = lineerrors
 
-    if 'classification.type' not in event:
-        event.add('classification.type', 'test')
-    if 'classification.identifier' not in event:
-        event.add('classification.identifier', 'test')
-    if 'feed.code' not in event:
-        event.add('feed.code', 'webinput')
-    if 'time.observation' not in event:
-        event.add('time.observation', time_observation, sanitize=False)
+    return event, line_valid
 
-    # Ensure dryrun has priority, overwrite it at the end
-    if body['dryrun']:
-        event.add('classification.identifier', 'test', overwrite=True)
-        event.add('classification.type', 'test', overwrite=True)
 
-    return event, line_valid
+def new_event() -> Event:
+    """
+    Returns an empty Event, without loading the harmonization again
+    """
+    event = Event.__new__(Event)
+    event.__dict__.update(EMPTY_EVENT.__dict__)
+    return event
+
+
+class BaseEvent:
+    """
+    The fields added to all rows of an upload, if the row does not have them:
+    custom fields, constant fields and defaults.
+    These are validated once, not for every row.
+    """
+
+    def __init__(self, body: dict, time_observation: str):
+        event = new_event()
+        # (field name, error message), the error applies to rows not having this field
+        self.errors = []
+        for key, value in body['custom'].items():
+            if key.startswith('custom_') and key[7:] not in event:
+                key = key[7:]
+                try:
+                    event.add(key, value)
+                except InvalidValue as exc:
+                    self.errors.append((key, f"Failed to add data {value!r} as field {key!r}: {exc!s}"))
+        for key in CONSTANTS:
+            if key not in event:
+                try:
+                    event.add(key, CONSTANTS[key])
+                except InvalidValue as exc:
+                    self.errors.append((key, f"Failed to add data {CONSTANTS[key]!r} as field {key!r}: {exc!s}"))
+
+        if 'classification.type' not in event:
+            event.add('classification.type', 'test')
+        if 'classification.identifier' not in event:
+            event.add('classification.identifier', 'test')
+        if 'feed.code' not in event:
+            event.add('feed.code', 'webinput')
+        if 'time.observation' not in event:
+            event.add('time.observation', time_observation, sanitize=False)
+        self.fields = dict(event)
+
+        # Ensure dryrun has priority, overwrite it at the end
+        if body['dryrun']:
+            self.overrides = {'classification.identifier': 'test',
+                              'classification.type': 'test'}
+        else:
+            self.overrides = {}
+
+    def merge(self, event: Event, lineerrors: defaultdict) -> bool:
+        """
+        Adds the fields to the event of a row, the errors to lineerrors
+        Returns False if the line got invalid
+        """
+        line_valid = True
+        for key, message in self.errors:
+            if key not in event:
+                lineerrors[-1].append(message)
+                line_valid = False
+        for key, value in self.fields.items():
+            if key not in event:
+                dict.__setitem__(event, key, value)
+        for key, value in self.overrides.items():
+            dict.__setitem__(event, key, value)
+        return line_valid
+
+
+def convert_rows(rows: list, body: dict, time_observation: str) -> tuple:
+    """
+    Converts a chunk of rows with row_to_event, used by the conversion processes.
+    rows is a list of (lineno, row) tuples.
+    Returns a list of (lineno, event data, line valid, line errors) tuples,
+    the event data is None for empty rows, and the errors of the columns.
+    """
+    converted = []
+    timestamp_parsers = {}
+    column_plan = ColumnPlan(EVENT_HARMONIZATION, HARMONIZATION_CONF)
+    base_event = BaseEvent(body, time_observation)
+    for lineno, item in rows:
+        if not item:
+            converted.append((lineno, None, False, None))
+            continue
+        lineerrors = {}
+        event, line_valid = row_to_event(item, body, lineerrors, lineno, time_observation, timestamp_parsers, column_plan, base_event)
+        converted.append((lineno, dict(event), line_valid, dict(lineerrors[lineno])))
+    return converted, column_plan.column_errors
+
+
+def convert_data(data: Iterable[dict], body: dict, retval: defaultdict, time_observation: str,
+                 column_plan: ColumnPlan, timer: Optional[StageTimer] = None) -> Iterator[tuple]:
+    """
+    Converts the rows of data to events, in the conversion processes if configured.
+    Profiled requests are converted in this process, so the conversion is part of the profile.
+    Yields (lineno, event, line valid) tuples in the order of the input, the event is None for empty rows.
+    The errors of the lines are written to retval, the errors of the columns to column_plan.
+    If given, the time of the conversion is added to the timer as stage convert.
+    """
+    if timer is None:
+        timer = StageTimer('upload')
+    rows = enumerate(data)
+    chunk_size = max(1, CONFIG.get('conversion_chunk_size', DEFAULT_CONVERSION_CHUNK_SIZE))
+    pool = None if body.get('profile', False) else conversion_pool
+    first_chunk = list(islice(rows, chunk_size)) if pool is not None else []
+    if pool is None or len(first_chunk) < chunk_size:
+        # small uploads are converted directly, the overhead of the processes is not worth it
+        timestamp_parsers = {}
+        base_event = BaseEvent(body, time_observation)
+        for lineno, item in chain(first_chunk, rows):
+            if not item:
+                yield lineno, None, False
+                continue
+            start = time.perf_counter()
+            event, line_valid = row_to_event(item, body, retval, lineno, time_observation, timestamp_parsers, column_plan, base_event)
+            timer.add('convert', time.perf_counter() - start)
+            yield lineno, event, line_valid
+        return
+
+    # only the parameters used by row_to_event need to be sent to the processes
+    parameters = {key: body[key] for key in ('custom', 'dryrun', 'timezone') if key in body}
+    # limits the number of converted rows held in memory for streamed uploads
+    max_pending = 2 * max(1, CONFIG.get('conversion_processes', 1))
+    pending = deque([pool.submit(convert_rows, first_chunk, parameters, time_observation)])
+    while pending:
+        chunk = list(islice(rows, chunk_size))
+        if chunk:
+            pending.append(pool.submit(convert_rows, chunk, parameters, time_observation))
+            if len(pending) < max_pending:
+                continue
+        # the time waiting for the processes
+        with timer.measure('convert'):
+            converted, column_errors = pending.popleft().result()
+        column_plan.column_errors.update(column_errors)
+        for lineno, event_data, line_valid, lineerrors in converted:
+            if event_data is None:
+                yield lineno, None, False
+                continue
+            retval[lineno] = defaultdict(list, lineerrors)
+            # the data has already been validated by the conversion process
+            event = new_event()
+            dict.update(event, event_data)
+            yield lineno, event, line_valid
+
+
+def process_with_bots(bots: BotChain, converted: Iterator[tuple], batch_size: int,
+                      timer: Optional[StageTimer] = None) -> Iterator[tuple]:
+    """
+    Processes the valid events of converted, as given by convert_data, with the bots in batches of batch_size.
+    Yields (lineno, event, line valid, BatchResult) tuples in the order of the input,
+    the BatchResult is None for empty and invalid lines.
+    If given, the time spent in each bot is added to the timer.
+    """
+    batch = []
+    for item in chain(converted, [None]):
+        if item is not None:
+            batch.append(item)
+            if len(batch) < batch_size:
+                continue
+        results = iter(bots.process_batch([event for _, event, line_valid in batch if event is not None and line_valid], timer))
+        for lineno, event, line_valid in batch:
+            yield lineno, event, line_valid, next(results) if event is not None and line_valid else None
+        batch = []
+
+
+def send_messages(destination_pipeline, raw_messages: list) -> int:
+    """
+    Sends a chunk of serialized messages to the destination pipeline.
+    Returns the number of accepted messages.
+
+    For the Redis pipeline, the chunk is pushed with one LPUSH per destination queue,
+    all in one round trip. Other pipelines send the messages one by one.
+    """
+    if not isinstance(destination_pipeline, Redis):
+        for raw_message in raw_messages:
+            destination_pipeline.send(raw_message)
+        return len(raw_messages)
+
+    try:
+        queues = destination_pipeline.destination_queues['_default']
+    except KeyError as exc:
+        raise PipelineError(exc)
+    messages = [encode(raw_message) for raw_message in raw_messages]
+    if destination_pipeline.load_balance:
+        # same distribution as Redis.send: round-robin over the queues
+        queue_messages = defaultdict(list)
+        for message in messages:
+            queue_messages[queues[destination_pipeline.load_balance_iterator]].append(message)
+            destination_pipeline.load_balance_iterator += 1
+            destination_pipeline.load_balance_iterator %= len(queues)
+    else:
+        queue_messages = {queue: messages for queue in queues}
+
+    redis_pipeline = destination_pipeline.pipe.pipeline(transaction=False)
+    for destination_queue, queue_chunk in queue_messages.items():
+        redis_pipeline.lpush(destination_queue, *queue_chunk)
+    try:
+        redis_pipeline.execute()
+    except Exception as exc:
+        raise PipelineError(exc)
+    return len(messages)
+
+
+def create_destination_pipeline():
+    """
+    Creates and connects a destination pipeline as configured
+    """
+    destination_pipeline = PipelineFactory.create(pipeline_args=CONFIG['intelmq'],
+                                                  logger=log,
+                                                  direction='destination')
+    if not CONFIG.get('destination_pipeline_queue_formatted', False):
+        destination_pipeline.set_queues(CONFIG['destination_pipeline_queue'], "destination")
+        destination_pipeline.connect()
+    return destination_pipeline
+
+
+def check_destination_pipeline(destination_pipeline) -> bool:
+    """
+    Health check for pooled pipelines, the Redis server must answer a PING
+    """
+    if isinstance(destination_pipeline, Redis) and destination_pipeline.pipe is not None:
+        return destination_pipeline.pipe.ping()
+    return True
+
+
+def close_destination_pipeline(destination_pipeline):
+    if isinstance(destination_pipeline, Redis) and destination_pipeline.pipe is not None:
+        destination_pipeline.pipe.close()
+    destination_pipeline.disconnect()
+
+
+def mailgen():
+    """
+    Returns intelmqmail.cb, None if intelmqmail is not installed
+    intelmqmail is imported on first use, so processes not using mailgen don't pay for the import.
+    """
+    global cb, open_db_connection, build_table_format, MAILGEN_INSTALLED
+    if cb is None and MAILGEN_INSTALLED:
+        try:
+            from intelmqmail import cb as mailgen_cb
+            from intelmqmail.db import open_db_connection
+            from intelmqmail.tableformat import build_table_format
+        except ImportError:
+            log.exception('Importing intelmqmail failed')
+            MAILGEN_INSTALLED = False
+        else:
+            cb = mailgen_cb
+    return cb
+
+
+def get_preview_renderer() -> 'PreviewRenderer':  # noqa: F821
+    global preview_renderer
+    if preview_renderer is None:
+        from intelmq_webinput_csv.preview import PreviewRenderer
+        preview_renderer = PreviewRenderer()
+    return preview_renderer
+
+
+def bot_library() -> tuple:
+    """
+    Returns intelmq.lib.bot.Bot and BotLibSettings, imported on first use
+    Both are None if IntelMQ does not support calling bots as library (IntelMQ < 3.2.0).
+    """
+    try:
+        from intelmq.lib.bot import BotLibSettings, Bot
+    except ImportError:
+        return None, None
+    return Bot, BotLibSettings
+
+
+def read_mailgen_config() -> dict:
+    """
+    Returns the mailgen configuration, from the cache if the files are unchanged
+    """
+    return mailgen_files.config(CONFIG.get('mailgen_config_file'))
+
+
+def create_mailgen_db_connection() -> 'psycopg2.extensions.connection':  # noqa: F821
+    """
+    Connects to the events database as configured for mailgen
+    """
+    conn = open_db_connection(read_mailgen_config(), connection_factory=RealDictConnection)
+    conn.autocommit = False
+    return conn
+
+
+@contextmanager
+def mailgen_db_connection():
+    """
+    Lends out a connection to the mailgen database for the duration of a request.
+    The transaction is rolled back when the connection is returned, also on errors.
+    Closing the connection, as intelmqmail.cb.start does, only rolls back the transaction.
+    """
+    with mailgen_db_pool.lease() as conn:
+        try:
+            yield UnclosableConnection(conn)
+        finally:
+            if not conn.closed:
+                conn.rollback()
+
+
+def create_contactdb_connection() -> 'psycopg2.extensions.connection':  # noqa: F821
+    """
+    Connects to the contactdb for the target groups
+    """
+    conn = connect(**CONFIG['target_groups']['database'])
+    # only used for reading, don't keep transactions open
+    conn.autocommit = True
+    return conn
+
+
+def check_db_connection(conn: 'psycopg2.extensions.connection') -> bool:  # noqa: F821
+    """
+    Health check for pooled database connections
+    """
+    if conn.closed:
+        return False
+    with conn.cursor() as cur:
+        cur.execute('SELECT 1')
+    if not conn.autocommit:
+        conn.rollback()
+    return True
+
+
+def close_db_connection(conn: 'psycopg2.extensions.connection'):  # noqa: F821
+    conn.close()
+
+
+def bot_class(module: str) -> type:
+    """
+    Returns the class of the bot in the module, imported on first use
+    """
+    if module == 'intelmq_webinput_csv.sql_output':
+        from intelmq_webinput_csv.sql_output import WebinputSQLOutputBot
+        return WebinputSQLOutputBot
+    module_name = get_bot_module_name(module)
+    if not module_name:
+        raise ValueError(f"Bot Module {module!r} is not available.")
+    return import_module(module_name).BOT
+
+
+def create_bot_chain(bots_config: dict, settings: dict) -> BotChain:
+    """
+    Initializes the configured bots with the given settings and their parameters
+    """
+    init_log = io.StringIO()
+    log_handler = logging.StreamHandler(stream=init_log)
+    log_handler.setFormatter(logging.Formatter(LOG_FORMAT_STREAM))
+    _, BotLibSettings = bot_library()
+    bots = []
+    for bot_id, bot_config in bots_config.items():
+        logging.getLogger(bot_id).addHandler(log_handler)
+        try:
+            bot = bot_class(bot_config['module'])
+            bots.append((bot_id, bot(bot_id, settings=BotLibSettings | settings | bot_config.get('parameters', {}))))
+        finally:
+            logging.getLogger(bot_id).removeHandler(log_handler)
+    return BotChain(bots, init_log.getvalue())
+
+
+def connect_sql_output_bot(bots_config: dict) -> Optional['psycopg2.extensions.connection']:  # noqa: F821
+    """
+    Opens a database connection with the parameters of the SQL output bot, if one is configured
+    """
+    for bot_config in bots_config.values():
+        if bot_config['module'] == 'intelmq_webinput_csv.sql_output':
+            conn = connect(database=bot_config['parameters']['database'],
+                           user=bot_config['parameters']['user'],
+                           password=bot_config['parameters']['password'],
+                           host=bot_config['parameters']['host'],
+                           port=bot_config['parameters']['port'],
+                           connection_factory=RealDictConnection)
+            conn.autocommit = False
+            return conn
+    return None
 
 
 @hug.post(ENDPOINT_PREFIX + '/api/upload', requires=session.token_authentication)
 def uploadCSV(body, request, response):
+    return handle_upload(body["data"], body, request, response)
+
+
+@hug.post(ENDPOINT_PREFIX + '/api/upload/csv', requires=session.token_authentication)
+def upload_csv_stream(request, response):
+    """
+    Upload of the raw CSV file as request body (e.g. Content-Type text/csv), parsed incrementally on the server.
+
+    The parameters are given as JSON object in the header X-Webinput-Parameters.
+    These are the same as the body of /api/upload, except for data, plus:
+      columns: list of the field names of the CSV columns, empty names skip the column
+      delimiter, quotechar, escapechar: the CSV dialect, default: , " and none
+      skip_initial_space: ignore whitespace immediately following the delimiter
+      has_header: the first line is a header, default: true
+      skip_lines: number of lines to skip after the header
+      encoding: the character encoding of the file, default: utf-8
+    """
+    try:
+        body = json.loads(request.get_header('X-Webinput-Parameters') or '{}')
+        if not isinstance(body, dict):
+            raise ValueError('The parameters must be a JSON object.')
+    except ValueError as exc:
+        response.status = falcon.HTTP_400
+        return f"Invalid parameters in header X-Webinput-Parameters: {exc!s}"
+    if not body.get('columns'):
+        response.status = falcon.HTTP_400
+        return "No columns given. Did you set fields for the columns?"
+    if body.get('background', False):
+        # the request body can't be read after the response has been sent
+        response.status = falcon.HTTP_400
+        return "Background processing is not available for streamed uploads."
+
+    stream = io.TextIOWrapper(request.bounded_stream, encoding=body.get('encoding', 'utf-8'), newline='')
+    try:
+        return handle_upload(csv_rows(stream, body), body, request, response)
+    except (csv.Error, UnicodeDecodeError) as exc:
+        response.status = falcon.HTTP_400
+        return f"Failed to parse the CSV data: {exc!s}"
+
+
+def csv_rows(stream, parameters: dict) -> Iterator[dict]:
+    """
+    Reads the CSV data from the stream and yields one dictionary per row,
+    with the values prepared in the same way as the frontend does.
+    Empty lines are skipped.
+    """
+    reader = csv.reader(stream,
+                        delimiter=parameters.get('delimiter') or ',',
+                        quotechar=parameters.get('quotechar') or '"',
+                        escapechar=parameters.get('escapechar') or None,
+                        skipinitialspace=parameters.get('skip_initial_space', False))
+    columns = parameters['columns']
+    skip_lines = int(parameters.get('skip_lines') or 0) + bool(parameters.get('has_header', True))
+    for row in reader:
+        if not row:
+            continue
+        if skip_lines:
+            skip_lines -= 1
+            continue
+        item = {}
+        for field, value in zip(columns, row):
+            if not field:
+                continue
+            if field == 'extra':
+                try:
+                    value = json.loads(value)
+                except ValueError:
+                    value = {'data': value}
+                else:
+                    if isinstance(value, list):
+                        value = {'data': value}
+            item[field] = value
+        yield item
+
+
+def handle_upload(data: Iterable[dict], body: dict, request, response):
+    """
+    Common part of the upload endpoints: authentication and,
+    if requested, start of the upload as background job
+    """
+    if body.get('profile', False) and not profiling_allowed(request):
+        response.status = falcon.HTTP_403
+        return "Profiling is not enabled for this user."
+
+    timer = StageTimer('upload', request.context.get('start'))
+    # parsing the body and the session authentication
+    timer.add('parse', time.perf_counter() - timer.start)
     # additional authentication is required for this call
     if body.get('submit', True) and session.session_store is not None:
         username = body.get('username')
         password = body.get('password')
-        known = session.session_store.verify_user(username, password)
+        # repeated submissions in the same session don't need to hash the password again
+        with timer.measure('authentication'):
+            known = session.session_store.verify_user(username, password, token=request.get_header('Authorization'))
         if known is None:
             response.status = falcon.HTTP_401
             return "Invalid username and/or password"
 
-    destination_pipeline = PipelineFactory.create(pipeline_args=CONFIG['intelmq'],
-                                                  logger=log,
-                                                  direction='destination')
-    if not CONFIG.get('destination_pipeline_queue_formatted', False):
-        destination_pipeline.set_queues(CONFIG['destination_pipeline_queue'], "destination")
-        destination_pipeline.connect()
+    if 'custom' not in body:
+        body["custom"] = {}
+
+    upload = profiled('upload', body, run_upload)
+    if body.get('background', False):
+        job = upload_jobs.submit(upload, data, body, timer=timer)
+        response.status = falcon.HTTP_202
+        return {'job_id': job.id}
+
+    try:
+        return upload(data, body, timer=timer)
+    except PoolTimeout as exc:
+        response.status = falcon.HTTP_503
+        return f"All connections are in use, please try again later. {exc!s}"
+    finally:
+        timer.finish()
+        response.set_header('Server-Timing', timer.server_timing())
+
+
+def run_upload(data: Iterable[dict], body: dict, progress: Optional[dict] = None,
+               timer: Optional[StageTimer] = None) -> dict:
+    """
+    Runs upload_data, with a destination pipeline or the bots from the pools if required
+    """
+    if body.get('validate_with_bots', False):
+        bots_config = CONFIG.get('bots', {})
+        # the database connection is only needed for the bots, e.g. the SQL output bot
+        with (mailgen_db_connection() if mailgen() else nullcontext()) as conn:
+            try:
+                bots = bot_chains.acquire(bots_config, BOT_UPLOAD_SETTINGS,
+                                          partial(create_bot_chain, bots_config, BOT_UPLOAD_SETTINGS), conn)
+            except PoolTimeout:
+                raise
+            except Exception:
+                return {'status': 'error',
+                        'log': traceback.format_exc()}
+            try:
+                return upload_data(data, body, bots=bots, progress=progress, conn=conn, timer=timer)
+            finally:
+                bot_chains.release(bots)
+    if not body.get('submit', True):
+        # the destination pipeline is only needed for submissions without bots
+        return upload_data(data, body, progress=progress, timer=timer)
+    with destination_pipeline_pool.lease() as destination_pipeline:
+        return upload_data(data, body, destination_pipeline, progress=progress, timer=timer)
+
+
+@hug.get(ENDPOINT_PREFIX + '/api/jobs/{job_id}', requires=session.token_authentication)
+def job_status(job_id: str, response):
+    """
+    Returns the status and progress of a background upload,
+    and the result in the same format as /api/upload, once it is finished
+    """
+    job = upload_jobs.get(job_id)
+    if job is None:
+        response.status = falcon.HTTP_404
+        # with several backend processes, the job may also belong to another process
+        return f'Job {job_id!r} does not exist in this backend process, it has expired or was started by another process.'
+    return job.to_dict()
+
+
+def upload_data(data: Iterable[dict], body: dict, destination_pipeline=None,
+                progress: Optional[dict] = None, bots: Optional[BotChain] = None,
+                conn: Optional['psycopg2.extensions.connection'] = None,  # noqa: F821
+                timer: Optional[StageTimer] = None) -> dict:
+    """
+    Converts, validates and - if requested - submits the data of an upload.
+    The data can be any iterable of rows, it is consumed only once.
+    bots is the bot chain for validate_with_bots, conn the database connection bound to it.
+    The transaction of conn is committed, or rolled back for dry runs.
+    If given, the dictionary progress is updated with the current counters while processing.
+    The durations of the stages are recorded with the timer, which is finished at the end.
+    Returns the result as given by /api/upload
+    """
+    if progress is None:
+        progress = {}
+    if timer is None:
+        timer = StageTimer('upload')
     time_observation = DateTime().generate_datetime_now()
     required_fields = CONFIG.get('required_fields')
+    batch_size = max(1, CONFIG.get('destination_pipeline_batch_size', DEFAULT_DESTINATION_PIPELINE_BATCH_SIZE))
+    pending_messages = []
+    submitted_chunks = []
 
-    data = body["data"]
-    if 'custom' not in body:
-        body["custom"] = {}
     retval = defaultdict(list)
     lines_valid = 0
 
-    if cb:
-        mailgen_config = cb.read_configuration(CONFIG.get('mailgen_config_file'))
-        conn = open_db_connection(mailgen_config, connection_factory=RealDictConnection)
-
-    bots = []
-    for bot_id, bot_config in CONFIG.get('bots', {}).items() if body.get('validate_with_bots', False) else {}:
-        try:
-            if bot_config['module'] == 'intelmq_webinput_csv.sql_output':
-                bot = WebinputSQLOutputBot
-                kwargs = {'connection': conn}
-            else:
-                module_name = get_bot_module_name(bot_config['module'])
-                bot = import_module(module_name).BOT
-                kwargs = {}
-            bots.append((bot_id, bot(bot_id, **kwargs, settings=BotLibSettings | bot_config.get('parameters', {}))))
-        except Exception:
-            return {'status': 'error',
-                    'log': traceback.format_exc()}
+    if bots is None:
+        bots = []
 
     tracebacks = []
     input_lines_invalid = 0
     output_lines = 0
 
-    for lineno, item in enumerate(data):
-        if not item:
+    total_lines = 0
+
+    column_plan = ColumnPlan(EVENT_HARMONIZATION, HARMONIZATION_CONF)
+    converted = convert_data(data, body, retval, time_observation, column_plan, timer)
+    if bots:
+        converted = process_with_bots(bots, converted, max(1, CONFIG.get('bot_batch_size', DEFAULT_BOT_BATCH_SIZE)), timer)
+    else:
+        converted = ((lineno, event, line_valid, None) for lineno, event, line_valid in converted)
+    for lineno, event, input_line_valid, bots_result in converted:
+        progress.update(input_lines=lineno, input_lines_invalid=input_lines_invalid,
+                        output_lines=output_lines, output_lines_invalid=len(tracebacks))
+        total_lines = lineno + 1
+        if event is None:
             retval[lineno] = {-1: ('Line is empty', )}
             continue
 
-        event, input_line_valid = row_to_event(item, body, retval, lineno, time_observation)
         if not input_line_valid:
             input_lines_invalid += 1
+            # lines invalid only because of an invalid column are reported in column_errors
+            if not retval.get(lineno):
+                retval.pop(lineno, None)
             continue
 
-        bots_input = [event]
-        for bot_id, bot in bots:
-            bot_raised_errors = False
-            if bot.bottype is not BotType.OUTPUT:
-                bots_output = []
-            for message in bots_input:
-                try:
-                    queues = bot.process_message(message)
-                except Exception:
-                    bot_raised_errors = True
-                    tracebacks.append(traceback.format_exc())
-                else:
-                    # for output bots, the output queue is empty, don't consider it
-                    if bot.bottype is not BotType.OUTPUT:
-                        bots_output.extend(queues['output'])
+        if bots_result is not None:
+            tracebacks.extend(bots_result.tracebacks)
             # if > 0 errors and no valid messages, then the line is invalid
-            if not bots_output and bot_raised_errors:
-                retval[lineno][-1].append(f"Bot {bot_id} raised an error. Please inspect the details with the magnifier symbol on the left.")
+            if bots_result.failed_bot is not None:
+                retval[lineno][-1].append(f"Bot {bots_result.failed_bot} raised an error. Please inspect the details with the magnifier symbol on the left.")
                 input_line_valid = False
-                break
-            bots_input = bots_output
-        if not bots:
+            bots_output = bots_result.outputs
+        else:
             bots_output = [event]
         output_lines += len(bots_output)
 
@@ -348,9 +1102,15 @@ def uploadCSV(body, request, response):
 
                 # if 'raw' not in event:
                 #     event.add('raw', ''.join(raw_header + [handle_rewindable.current_line]))
+                start = time.perf_counter()
                 raw_message = MessageFactory.serialize(event)
+                timer.add('serialize', time.perf_counter() - start)
                 if body.get('submit', True) and input_line_valid:
-                    destination_pipeline.send(raw_message)
+                    pending_messages.append(raw_message)
+                    if len(pending_messages) >= batch_size:
+                        with timer.measure('send'):
+                            submitted_chunks.append(send_messages(destination_pipeline, pending_messages))
+                        pending_messages = []
 
         # if line was valid, increment the counter by 1
         input_lines_invalid += not input_line_valid
@@ -358,20 +1118,36 @@ def uploadCSV(body, request, response):
         if not retval[lineno]:
             del retval[lineno]
 
+    if pending_messages:
+        with timer.measure('send'):
+            submitted_chunks.append(send_messages(destination_pipeline, pending_messages))
+
     output_lines_invalid = len(tracebacks)
+    progress.update(input_lines=total_lines, input_lines_invalid=input_lines_invalid,
+                    output_lines=output_lines, output_lines_invalid=output_lines_invalid)
 
-    if body['dryrun'] and cb:
-        conn.rollback()
-    elif cb:
-        conn.commit()
+    if conn is not None:
+        with timer.measure('commit'):
+            if body['dryrun']:
+                conn.rollback()
+            else:
+                conn.commit()
+
+    ROWS.inc(total_lines - input_lines_invalid, endpoint='upload', status='valid')
+    ROWS.inc(input_lines_invalid, endpoint='upload', status='invalid')
+    EVENTS.inc(output_lines, endpoint='upload', status='output')
+    EVENTS.inc(sum(submitted_chunks), endpoint='upload', status='submitted')
+    timer.finish()
 
-    # lineno is the index, for the number of lines add one
-    total_lines = lineno + 1 if data else 0
     result = {"input_lines": total_lines,
               "input_lines_invalid": input_lines_invalid,
               "output_lines": output_lines,
               "output_lines_invalid": output_lines_invalid,
-              "errors": retval}
+              "errors": retval,
+              "column_errors": column_plan.column_errors}
+    if body.get('submit', True) and not body.get('validate_with_bots', False):
+        # number of accepted events per chunk sent to the destination pipeline
+        result['submitted_chunks'] = submitted_chunks
     if tracebacks:
         result['log'] = '\n'.join(tracebacks)
     return result
@@ -379,6 +1155,7 @@ def uploadCSV(body, request, response):
 
 @hug.get(ENDPOINT_PREFIX + '/api/classification/types', requires=session.token_authentication)
 def classification_types():
+    from intelmq.bots.experts.taxonomy.expert import TAXONOMY
     return TAXONOMY
 
 
@@ -398,20 +1175,29 @@ def get_required_fields():
 
 
 @hug.get(ENDPOINT_PREFIX + '/api/mailgen/target_groups', requires=session.token_authentication)
-def get_mailgen_target_groups():
+def get_mailgen_target_groups(refresh: hug.types.smart_boolean = False):
     """
     Return configured mailgen target groups
     The target group is used by a rules expert's rule and is used here in the webinput as a special form of a constant field.
+
+    The result is cached, with refresh the contactdb is queried again.
     """
     if 'target_groups' not in CONFIG:
         return {'tag_name': 'Target groups',
                 'tag_values': []}
-    conn = connect(**CONFIG['target_groups']['database'])
-    cur = conn.cursor()
-    cur.execute(CONFIG['target_groups']['tag_values_query'])
-    tag_values = list(chain(*cur.fetchall()))
-    cur.execute(CONFIG['target_groups']['tag_name_query'])
-    tag_name = cur.fetchone()[0]
+    key = json.dumps(CONFIG['target_groups'], sort_keys=True)
+    if refresh:
+        target_groups_cache.invalidate(key)
+    return target_groups_cache.get(key, query_target_groups)
+
+
+def query_target_groups() -> dict:
+    with contactdb_pool.lease() as conn:
+        with conn.cursor() as cur:
+            cur.execute(CONFIG['target_groups']['tag_values_query'])
+            tag_values = list(chain(*cur.fetchall()))
+            cur.execute(CONFIG['target_groups']['tag_name_query'])
+            tag_name = cur.fetchone()[0]
     return {'tag_name': tag_name,
             'tag_values': tag_values}
 
@@ -427,7 +1213,7 @@ def mailgen_available():
     """
     Returns true/false if mailgen is installed on the system.
     """
-    return bool(cb)
+    return mailgen() is not None
 
 
 @hug.get(ENDPOINT_PREFIX + '/api/mailgen/settings', requires=session.token_authentication)
@@ -466,14 +1252,14 @@ def mailgen_run(body, request, response):
     else:
         logging.getLogger('intelmqmail').setLevel(logging.INFO)
 
-    if cb is None:
+    if mailgen() is None:
         response.status = falcon.HTTP_500
         return {"result": "intelmqmail is not available on this system."}
 
     format_spec = build_format_spec(body.get('assigned_columns'))
 
     try:
-        mailgen_config = cb.read_configuration(CONFIG.get('mailgen_config_file'))
+        mailgen_config = read_mailgen_config()
         return {"result": cb.start(mailgen_config, process_all=True,
                                    template=body.get('template'),
                                    templates={item['name']: item['body'] for item in body.get('templates', [])},
@@ -486,11 +1272,49 @@ def mailgen_run(body, request, response):
         return {"result": str(traceback.format_exc()), "log": mailgen_log.getvalue().strip()}
 
 
+def example_certbund_event() -> Event:
+    """
+    Returns the example event with directives for mailgen, the module is imported on first use
+    """
+    try:
+        from .data import EXAMPLE_CERTBUND_EVENT
+    except ImportError:  # attempted relative import with no known parent package
+        namespace = {}
+        exec(Path(__file__).with_name('data.py').read_text(encoding='utf-8'), namespace)
+        EXAMPLE_CERTBUND_EVENT = namespace['EXAMPLE_CERTBUND_EVENT']
+    return EXAMPLE_CERTBUND_EVENT
+
+
+def create_example_event(data: dict) -> Event:
+    """
+    Returns the example event for mailgen previews, with the user data and the constant fields
+    """
+    example_data = example_certbund_event().copy()
+    user_data = Event(harmonization=HARMONIZATION_CONF)  # we can't use the allowed_event_fields setting here, as we also need to consider fields produced by bots
+    # validate the user data so that we only have syntactically correct values
+    # otherwise the database INSERT may fail because of incorrect types
+    for key, value in data.items():
+        # we ignore errors here
+        # the goal is to show a template preview and give feedback on the template, not on the data
+        user_data.add(key, value, sanitize=True, overwrite=True, raise_failure=False)
+    for key, value in CONSTANTS.items():
+        user_data.add(key, value, sanitize=True, overwrite=True, raise_failure=False)
+    example_data.update(user_data)  # TODO:
+    return example_data
+
+
 @hug.post(ENDPOINT_PREFIX + '/api/mailgen/preview', requires=session.token_authentication)
 def mailgen_preview(body, request, response):
     """
     Show mailgen email preview
     """
+    if body.get('profile', False) and not profiling_allowed(request):
+        response.status = falcon.HTTP_403
+        return {'result': 'Profiling is not enabled for this user.'}
+    return profiled('mailgen_preview', body, render_mailgen_preview)(body, response)
+
+
+def render_mailgen_preview(body: dict, response) -> dict:
     if not body.get('template'):  # empty string
         response.status = falcon.HTTP_422
         return {'result': 'Empty template', 'log': ''}
@@ -508,37 +1332,33 @@ def mailgen_preview(body, request, response):
     else:
         logging.getLogger('intelmqmail').setLevel(logging.INFO)
 
-    if cb is None:
+    if mailgen() is None:
         response.status = falcon.HTTP_500
         return {"result": "intelmqmail is not available on this system."}
 
-    format_spec = build_format_spec(body.get('assigned_columns'))
-    example_data = EXAMPLE_CERTBUND_EVENT.copy()
-    user_data = Event()  # we can't use the allowed_event_fields setting here, as we also need to consider fields produced by bots
-    # validate the user data so that we only have syntactically correct values
-    # otherwise the database INSERT may fail because of incorrect types
-    for key, value in body.get('data', {}).items():
-        # we ignore errors here
-        # the goal is to show a template preview and give feedback on the template, not on the data
-        user_data.add(key, value, sanitize=True, overwrite=True, raise_failure=False)
-    for key, value in CONSTANTS.items():
-        user_data.add(key, value, sanitize=True, overwrite=True, raise_failure=False)
-    example_data.update(user_data)  # TODO:
-    # this converts extra-keys to a single dict, so the INSERT below works
-    example_data = example_data.to_dict(jsondict_as_string=True)
+    assigned_columns = body.get('assigned_columns')
+    preview_renderer = get_preview_renderer()
+    format_spec = preview_renderer.format_spec(json.dumps(assigned_columns), lambda: build_format_spec(assigned_columns))
+    data = body.get('data', {})
+    example_event = preview_renderer.prepared_event(json.dumps([data, CONSTANTS], sort_keys=True, default=str),
+                                                    lambda: create_example_event(data))
 
     try:
-        mailgen_config = cb.read_configuration(CONFIG.get('mailgen_config_file'))
-        conn = open_db_connection(mailgen_config, connection_factory=RealDictConnection)
-        conn.autocommit = False
-
-        try:
+        mailgen_config = read_mailgen_config()
+        result = preview_renderer.render(mailgen_config, example_event, template=body.get('template'), format_spec=format_spec)
+        if result is not None:
+            return {"result": result, "log": mailgen_log.getvalue().strip()}
+        # the scripts need the database, only show the log of the following run
+        mailgen_log.seek(0)
+        mailgen_log.truncate()
+
+        with mailgen_db_connection() as conn:
             cur = conn.cursor()
             cur.execute('START TRANSACTION')
             cur.execute('INSERT INTO events ("{keys}") VALUES ({values})'
-                        ''.format(keys='", "'.join(example_data.keys()),
-                                  values=', '.join(['%s'] * len(example_data))),
-                        list(example_data.values()))
+                        ''.format(keys='", "'.join(example_event.values.keys()),
+                                  values=', '.join(['%s'] * len(example_event.values))),
+                        list(example_event.values.values()))
             cur.execute('SELECT id FROM directives ORDER BY id DESC LIMIT 1;')
             last_id = cur.fetchone()['id'] if cur.rowcount else None
             # ignore the additional_directive_where in mailgen config as that causes we are not seeing the test event
@@ -550,11 +1370,6 @@ def mailgen_preview(body, request, response):
                                        additional_directive_where=additional_directive_where,
                                        conn=conn, default_format_spec=format_spec)[0],  # only transmit the first notification
                     "log": mailgen_log.getvalue().strip()}
-        finally:
-            try:
-                conn.rollback()
-            except InterfaceError:  # connection already closed
-                pass
     except Exception:
         log.exception('Mailgen Preview failed')  # also log it properly
         for line in mailgen_log.getvalue().splitlines():
@@ -573,6 +1388,7 @@ def bots_available(body) -> dict:
     Checks if bots are available: IntelMQ Core version supports the feature and at least one bot is configured.
     """
     config_has_bots = bool(CONFIG.get('bots'))
+    Bot, BotLibSettings = bot_library()
     intelmq_supports_bot_lib = BotLibSettings and Bot and hasattr(Bot, 'process_message')
     return {
         "status": config_has_bots and intelmq_supports_bot_lib,
@@ -581,7 +1397,7 @@ def bots_available(body) -> dict:
 
 
 @hug.post(ENDPOINT_PREFIX + '/api/bots/process', requires=session.token_authentication)
-def process(body) -> dict:
+def process(body, request, response) -> dict:
     """
     Process data with IntelMQ bots
     """
@@ -589,83 +1405,96 @@ def process(body) -> dict:
     if not data:
         return {'status': 'error',
                 'log': 'No data supplied. Did you set fields for the columns?'}
+    if body.get('profile', False) and not profiling_allowed(request):
+        response.status = falcon.HTTP_403
+        return {'status': 'error',
+                'log': 'Profiling is not enabled for this user.'}
 
+    timer = StageTimer('bots_process', request.context.get('start'))
+    # parsing the body and the session authentication
+    timer.add('parse', time.perf_counter() - timer.start)
+    bots_config = CONFIG.get('bots', {})
+    try:
+        with ExitStack() as stack:
+            if mailgen():
+                conn = stack.enter_context(mailgen_db_connection())
+            else:
+                # for the SQL output bot, if mailgen is not available
+                conn = connect_sql_output_bot(bots_config)
+                if conn is not None:
+                    stack.callback(conn.close)
+            return profiled('bots_process', body, process_data)(data, body, bots_config, conn, timer)
+    finally:
+        timer.finish()
+        response.set_header('Server-Timing', timer.server_timing())
+
+
+def process_data(data: list, body: dict, bots_config: dict,
+                 conn: Optional['psycopg2.extensions.connection'],  # noqa: F821
+                 timer: Optional[StageTimer] = None) -> dict:
+    """
+    Processes the data with the bots and, if available, mailgen, using the database connection conn
+    If given, the durations of the stages are added to the timer.
+    """
+    if timer is None:
+        timer = StageTimer('bots_process')
     bot_logs = io.StringIO()
     log_handler = logging.StreamHandler(stream=bot_logs)
     log_handler.setFormatter(logging.Formatter(LOG_FORMAT_STREAM))
 
-    conn = None
-
-    if cb:
-        mailgen_config = cb.read_configuration(CONFIG.get('mailgen_config_file'))
-        conn = open_db_connection(mailgen_config, connection_factory=RealDictConnection)
-        conn.autocommit = False
+    if mailgen():
+        mailgen_config = read_mailgen_config()
         # find the last directive ID before inserting our new ones
         cur = conn.cursor()
         cur.execute('SELECT id FROM directives ORDER BY id DESC LIMIT 1;')
         last_id = cur.fetchone()['id'] if cur.rowcount else None
 
-    bots = []
-    for bot_id, bot_config in CONFIG.get('bots', {}).items():
-        try:
-            logging.getLogger(bot_id).addHandler(log_handler)
-            if bot_config['module'] == 'intelmq_webinput_csv.sql_output':
-                bot = WebinputSQLOutputBot
-                if not conn:
-                    conn = connect(database=bot_config['parameters']['database'],
-                                   user=bot_config['parameters']['user'],
-                                   password=bot_config['parameters']['password'],
-                                   host=bot_config['parameters']['host'],
-                                   port=bot_config['parameters']['port'],
-                                   connection_factory=RealDictConnection)
-                    conn.autocommit = False
-                kwargs = {'connection': conn}
-            else:
-                module_name = get_bot_module_name(bot_config['module'])
-                if not module_name:
-                    raise ValueError(f"Bot Module {bot_config['module']!r} is not available.")
-                bot = import_module(module_name).BOT
-                kwargs = {}
-            bots.append((bot_id, bot(bot_id, **kwargs, settings=BotLibSettings | {'logging_level': 'DEBUG'} | bot_config.get('parameters', {}))))
-        except Exception:
-            return {'status': 'error',
-                    'log': traceback.format_exc()}
-    bots_input = []
-    for item in data:
-        if not item:
-            return {'status': 'error',
-                    'log': 'No data supplied for at least one row. Did you set fields for the columns?'}
-        # log.info('message before converting: %r', item)
-        retval = {0: defaultdict(list)}
-        first_message, line_valid = row_to_event(item, body, retval)
-        if not line_valid:
-            NEWLINE = '\n'  # SyntaxError: f-string expression part cannot include a backslash
-            return {'status': 'error',
-                    'log': f"Line was not valid:\n{NEWLINE.join(chain.from_iterable(retval[0].values()))}"}
-        bots_input.append(first_message)
+    try:
+        bots = bot_chains.acquire(bots_config, BOT_PROCESS_SETTINGS,
+                                  partial(create_bot_chain, bots_config, BOT_PROCESS_SETTINGS), conn)
+    except PoolTimeout as exc:
+        return {'status': 'error',
+                'log': f'All instances of the bots are in use, please try again later. {exc!s}'}
+    except Exception:
+        return {'status': 'error',
+                'log': traceback.format_exc()}
+    bot_logs.write(bots.init_log)
 
     tracebacks = []
-    for bot_id, bot in bots:
-        if bot.bottype is not BotType.OUTPUT:
-            bots_output = []
-        for message in bots_input:
-            try:
-                queues = bot.process_message(message)
-            except Exception:
-                tracebacks.append(traceback.format_exc())
-            else:
-                # for output bots, the output queue is empty, don't consider it
-                if bot.bottype is not BotType.OUTPUT:
-                    bots_output.extend(queues['output'])
-        bots_input = bots_output
-    if not bots:
-        bots_output = bots_input
-
+    for bot_id, _ in bots:
+        logging.getLogger(bot_id).addHandler(log_handler)
+    try:
+        bots_input = []
+        for item in data:
+            if not item:
+                return {'status': 'error',
+                        'log': 'No data supplied for at least one row. Did you set fields for the columns?'}
+            # log.info('message before converting: %r', item)
+            retval = {0: defaultdict(list)}
+            with timer.measure('convert'):
+                first_message, line_valid = row_to_event(item, body, retval)
+            ROWS.inc(endpoint='bots_process', status='valid' if line_valid else 'invalid')
+            if not line_valid:
+                NEWLINE = '\n'  # SyntaxError: f-string expression part cannot include a backslash
+                return {'status': 'error',
+                        'log': f"Line was not valid:\n{NEWLINE.join(chain.from_iterable(retval[0].values()))}"}
+            bots_input.append(first_message)
+
+        bots_output = []
+        for result in bots.process_batch(bots_input, timer):
+            bots_output.extend(result.outputs)
+            tracebacks.extend(result.tracebacks)
+    finally:
+        for bot_id, _ in bots:
+            logging.getLogger(bot_id).removeHandler(log_handler)
+        bot_chains.release(bots)
+
+    EVENTS.inc(len(bots_output), endpoint='bots_process', status='output')
     retval = {'status': 'error' if (not bots_output and tracebacks) else 'success',
               'messages': bots_output,
               'log': '\n'.join(tracebacks + [bot_logs.getvalue()])}
 
-    if cb:
+    if mailgen():
         mailgen_log = io.StringIO()
         log_handler = logging.StreamHandler(stream=mailgen_log)
         logging.getLogger('intelmqmail').addHandler(log_handler)
@@ -677,14 +1506,15 @@ def process(body) -> dict:
         format_spec = build_format_spec(body.get('assigned_columns'))
 
         retval['log'] += mailgen_log.getvalue().strip()
-        retval['notifications'] = cb.start(mailgen_config, process_all=True,
-                                           template=body.get('template'),
-                                           templates={item['name']: item['body'] for item in body.get('templates', [])},
-                                           get_preview=True,
-                                           conn=conn,
-                                           dry_run=True,
-                                           additional_directive_where=additional_directive_where,
-                                           default_format_spec=format_spec)
+        with timer.measure('mailgen'):
+            retval['notifications'] = cb.start(mailgen_config, process_all=True,
+                                               template=body.get('template'),
+                                               templates={item['name']: item['body'] for item in body.get('templates', [])},
+                                               get_preview=True,
+                                               conn=conn,
+                                               dry_run=True,
+                                               additional_directive_where=additional_directive_where,
+                                               default_format_spec=format_spec)
         # in dry_run, mailgen calls conn.rollback() itself
 
         retval['log'] += mailgen_log.getvalue()
@@ -693,22 +1523,28 @@ def process(body) -> dict:
         retval['notifications'] = []
         if conn:
             # for the SQL output bot, if mailgen was not running
-            conn.rollback()
+            with timer.measure('commit'):
+                conn.rollback()
 
     return retval
 
 
 @hug.get(ENDPOINT_PREFIX + '/api/mailgen/templates', requires=session.token_authentication)
-def get_templates():
+def get_templates(request, response):
     """
     Returns all defined mailgen templates
+    Supports conditional requests with If-None-Match.
     """
-    mailgen_config = cb.read_configuration(CONFIG.get('mailgen_config_file'))
+    mailgen_config = read_mailgen_config()
     template_dir = Path(mailgen_config['template_dir'])
-    retval = {}
-    for template in template_dir.glob('*'):  # iterdir does not work here as that is recursive
-        retval[template.name] = template.read_text()
-    return retval
+    templates, etag = mailgen_files.templates(template_dir)
+    response.set_header('ETag', etag)
+    # weak comparison, as for GET requests
+    if_none_match = [tag.strip().replace('W/', '', 1) for tag in (request.get_header('If-None-Match') or '').split(',')]
+    if '*' in if_none_match or etag in if_none_match:
+        response.status = falcon.HTTP_304
+        return None
+    return templates
 
 
 @hug.put(ENDPOINT_PREFIX + '/api/mailgen/template', requires=session.token_authentication)
@@ -726,9 +1562,9 @@ def set_template(template_name: str, template_body: str, response):
         response.status = falcon.HTTP_403
         return f'Template name does not match regular expression {FILENAME_RE.pattern!r}.'
 
-    mailgen_config = cb.read_configuration(CONFIG.get('mailgen_config_file'))
+    mailgen_config = read_mailgen_config()
     template_dir = Path(mailgen_config['template_dir'])
-    Path(template_dir / template_name.strip()).write_text(template_body.strip(), encoding='utf8')
+    mailgen_files.write_template(template_dir, template_name.strip(), template_body.strip())
 
 
 @hug.delete(ENDPOINT_PREFIX + '/api/mailgen/template', requires=session.token_authentication)
@@ -740,14 +1576,14 @@ def delete_template(template_name: str, response):
         response.status = falcon.HTTP_403
         return f'Template name does not match regular expression {FILENAME_RE.pattern!r}.'
 
-    mailgen_config = cb.read_configuration(CONFIG.get('mailgen_config_file'))
+    mailgen_config = read_mailgen_config()
     template_dir = Path(mailgen_config['template_dir'])
     template_file = Path(template_dir / template_name.strip())
     if not template_file.exists():
         response.status = falcon.HTTP_404
         return f'Template {template_file!s} does not exist'
 
-    template_file.unlink()
+    mailgen_files.delete_template(template_dir, template_name.strip())
 
 
 @hug.get(ENDPOINT_PREFIX + '/api/version')
@@ -8,8 +8,38 @@ This is a special SQL Output Bot which reuses a connection instance
 Use this bot as module intelmq_webinput_csv.sql_output
 """
 
+from collections import OrderedDict
+from hashlib import sha1
+from typing import Optional
+
 from intelmq.bots.outputs.sql.output import SQLOutputBot, itemgetter_tuple
 
+try:
+    from psycopg2.extensions import cursor as tuple_cursor
+    from psycopg2.extras import execute_values
+except ImportError:
+    tuple_cursor = execute_values = None
+
+
+class InsertStatement:
+    """
+    The INSERT statements for one set of fields
+
+    The statement for single events is prepared on the server with the name,
+    the multi-row statement for batches is only formatted once.
+    """
+    __slots__ = ('name', 'prepare_query', 'execute_query', 'bulk_query')
+
+    def __init__(self, table: str, valid_keys: tuple, format_char: str, prefix: str = 'webinput_insert_'):
+        keys = '", "'.join(valid_keys)
+        parameters = ', '.join(f'${index}' for index in range(1, len(valid_keys) + 1))
+        query = f'INSERT INTO {table} ("{keys}") VALUES ({parameters})'
+        # the same statement has the same name for bot instances with the same prefix
+        self.name = prefix + sha1(query.encode()).hexdigest()[:20]
+        self.prepare_query = f'PREPARE {self.name} AS {query}'
+        self.execute_query = f'EXECUTE {self.name} ({", ".join([format_char] * len(valid_keys))})'
+        self.bulk_query = f'INSERT INTO {table} ("{keys}") VALUES %s'
+
 
 class WebinputSQLOutputBot(SQLOutputBot):
     """
@@ -19,23 +49,72 @@ class WebinputSQLOutputBot(SQLOutputBot):
     The bot must not do any error-handling by itself like re-connecting etc.
     If there's a fail, then raise, so the user gets informed.
     Thus, fail_on_errors is always set to true
+
+    Batches of events are inserted with multi-row INSERT statements,
+    with up to bulk_size rows per statement.
+
+    The INSERT statements are cached per set of fields, for up to statement_cache_size sets.
+    Single events are inserted with statements prepared on the server.
     """
+    bulk_size: int = 1000
+    statement_cache_size: int = 100
 
-    def __init__(self, *args, connection: 'psycopg2.extensions.connection', **kwargs):  # noqa: F821
+    def __init__(self, bot_id: str, *args, connection: Optional['psycopg2.extensions.connection'] = None, **kwargs):  # noqa: F821
         """
         Initializes the WebinputSQLOutputBot with a pre-exisiting Postgres Connection
+        The connection can also be given later with bind, before processing.
         """
         if not hasattr(self, 'fail_on_errors'):
             raise ValueError('This version of IntelMQ is too old. At least version 1.2.0 is required.')
         self.fail_on_errors = True
 
-        self.con = connection
         self.autocommit = False
+        # key: tuple of field names, value: InsertStatement, least recently used first
+        self._statements = OrderedDict()
+        # the names of the prepared statements are per bot id, so that bots sharing the
+        # connection don't deallocate the statements of each other
+        self._statement_prefix = f'webinput_insert_{sha1(bot_id.encode()).hexdigest()[:8]}_'
+        self.bind(connection)
+        self._engine = "postgresql"
+        super().__init__(bot_id, *args, **kwargs)
+
+    def bind(self, connection: Optional['psycopg2.extensions.connection']):  # noqa: F821
+        """
+        Uses the given connection for the following messages,
+        so that the bot instance can be reused for multiple requests.
+        """
+        self.con = connection
+        # names of the statements prepared on the connection
+        self._prepared = set()
+        if self.con is None:
+            self.cur = None
+            return
         if self.con.autocommit != self.autocommit:
             self.con.autocommit = False
         self.cur = self.con.cursor()
-        self._engine = "postgresql"
-        super().__init__(*args, **kwargs)
+        # the connection may have been used before, by another instance of this bot
+        with self.con.cursor(cursor_factory=tuple_cursor) as cur:
+            cur.execute("SELECT name FROM pg_prepared_statements WHERE name LIKE %s",
+                        (self._statement_prefix.replace('_', '\\_') + '%', ))
+            self._prepared = {row[0] for row in cur.fetchall()}
+
+    def get_statement(self, valid_keys: tuple) -> InsertStatement:
+        """
+        Returns the cached statements for the fields, evicting the least recently used ones
+        """
+        try:
+            statement = self._statements[valid_keys]
+        except KeyError:
+            statement = InsertStatement(self.table, valid_keys, self.format_char, self._statement_prefix)
+            self._statements[valid_keys] = statement
+            while len(self._statements) > self.statement_cache_size:
+                _, evicted = self._statements.popitem(last=False)
+                if evicted.name in self._prepared:
+                    self._prepared.discard(evicted.name)
+                    self.cur.execute(f'DEALLOCATE {evicted.name}')
+        else:
+            self._statements.move_to_end(valid_keys)
+        return statement
 
     def _init_postgresql(self):
         self.logger.info('Ignoring initialization of postgres connection.')
@@ -56,14 +135,49 @@ class WebinputSQLOutputBot(SQLOutputBot):
         key_names = self.fields
         if key_names is None:
             key_names = event.keys()
-        valid_keys = [key for key in key_names if key in event]
-        keys = '", "'.join(valid_keys)
+        valid_keys = tuple(key for key in key_names if key in event)
+        statement = self.get_statement(valid_keys)
         values = self.prepare_values(itemgetter_tuple(*valid_keys)(event))
-        fvalues = len(values) * f'{self.format_char}, '
-        query = (f'INSERT INTO {self.table} ("{keys}") VALUES ({fvalues[:-2]})')
+        if statement.name not in self._prepared:
+            self.cur.execute(statement.prepare_query)
+            self._prepared.add(statement.name)
 
-        if self.execute(query, values, rollback=not self.fail_on_errors):
+        if self.execute(statement.execute_query, values, rollback=not self.fail_on_errors):
             self.acknowledge_message()
 
+    def process_batch(self, messages: list) -> list:
+        """
+        Inserts all events with the same fields with one multi-row INSERT statement.
+        As for process, the transaction is not committed.
+
+        The inserts are wrapped in a savepoint. If one fails, the inserts of this batch are
+        rolled back and the exception is raised, the events are then inserted one by one
+        with process to find the failing ones.
+        """
+        if execute_values is None:
+            raise ValueError('Could not import psycopg2.extras. Please install it.')
+        # key: tuple of field names, value: list of value tuples
+        groups = {}
+        for message in messages:
+            event = message.to_dict(jsondict_as_string=self.jsondict_as_string)
+            key_names = self.fields
+            if key_names is None:
+                key_names = event.keys()
+            valid_keys = tuple(key for key in key_names if key in event)
+            groups.setdefault(valid_keys, []).append(self.prepare_values(itemgetter_tuple(*valid_keys)(event)))
+
+        self.cur.execute('SAVEPOINT webinput_bulk_insert')
+        try:
+            for valid_keys, rows in groups.items():
+                query = self.get_statement(valid_keys).bulk_query
+                self.logger.debug('Executing %r with %d rows.', query, len(rows))
+                execute_values(self.cur, query, rows, page_size=self.bulk_size)
+        except Exception:
+            self.cur.execute('ROLLBACK TO SAVEPOINT webinput_bulk_insert')
+            raise
+        self.cur.execute('RELEASE SAVEPOINT webinput_bulk_insert')
+        # output bot, no messages are sent
+        return [[] for _ in messages]
+
 
 BOT = WebinputSQLOutputBot
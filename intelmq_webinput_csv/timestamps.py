@@ -0,0 +1,120 @@
+"""
+SPDX-FileCopyrightText: 2026 Bundesamt für Sicherheit in der Informationstechnik
+SPDX-License-Identifier: AGPL-3.0-or-later
+Software engineering by Intevation GmbH <https://intevation.de>
+
+Fast parsing of the timestamps of time.* columns
+
+The values of a column usually all have the same format. TimestampParser learns
+the format of a column from the first values, which are parsed with dateutil by
+the caller. Afterwards, values in this format are parsed with a regular
+expression, all other values are still parsed with dateutil by the caller.
+"""
+from datetime import datetime, timedelta, timezone, tzinfo
+from re import compile
+from typing import Optional
+
+import dateutil.parser
+
+_TIME = r'(?P<hour>\d{1,2}):(?P<minute>\d{2})(?::(?P<second>\d{2})(?:\.(?P<fraction>\d{1,6}))?)?'
+_TZ = r' ?(?P<tz>Z|[+-]\d{2}:?\d{2})?'
+
+# Only formats which dateutil interprets the same way for all matching values,
+# i.e. year first or month first, always with a time of day.
+# dateutil treats a timezone appended to a date without time as a time.
+FORMATS = (
+    # ISO 8601 and variants, e.g. 2024-01-31T12:00:00.123+01:00 or 2024-01-31 12:00
+    compile(r'(?P<year>\d{4})-(?P<month>\d{2})-(?P<day>\d{2})[T ]' + _TIME + _TZ),
+    # 2024/01/31 12:00:00
+    compile(r'(?P<year>\d{4})/(?P<month>\d{1,2})/(?P<day>\d{1,2})[T ]' + _TIME + _TZ),
+    # 01/31/2024 12:00:00 or 01.31.2024 12:00:00, month first like dateutil's default
+    compile(r'(?P<month>\d{1,2})(?P<separator>[/.-])(?P<day>\d{1,2})(?P=separator)(?P<year>\d{4}) ' + _TIME + _TZ),
+)
+
+# number of values per column parsed with dateutil to learn the format
+SAMPLE_SIZE = 10
+
+UTC_DESIGNATOR = 'Z'
+
+
+class TimestampParser:
+    """
+    Parses the values of one time.* column
+
+    parse() returns the value as ISO 8601 formatted string, identical to
+    dateutil.parser.parse(value, fuzzy=True).isoformat(), with the given timezone
+    if the value has none. It returns None for values it can't handle itself,
+    the caller then parses them with dateutil and passes the result to learn().
+    """
+
+    def __init__(self, timezone: str):
+        self.timezone = timezone
+        self.default_tzinfo = None
+        # format: [number of values agreeing with dateutil, number of values disagreeing]
+        self.candidates = {pattern: [0, 0] for pattern in FORMATS}
+        self.samples = 0
+        self.format = None
+        # parsed timezone suffixes of the values
+        self.tzinfos = {}
+
+    def parse(self, value: str) -> Optional[str]:
+        if self.format is None:
+            return None
+        match = self.format.fullmatch(value)
+        if match is None:
+            return None
+        try:
+            return self.build(match)
+        except Exception:
+            return None
+
+    def learn(self, value: str, result: str):
+        """
+        Compares the result of dateutil for value with all known formats,
+        and decides for the best format after SAMPLE_SIZE values.
+        """
+        if self.candidates is None:
+            return
+        for pattern, counts in self.candidates.items():
+            match = pattern.fullmatch(value)
+            if match is None:
+                continue
+            try:
+                agrees = self.build(match) == result
+            except Exception:
+                agrees = False
+            counts[not agrees] += 1
+        self.samples += 1
+        if self.samples >= SAMPLE_SIZE:
+            matching = [(counts[0], pattern) for pattern, counts in self.candidates.items()
+                        if counts[0] and not counts[1]]
+            if matching:
+                self.format = max(matching, key=lambda candidate: candidate[0])[1]
+            self.candidates = None
+
+    def build(self, match) -> str:
+        year, month, day, hour, minute, second, fraction, tz = match.group('year', 'month', 'day', 'hour', 'minute', 'second', 'fraction', 'tz')
+        return datetime(int(year), int(month), int(day), int(hour), int(minute),
+                        int(second) if second else 0,
+                        int(fraction.ljust(6, '0')) if fraction else 0,
+                        self.get_tzinfo(tz)).isoformat()
+
+    def get_tzinfo(self, suffix: Optional[str]) -> tzinfo:
+        try:
+            return self.tzinfos[suffix]
+        except KeyError:
+            pass
+        if suffix is None:
+            # the same timezone object dateutil uses for the value with appended timezone
+            if self.default_tzinfo is None:
+                self.default_tzinfo = dateutil.parser.parse('2000-01-01 00:00' + self.timezone).tzinfo
+                if self.default_tzinfo is None:
+                    raise ValueError(f'Timezone {self.timezone!r} is not usable.')
+            result = self.default_tzinfo
+        elif suffix == UTC_DESIGNATOR:
+            result = timezone.utc
+        else:
+            offset = timedelta(hours=int(suffix[1:3]), minutes=int(suffix[-2:]))
+            result = timezone(-offset if suffix[0] == '-' else offset)
+        self.tzinfos[suffix] = result
+        return result
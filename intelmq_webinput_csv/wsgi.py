@@ -0,0 +1,14 @@
+"""
+SPDX-FileCopyrightText: 2026 Bundesamt für Sicherheit in der Informationstechnik
+SPDX-License-Identifier: AGPL-3.0-or-later
+Software engineering by Intevation GmbH <https://intevation.de>
+
+WSGI application for preforking servers, with the shared state loaded before the fork:
+
+    gunicorn --preload --workers 4 intelmq_webinput_csv.wsgi:application
+
+The resources of each worker are created on its first request.
+"""
+from intelmq_webinput_csv.serve import create_app
+
+application = create_app()
@@ -10,6 +10,12 @@ from unittest import mock
 from hug import test
 
 import intelmq_webinput_csv.serve
+from intelmq.lib.bot import BotLibSettings, ExpertBot
+from intelmq.lib.datatypes import BotType
+from intelmq.lib.message import Event
+
+from intelmq_webinput_csv.bots import BotChain, BotChainCache
+from intelmq_webinput_csv.sql_output import WebinputSQLOutputBot
 from .test_main import CONFIG, CONFIG_SIMPLE
 
 EXAMPLE_DATA_URL = [
@@ -101,6 +107,20 @@ def test_process_bot():
                            'messages': EXAMPLE_DATA_URL_PROCESSED}
 
 
+def test_process_bot_timing():
+    """
+    The time spent in each bot is sent in the Server-Timing header
+    """
+    with mock.patch('webinput_session.session.skip_authentication', new=True):
+        with mock.patch('intelmq_webinput_csv.serve.CONFIG', new=CONFIG | BOTS_CONFIG):
+            result = test.call('POST', intelmq_webinput_csv.serve, '/api/bots/process/', body={'data': EXAMPLE_DATA_URL,
+                                                                                               'custom': {},
+                                                                                               'dryrun': True})
+    assert result.status == '200 OK'
+    stages = [metric.split(';')[0] for metric in result.headers_dict['Server-Timing'].split(', ')]
+    assert stages == ['parse', 'convert', 'bot.url', 'bot.taxonomy', 'bot.format-field', 'bot.remove-affix', 'total']
+
+
 def test_process_bot_multi_messages():
     """
     test /api/bots/process/ with multiple bots and multiple messages
@@ -121,6 +141,87 @@ def test_process_bot_multi_messages():
                            'messages': EXAMPLE_DATA_URL_PROCESSED * 2}
 
 
+def test_process_bot_reused():
+    """
+    The bots are initialized once and reused for the following requests, the initialization log is still returned
+    """
+    with mock.patch('webinput_session.session.skip_authentication', new=True), \
+            mock.patch('intelmq_webinput_csv.serve.bot_chains', new=BotChainCache()), \
+            mock.patch('intelmq_webinput_csv.serve.create_bot_chain', wraps=intelmq_webinput_csv.serve.create_bot_chain) as create_bot_chain:
+        with mock.patch('intelmq_webinput_csv.serve.CONFIG', new=CONFIG | BOT_CONFIG):
+            for _ in range(2):
+                result = test.call('POST', intelmq_webinput_csv.serve, '/api/bots/process/', body={'data': EXAMPLE_DATA_URL,
+                                                                                                   'custom': {},
+                                                                                                   'dryrun': True})
+                assert result.status == '200 OK'
+                assert result.data['status'] == 'success'
+                assert 'URLExpertBot initialized with id url' in result.data['log']
+        create_bot_chain.assert_called_once()
+        with mock.patch('intelmq_webinput_csv.serve.CONFIG', new=CONFIG | BOTS_CONFIG):
+            result = test.call('POST', intelmq_webinput_csv.serve, '/api/bots/process/', body={'data': EXAMPLE_DATA_URL,
+                                                                                               'custom': {},
+                                                                                               'dryrun': True})
+        assert result.status == '200 OK'
+        assert create_bot_chain.call_count == 2
+
+
+class SendAndFailExpertBot(ExpertBot):
+    """
+    Sends every event and fails afterwards for one IP address
+    """
+
+    def process(self):
+        event = self.receive_message()
+        self.send_message(event)
+        if event['source.ip'] == '10.0.0.1':
+            raise ValueError('failed after sending')
+        self.acknowledge_message()
+
+
+def test_bot_chain_raised_outputs():
+    """
+    The messages a bot sent before raising are not returned by the next call of the reused chain
+    """
+    bot_chain = BotChain([('send-and-fail', SendAndFailExpertBot('send-and-fail', settings=BotLibSettings))])
+    results = bot_chain.process_batch([Event({'source.ip': '10.0.0.1'})])
+    assert results[0].failed_bot == 'send-and-fail'
+    results = bot_chain.process_batch([Event({'source.ip': '192.0.2.1'})])
+    assert [dict(event) for event in results[0].outputs] == [{'source.ip': '192.0.2.1'}]
+
+
+class BatchSendAndFailExpertBot(SendAndFailExpertBot):
+    """
+    Sends all events of a batch and fails afterwards
+    """
+
+    def process_batch(self, messages):
+        for message in messages:
+            self.send_message(message)
+        raise ValueError('batch failed after sending')
+
+
+def test_bot_chain_raised_batch_outputs():
+    """
+    The messages sent by a failed batch are not returned when the messages are processed one by one
+    """
+    bot_chain = BotChain([('send-and-fail', BatchSendAndFailExpertBot('send-and-fail', settings=BotLibSettings))])
+    results = bot_chain.process_batch([Event({'source.ip': '192.0.2.1'}), Event({'source.ip': '192.0.2.2'})])
+    outputs = [[dict(event) for event in result.outputs] for result in results]
+    assert outputs == [[{'source.ip': '192.0.2.1'}], [{'source.ip': '192.0.2.2'}]]
+
+
+def test_bot_chain_shutdown():
+    """
+    The bots are shut down when the chains of an old configuration are discarded
+    """
+    bot = mock.Mock()
+    bot_chains = BotChainCache()
+    with bot_chains.lease({'a': {}}, {}, lambda: BotChain([('a', bot)])):
+        pass
+    bot_chains.get_pool({'b': {}}, {}, lambda: BotChain([]))
+    bot.shutdown.assert_called_once_with()
+
+
 def test_bots_library():
     with mock.patch('webinput_session.session.skip_authentication', new=True):
         with mock.patch('intelmq_webinput_csv.serve.CONFIG', new=CONFIG | BOTS_CONFIG):
@@ -300,3 +401,104 @@ def test_bot_empty_output_valid():
     assert result.status == '200 OK'
     assert result.data['input_lines_invalid'] == 0
     assert result.data['output_lines_invalid'] == 0
+
+
+class BatchExpert:
+    """
+    Bot with a batch method, duplicating every message and failing on messages with 'fail' in them
+    """
+    bottype = BotType.EXPERT
+
+    def __init__(self):
+        self.batches = []
+
+    def process_batch(self, messages):
+        if any('fail' in message for message in messages):
+            raise ValueError('batch failed')
+        self.batches.append(len(messages))
+        return [[message, message] for message in messages]
+
+    def process_message(self, message):
+        if 'fail' in message:
+            raise ValueError('message failed')
+        return {'output': [message]}
+
+
+def test_chain_process_batch():
+    """
+    Batches are processed stage by stage, with fallback to single messages
+    """
+    bot = BatchExpert()
+    results = BotChain([('batch', bot), ('second', bot)]).process_batch([{'a': 1}, {'b': 2}])
+    assert bot.batches == [2, 4]
+    assert [len(result.outputs) for result in results] == [4, 4]
+
+    results = BotChain([('batch', bot)]).process_batch([{'a': 1}, {'fail': 2}])
+    assert results[0].outputs == [{'a': 1}]
+    assert results[0].failed_bot is None
+    assert results[1].outputs == []
+    assert results[1].failed_bot == 'batch'
+    assert 'message failed' in results[1].tracebacks[0]
+
+
+def test_sql_output_process_batch():
+    """
+    Events with the same fields are inserted with one statement, without commit
+    """
+    connection = mock.MagicMock(autocommit=False)
+    bot = WebinputSQLOutputBot('sql', settings=BotLibSettings | {'engine': 'postgresql', 'table': 'events'},
+                               connection=connection)
+    events = [Event({'source.ip': '192.0.2.1'}), Event({'source.ip': '192.0.2.2'}),
+              Event({'source.ip': '192.0.2.3', 'source.port': 80})]
+    with mock.patch('intelmq_webinput_csv.sql_output.execute_values') as execute_values:
+        assert bot.process_batch(events) == [[], [], []]
+    assert execute_values.call_args_list == [
+        mock.call(connection.cursor(), 'INSERT INTO events ("source.ip") VALUES %s',
+                  [['192.0.2.1'], ['192.0.2.2']], page_size=1000),
+        mock.call(connection.cursor(), 'INSERT INTO events ("source.ip", "source.port") VALUES %s',
+                  [['192.0.2.3', 80]], page_size=1000),
+    ]
+    assert connection.cursor().execute.call_args_list == [mock.call('SAVEPOINT webinput_bulk_insert'),
+                                                          mock.call('RELEASE SAVEPOINT webinput_bulk_insert')]
+    connection.commit.assert_not_called()
+
+
+def test_sql_output_prepared_statements():
+    """
+    The INSERT statements are prepared once per set of fields, and deallocated when evicted from the cache
+    """
+    connection = mock.MagicMock(autocommit=False)
+    bot = WebinputSQLOutputBot('sql', settings=BotLibSettings | {'engine': 'postgresql', 'table': 'events',
+                                                                 'statement_cache_size': 1},
+                               connection=connection)
+    cursor = connection.cursor()
+    bot.process_message(Event({'source.ip': '192.0.2.1'}))
+    bot.process_message(Event({'source.ip': '192.0.2.2'}))
+    name = bot.get_statement(('source.ip', )).name
+    assert cursor.execute.call_args_list == [
+        mock.call(f'PREPARE {name} AS INSERT INTO events ("source.ip") VALUES ($1)'),
+        mock.call(f'EXECUTE {name} (%s)', ['192.0.2.1']),
+        mock.call(f'EXECUTE {name} (%s)', ['192.0.2.2']),
+    ]
+    cursor.reset_mock()
+    bot.process_message(Event({'source.ip': '192.0.2.3', 'source.port': 80}))
+    other_name = bot.get_statement(('source.ip', 'source.port')).name
+    assert cursor.execute.call_args_list == [
+        mock.call(f'DEALLOCATE {name}'),
+        mock.call(f'PREPARE {other_name} AS INSERT INTO events ("source.ip", "source.port") VALUES ($1, $2)'),
+        mock.call(f'EXECUTE {other_name} (%s, %s)', ['192.0.2.3', 80]),
+    ]
+    connection.commit.assert_not_called()
+
+
+def test_sql_output_statement_names():
+    """
+    Bots sharing a connection use their own names for the prepared statements
+    """
+    connection = mock.MagicMock(autocommit=False)
+    settings = BotLibSettings | {'engine': 'postgresql', 'table': 'events'}
+    bot = WebinputSQLOutputBot('sql', settings=settings, connection=connection)
+    other_bot = WebinputSQLOutputBot('sql-archive', settings=settings, connection=connection)
+    name = bot.get_statement(('source.ip', )).name
+    assert name != other_bot.get_statement(('source.ip', )).name
+    assert name == WebinputSQLOutputBot('sql', settings=settings).get_statement(('source.ip', )).name
@@ -0,0 +1,33 @@
+"""
+Tests for the TTL cache
+
+SPDX-FileCopyrightText: 2026 Bundesamt für Sicherheit in der Informationstechnik
+SPDX-License-Identifier: AGPL-3.0-or-later
+Software engineering by Intevation GmbH <https://intevation.de>
+"""
+from unittest import mock
+
+import pytest
+
+from intelmq_webinput_csv.cache import TTLCache
+
+
+def test_cache():
+    cache = TTLCache(duration=60)
+    compute = mock.Mock(side_effect=[1, 2, 3])
+    assert cache.get('a', compute) == 1
+    assert cache.get('a', compute) == 1
+    cache.invalidate('a')
+    assert cache.get('a', compute) == 2
+    with mock.patch('intelmq_webinput_csv.cache.time.monotonic', return_value=float('inf')):
+        assert cache.get('a', compute) == 3
+
+
+def test_cache_exception():
+    """
+    Exceptions are not cached
+    """
+    cache = TTLCache()
+    with pytest.raises(ValueError):
+        cache.get('a', mock.Mock(side_effect=ValueError))
+    assert cache.get('a', lambda: 1) == 1
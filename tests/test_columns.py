@@ -0,0 +1,49 @@
+"""
+Tests for the column plan
+
+SPDX-FileCopyrightText: 2026 Bundesamt für Sicherheit in der Informationstechnik
+SPDX-License-Identifier: AGPL-3.0-or-later
+Software engineering by Intevation GmbH <https://intevation.de>
+"""
+import pytest
+
+from intelmq.lib.exceptions import InvalidValue
+from intelmq.lib.message import Event
+
+from intelmq_webinput_csv.columns import ColumnPlan
+from intelmq_webinput_csv.serve import HARMONIZATION_CONF
+
+VALUES = [('source.ip', '127.0.0.1'), ('source.ip', '1270.0.0.1'), ('source.ip', ' 127.0.0.1 '),
+          ('source.asn', '1'), ('source.asn', 'AS1'), ('source.asn', 'x'), ('source.port', '-'),
+          ('classification.type', 'Undetermined'), ('classification.type', 'foo'),
+          ('time.source', '2024-01-31T10:00:00+01:00'), ('feed.code', 'x' * 200),
+          ('extra.foo', 'bar'), ('extra', '{"foo": "bar"}'), ('source.fqdn', 'example.com.')]
+
+
+@pytest.mark.parametrize('key,value', VALUES)
+def test_same_as_event_add(key, value):
+    """
+    The columns add the values like Event.add, with the same errors
+    """
+    expected = Event(harmonization=HARMONIZATION_CONF)
+    try:
+        expected.add(key, value)
+    except InvalidValue as exc:
+        expected = str(exc)
+
+    column = ColumnPlan(HARMONIZATION_CONF, HARMONIZATION_CONF).get(key)
+    event = Event(harmonization=HARMONIZATION_CONF)
+    try:
+        column.add(event, value)
+    except InvalidValue as exc:
+        event = str(exc)
+    assert event == expected
+
+
+def test_invalid_key():
+    plan = ColumnPlan(HARMONIZATION_CONF, HARMONIZATION_CONF)
+    assert plan.get('source.foo') is None
+    assert plan.get('source.foo') is None
+    assert list(plan.column_errors) == ['source.foo']
+    assert plan.get('source.ip').is_time is False
+    assert plan.get('time.source').is_time is True
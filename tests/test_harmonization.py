@@ -0,0 +1,67 @@
+"""
+Tests for the harmonization snapshot and the startup
+
+SPDX-FileCopyrightText: 2026 Bundesamt für Sicherheit in der Informationstechnik
+SPDX-License-Identifier: AGPL-3.0-or-later
+Software engineering by Intevation GmbH <https://intevation.de>
+"""
+import json
+import os
+import subprocess
+import sys
+from unittest import mock
+
+from intelmq_webinput_csv.harmonization import load_harmonization
+
+HARMONIZATION = {'event': {'source.ip': {'type': 'IPAddress'}, 'source.asn': {'type': 'ASN'}},
+                 'report': {'raw': {'type': 'Base64'}}}
+
+
+def test_snapshot(tmp_path):
+    source = tmp_path / 'harmonization.conf'
+    source.write_text(json.dumps(HARMONIZATION))
+    snapshot = tmp_path / 'cache' / 'harmonization.json'
+    with mock.patch('intelmq_webinput_csv.harmonization.load_configuration',
+                    side_effect=lambda path: json.loads(path.read_text())) as load_configuration:
+        harmonization, event_harmonization = load_harmonization(source, snapshot_path=snapshot)
+        assert harmonization == event_harmonization == HARMONIZATION
+        assert load_harmonization(source, snapshot_path=snapshot) == (HARMONIZATION, HARMONIZATION)
+        assert load_configuration.call_count == 1
+
+        # other allowed fields
+        harmonization, event_harmonization = load_harmonization(source, ['source.ip'], snapshot_path=snapshot)
+        assert event_harmonization == {'event': {'source.ip': {'type': 'IPAddress'}}}
+        assert load_harmonization(source, ['source.ip'], snapshot_path=snapshot)[1] == event_harmonization
+        assert load_configuration.call_count == 2
+
+        # changed harmonization
+        os.utime(source, ns=(0, 0))
+        load_harmonization(source, ['source.ip'], snapshot_path=snapshot)
+        assert load_configuration.call_count == 3
+
+        # without snapshot
+        load_harmonization(source)
+        assert load_configuration.call_count == 4
+
+
+def test_snapshot_not_writable(tmp_path):
+    source = tmp_path / 'harmonization.conf'
+    source.write_text(json.dumps(HARMONIZATION))
+    (tmp_path / 'file').touch()
+    with mock.patch('intelmq_webinput_csv.harmonization.load_configuration', return_value=HARMONIZATION), \
+            mock.patch('intelmq_webinput_csv.harmonization.log') as log:
+        for _ in range(2):
+            assert load_harmonization(source, snapshot_path=tmp_path / 'file' / 'harmonization.json') == (HARMONIZATION, HARMONIZATION)
+    log.warning.assert_called_once()
+
+
+def test_lazy_imports():
+    """
+    intelmqmail and the bots are not imported on startup
+    """
+    modules = subprocess.run([sys.executable, '-c', 'import sys, intelmq_webinput_csv.serve; print(" ".join(sys.modules))'],
+                             capture_output=True, check=True, text=True).stdout.split()
+    assert 'intelmq_webinput_csv.serve' in modules
+    for module in ('intelmqmail', 'intelmq.lib.bot', 'intelmq.bots.experts.taxonomy.expert',
+                   'intelmq_webinput_csv.sql_output', 'intelmq_webinput_csv.preview', 'intelmq_webinput_csv.data'):
+        assert module not in modules
@@ -5,11 +5,21 @@ SPDX-FileCopyrightText: 2023 Bundesamt für Sicherheit in der Informationstechni
 SPDX-License-Identifier: AGPL-3.0-or-later
 Software engineering by Intevation GmbH <https://intevation.de>
 """
-from json import dumps
+import datetime
+import re
+from json import dumps, loads
+from pathlib import Path
 from unittest import mock
+
+import pytest
+from dateutil.parser import isoparse
 from hug import test
 
 import intelmq_webinput_csv.serve
+from intelmq_webinput_csv.mailgen_files import MailgenFiles
+from intelmq_webinput_csv.pool import Pool
+from intelmq_webinput_csv.preview import PreparedEvent, PreviewRenderer, directives_from_row
+from intelmq_webinput_csv.data import EXAMPLE_CERTBUND_EVENT
 
 
 def test_delete_template_invalid_filename():
@@ -23,3 +33,237 @@ def test_save_template_invalid_filename():
         result = test.call('PUT', intelmq_webinput_csv.serve, '/api/mailgen/template', body=dumps({'template_name': '/etc/passwd',
                                                                                                    'template_body': ''}), headers={"content-type": "application/json"})
     assert result.status == '403 Forbidden'
+
+
+def test_templates_cached(tmp_path):
+    """
+    The templates are read again only when changed, the ETag allows conditional requests
+    """
+    (tmp_path / 'a').write_text('template a')
+    (tmp_path / '.hidden').write_text('hidden template')
+    (tmp_path / 'directory').mkdir()
+    mailgen_files = MailgenFiles(read=lambda path: {'template_dir': str(tmp_path)})
+    with mock.patch('webinput_session.session.skip_authentication', new=True), \
+            mock.patch('intelmq_webinput_csv.serve.mailgen_files', new=mailgen_files), \
+            mock.patch('intelmq_webinput_csv.serve.CONFIG', new={'mailgen_multi_templates_enabled': True}):
+        result = test.call('GET', intelmq_webinput_csv.serve, '/api/mailgen/templates')
+        assert result.data == {'a': 'template a', '.hidden': 'hidden template'}
+        etag = result.headers_dict['ETag']
+
+        result = test.call('GET', intelmq_webinput_csv.serve, '/api/mailgen/templates', headers={'If-None-Match': etag})
+        assert result.status == '304 Not Modified'
+
+        result = test.call('PUT', intelmq_webinput_csv.serve, '/api/mailgen/template',
+                           body=dumps({'template_name': 'b', 'template_body': 'template b'}), headers={"content-type": "application/json"})
+        assert result.status == '200 OK'
+        with mock.patch('intelmq_webinput_csv.mailgen_files.Path.read_text') as read_text:
+            result = test.call('GET', intelmq_webinput_csv.serve, '/api/mailgen/templates', headers={'If-None-Match': etag})
+        read_text.assert_not_called()
+        assert result.data == {'a': 'template a', '.hidden': 'hidden template', 'b': 'template b'}
+        assert result.headers_dict['ETag'] != etag
+
+        result = test.call('DELETE', intelmq_webinput_csv.serve, '/api/mailgen/template', body={'template_name': 'a'})
+        assert result.status == '200 OK'
+        assert not (tmp_path / 'a').exists()
+        result = test.call('GET', intelmq_webinput_csv.serve, '/api/mailgen/templates')
+        assert result.data == {'.hidden': 'hidden template', 'b': 'template b'}
+
+
+def test_config_cached(tmp_path):
+    config_file = tmp_path / 'mailgen.conf'
+    config_file.write_text('{"template_dir": "a"}')
+    read = mock.Mock(side_effect=lambda path: loads(Path(path).read_text()))
+    mailgen_files = MailgenFiles(read=read)
+    assert mailgen_files.config(str(config_file)) == {'template_dir': 'a'}
+    assert mailgen_files.config(str(config_file)) == {'template_dir': 'a'}
+    assert read.call_count == 1
+    config_file.write_text('{"template_dir": "bb"}')
+    assert mailgen_files.config(str(config_file)) == {'template_dir': 'bb'}
+
+
+def test_preview_reuses_connection():
+    """
+    The database connection is taken from the pool and not closed by mailgen
+    """
+    cb = mock.Mock()
+    cb.start.side_effect = lambda *args, conn, **kwargs: conn.close() or ['notification']
+    with mock.patch('webinput_session.session.skip_authentication', new=True), \
+            mock.patch('intelmq_webinput_csv.serve.cb', new=cb), \
+            mock.patch('intelmq_webinput_csv.serve.build_table_format', create=True), \
+            mock.patch('intelmq_webinput_csv.serve.read_mailgen_config', return_value={'database': {}}), \
+            mock.patch('intelmq_webinput_csv.serve.open_db_connection', create=True) as open_db_connection, \
+            mock.patch('intelmq_webinput_csv.serve.mailgen_db_pool', new=Pool(intelmq_webinput_csv.serve.create_mailgen_db_connection)):
+        open_db_connection.return_value.closed = 0
+        for _ in range(2):
+            result = test.call('POST', intelmq_webinput_csv.serve, '/api/mailgen/preview', body={'template': 'Subject\nBody'})
+            assert result.data['result'] == 'notification'
+    open_db_connection.assert_called_once()
+    open_db_connection.return_value.close.assert_not_called()
+    assert open_db_connection.return_value.rollback.call_count == 4
+
+
+def test_prepared_event():
+    prepared = PreparedEvent(EXAMPLE_CERTBUND_EVENT)
+    assert isinstance(prepared.values['extra'], str)
+    assert prepared.row['extra']['nothing'] == 'here'
+    assert prepared.row['time.source'].year == 2023
+    assert len(prepared.directives) == 1
+    directive = prepared.directives[0]
+    assert directive['recipient_address'] == 'provider@localhost'
+    assert directive['notification_interval'].days == 1
+    assert directive['aggregate_identifier']['source.port'] == '80'
+    assert directive['aggregate_identifier']['source.tor_node'] == 'false'
+
+
+def test_preview_in_memory():
+    """
+    If the preview can be rendered in memory, the database is not used, the example event is prepared once
+    """
+    renderer = PreviewRenderer()
+    create_example_event = mock.Mock(wraps=intelmq_webinput_csv.serve.create_example_event)
+    pool = mock.Mock()
+    with mock.patch('webinput_session.session.skip_authentication', new=True), \
+            mock.patch('intelmq_webinput_csv.serve.cb', new=mock.Mock()), \
+            mock.patch('intelmq_webinput_csv.serve.build_table_format', create=True), \
+            mock.patch('intelmq_webinput_csv.serve.read_mailgen_config', return_value={'database': {}}), \
+            mock.patch('intelmq_webinput_csv.serve.create_example_event', new=create_example_event), \
+            mock.patch('intelmq_webinput_csv.serve.preview_renderer', new=renderer), \
+            mock.patch.object(renderer, 'render', return_value='Subject: preview') as render, \
+            mock.patch('intelmq_webinput_csv.serve.mailgen_db_pool', new=pool):
+        for _ in range(2):
+            result = test.call('POST', intelmq_webinput_csv.serve, '/api/mailgen/preview',
+                               body={'template': 'Subject\nBody', 'data': {'source.ip': '192.0.2.1'}})
+            assert result.data['result'] == 'Subject: preview'
+    create_example_event.assert_called_once_with({'source.ip': '192.0.2.1'})
+    assert render.call_args.args[1].row['source.ip'] == '192.0.2.1'
+    pool.acquire.assert_not_called()
+
+
+PREVIEW_SCRIPTS = {
+    '10format.py': '''
+def create_notifications(context):
+    return context.mail_format_as_csv(context.default_format_spec)
+''',
+    '10database.py': '''
+def create_notifications(context):
+    context.db_cursor.execute('SELECT 1')
+    return context.mail_format_as_csv(context.default_format_spec)
+''',
+    '10postponed.py': '''
+from intelmqmail.notification import Postponed
+
+
+def create_notifications(context):
+    return Postponed
+''',
+}
+
+
+class PreviewDatabase:
+    """
+    Connection and cursor answering the statements of the preview and of mailgen with the inserted example event
+    """
+
+    def __init__(self):
+        self.closed = 0
+        self.statements = []
+        self.event = None
+        self.rowcount = 0
+        self.result = []
+
+    def cursor(self):
+        return self
+
+    def execute(self, statement, parameters=None):
+        self.statements.append(statement)
+        self.result = []
+        if statement.startswith('INSERT INTO events'):
+            # the types psycopg2 returns for the json and timestamp columns
+            self.event = dict(zip(re.findall('"([^"]+)"', statement), parameters))
+            self.event['extra'] = loads(self.event['extra'])
+            for key, value in self.event.items():
+                if key.startswith('time.'):
+                    self.event[key] = isoparse(value)
+        elif statement.startswith('SELECT id FROM directives'):
+            self.result = [{'id': 17}]
+        elif 'array_agg(d.id) AS directive_ids' in statement:
+            # the pending directives, with ids of the database
+            directive = directives_from_row(self.event)[0]
+            directive.update(event_ids=[42], directive_ids=[17, 18],
+                             inserted_at=directive['inserted_at'] - datetime.timedelta(seconds=1))
+            self.result = [directive]
+        elif 'FROM events WHERE id = ANY' in statement:
+            columns = re.findall('"([^"]+)"', statement.split('FROM')[0])
+            self.result = [{column: self.event.get(column) for column in columns} if columns else dict(self.event)]
+        elif 'nextval' in statement:
+            today = f'{datetime.datetime.now(datetime.timezone.utc):%Y%m%d}'
+            self.result = [{'date': today, 'init_date': today, 'nextval': 0}]
+        self.rowcount = len(self.result)
+
+    def fetchone(self):
+        return self.result[0]
+
+    def fetchall(self):
+        return self.result
+
+    def close(self):
+        pass
+
+    def rollback(self):
+        pass
+
+
+def test_preview_matches_database(tmp_path):
+    """
+    The preview rendered in memory equals the one rendered with the database, which is used if a script needs it
+    """
+    pytest.importorskip('intelmqmail.cb')
+    from intelmqmail import cb
+    from intelmqmail.tableformat import build_table_format
+
+    mailgen_config = {'database': {},
+                      'openpgp': {'always_sign': False, 'gnupg_home': str(tmp_path), 'signing_key': ''},
+                      'script_directory': str(tmp_path / 'scripts'),
+                      'sender': 'mailgen@localhost',
+                      'smtp': {'host': 'localhost', 'port': 25}}
+    (tmp_path / 'scripts').mkdir()
+
+    def preview(script: str) -> tuple:
+        for path in (tmp_path / 'scripts').iterdir():
+            path.unlink()
+        (tmp_path / 'scripts' / script).write_text(PREVIEW_SCRIPTS[script])
+        database = PreviewDatabase()
+        pool = mock.Mock()
+        pool.lease.return_value.__enter__ = mock.Mock(return_value=database)
+        pool.lease.return_value.__exit__ = mock.Mock(return_value=False)
+        with mock.patch('webinput_session.session.skip_authentication', new=True), \
+                mock.patch('intelmq_webinput_csv.serve.cb', new=cb), \
+                mock.patch('intelmq_webinput_csv.serve.build_table_format', new=build_table_format, create=True), \
+                mock.patch('intelmq_webinput_csv.serve.read_mailgen_config', return_value=mailgen_config), \
+                mock.patch('intelmq_webinput_csv.serve.preview_renderer', new=PreviewRenderer()), \
+                mock.patch('intelmq_webinput_csv.serve.mailgen_db_pool', new=pool), \
+                mock.patch('intelmqmail.cb.smtplib.SMTP'), \
+                mock.patch('intelmqmail.mail.formatdate', return_value='Thu, 01 Jan 2026 00:00:00 +0000'), \
+                mock.patch('intelmqmail.mail.make_msgid', return_value='<preview@localhost>'):
+            result = test.call('POST', intelmq_webinput_csv.serve, '/api/mailgen/preview',
+                               body={'template': 'Subject ${ticket_number}\nBody\n${events_as_csv}'})
+        return result, pool.lease.called, database
+
+    result, database_used, _ = preview('10format.py')
+    assert result.status == '200 OK'
+    assert not database_used
+    in_memory = result.data['result']
+    assert 'Subject: Subject ' in in_memory
+    assert 'provider@localhost' in in_memory
+
+    # the same script with the database, by accessing the cursor
+    result, database_used, database = preview('10database.py')
+    assert result.status == '200 OK'
+    assert database_used
+    assert 'SELECT 1' in database.statements
+    assert result.data['result'] == in_memory
+
+    # postponed notifications are not rendered in memory, mailgen does not render them either
+    _, database_used, database = preview('10postponed.py')
+    assert database_used
+    assert any(statement.startswith('INSERT INTO events') for statement in database.statements)
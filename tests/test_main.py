@@ -5,12 +5,17 @@ SPDX-FileCopyrightText: 2023 Bundesamt für Sicherheit in der Informationstechni
 SPDX-License-Identifier: AGPL-3.0-or-later
 Software engineering by Intevation GmbH <https://intevation.de>
 """
+from concurrent.futures import ProcessPoolExecutor
+from json import dumps
 from unittest import mock
 from pathlib import Path
 from os import environ
+from time import sleep
 from hug import test
 
 import intelmq_webinput_csv.serve
+from intelmq_webinput_csv.cache import TTLCache
+from intelmq_webinput_csv.pool import Pool
 
 
 CONFIG_SIMPLE = {
@@ -102,7 +107,8 @@ def test_submit_auth():
 
 
 def test_constant_fields():
-    with mock.patch('intelmq_webinput_csv.serve.PipelineFactory') as pipeline_mock:
+    with mock.patch('intelmq_webinput_csv.serve.PipelineFactory') as pipeline_mock, \
+            mock.patch('intelmq_webinput_csv.serve.destination_pipeline_pool', new=Pool(intelmq_webinput_csv.serve.create_destination_pipeline)):
         with mock.patch('webinput_session.session.skip_verify_user', new=True):
             with mock.patch('webinput_session.session.skip_authentication', new=True):
                 with mock.patch('intelmq_webinput_csv.serve.CONFIG', new=CONFIG):
@@ -124,6 +130,34 @@ def test_constant_fields():
     assert result.data['input_lines_invalid'] == 0
 
 
+def test_custom_fields():
+    """
+    Custom fields are added to rows not having the field, invalid custom fields make these rows invalid
+    """
+    with mock.patch('webinput_session.session.skip_authentication', new=True):
+        with mock.patch('intelmq_webinput_csv.serve.CONFIG', new=CONFIG):
+            result = test.call('POST', intelmq_webinput_csv.serve, '/api/upload/', body={'submit': False,
+                                                                                         'data': EXAMPLE_DATA + EXAMPLE_DATA_ASNAME,
+                                                                                         'custom': {'custom_source.as_name': 'Custom AS',
+                                                                                                    'custom_source.asn': 'invalid'},
+                                                                                         'dryrun': True,
+                                                                                         })
+    assert result.status == '200 OK'
+    assert result.data['input_lines_invalid'] == 0
+    with mock.patch('webinput_session.session.skip_authentication', new=True):
+        with mock.patch('intelmq_webinput_csv.serve.CONFIG', new=CONFIG):
+            result = test.call('POST', intelmq_webinput_csv.serve, '/api/upload/', body={'submit': False,
+                                                                                         'data': [{'source.ip': '127.0.0.1'}] + EXAMPLE_DATA,
+                                                                                         'custom': {'custom_source.as_name': 'Custom AS',
+                                                                                                    'custom_source.asn': 'invalid'},
+                                                                                         'dryrun': True,
+                                                                                         })
+    assert result.status == '200 OK'
+    assert result.data['input_lines_invalid'] == 1
+    assert list(result.data['errors']) == ['0']
+    assert result.data['errors']['0']['-1'][0].startswith("Failed to add data 'invalid' as field 'source.asn'")
+
+
 def test_preview_invalid():
     with mock.patch('webinput_session.session.skip_authentication', new=True):
         with mock.patch('intelmq_webinput_csv.serve.CONFIG', new=CONFIG):
@@ -147,3 +181,155 @@ def test_version():
     assert '.' in result.data
     # should only contain one line of data
     assert '\n' not in result.data.strip()
+
+
+def test_submit_batches():
+    """
+    The events are sent to the pipeline in chunks of destination_pipeline_batch_size
+    """
+    with mock.patch('intelmq_webinput_csv.serve.session.session_store'):
+        with mock.patch('webinput_session.session.skip_verify_user', new=True):
+            with mock.patch('webinput_session.session.skip_authentication', new=True):
+                with mock.patch('intelmq_webinput_csv.serve.CONFIG', new=CONFIG | {'destination_pipeline_batch_size': 2}):
+                    result = test.call('POST', intelmq_webinput_csv.serve, '/api/upload/', body={'submit': True,
+                                                                                                 'data': EXAMPLE_DATA_ASNAME * 3 + EXAMPLE_DATA_INVALID,
+                                                                                                 'dryrun': True,
+                                                                                                 'custom': {}
+                                                                                                 })
+    assert result.status == '200 OK'
+    assert result.data['input_lines_invalid'] == 1
+    assert result.data['submitted_chunks'] == [2, 1]
+
+
+def test_submit_reuses_pipeline():
+    """
+    The destination pipeline is created once and reused for subsequent uploads
+    """
+    with mock.patch('intelmq_webinput_csv.serve.PipelineFactory') as pipeline_mock, \
+            mock.patch('intelmq_webinput_csv.serve.destination_pipeline_pool', new=Pool(intelmq_webinput_csv.serve.create_destination_pipeline)):
+        with mock.patch('webinput_session.session.skip_verify_user', new=True):
+            with mock.patch('webinput_session.session.skip_authentication', new=True):
+                with mock.patch('intelmq_webinput_csv.serve.CONFIG', new=CONFIG):
+                    for _ in range(2):
+                        result = test.call('POST', intelmq_webinput_csv.serve, '/api/upload/', body={'submit': True,
+                                                                                                     'data': EXAMPLE_DATA_ASNAME,
+                                                                                                     'dryrun': True,
+                                                                                                     'custom': {}
+                                                                                                     })
+                        assert result.status == '200 OK'
+    pipeline_mock.create.assert_called_once()
+    assert pipeline_mock.create.return_value.send.call_count == 2
+
+
+def test_conversion_processes():
+    """
+    The conversion in separate processes gives the same result as the direct conversion
+    """
+    body = {'submit': False,
+            'data': EXAMPLE_DATA_ASNAME * 2 + EXAMPLE_DATA_INVALID + [{}] + EXAMPLE_DATA_ASNAME,
+            'dryrun': True,
+            'custom': {}
+            }
+    with mock.patch('webinput_session.session.skip_verify_user', new=True):
+        with mock.patch('webinput_session.session.skip_authentication', new=True):
+            with mock.patch('intelmq_webinput_csv.serve.CONFIG', new=CONFIG):
+                expected = test.call('POST', intelmq_webinput_csv.serve, '/api/upload/', body=body)
+            with ProcessPoolExecutor(max_workers=2) as conversion_pool, \
+                    mock.patch('intelmq_webinput_csv.serve.conversion_pool', new=conversion_pool), \
+                    mock.patch('intelmq_webinput_csv.serve.CONFIG', new=CONFIG | {'conversion_chunk_size': 2}):
+                result = test.call('POST', intelmq_webinput_csv.serve, '/api/upload/', body=body)
+    assert result.status == '200 OK'
+    assert result.data == expected.data
+    assert result.data['input_lines'] == 5
+    assert result.data['input_lines_invalid'] == 1
+
+
+def test_upload_invalid_column():
+    """
+    Invalid field names are reported once for the column, the lines are invalid,
+    but have no errors of their own
+    """
+    with mock.patch('webinput_session.session.skip_verify_user', new=True):
+        with mock.patch('webinput_session.session.skip_authentication', new=True):
+            with mock.patch('intelmq_webinput_csv.serve.CONFIG', new=CONFIG):
+                result = test.call('POST', intelmq_webinput_csv.serve, '/api/upload/', body={'submit': False,
+                                                                                             'data': [{'source.ip': '127.0.0.1', 'source.foo': 'bar'}] * 2,
+                                                                                             'dryrun': True,
+                                                                                             'custom': {}
+                                                                                             })
+    assert result.status == '200 OK'
+    assert result.data['input_lines_invalid'] == 2
+    assert list(result.data['column_errors']) == ['source.foo']
+    assert result.data['errors'] == {}
+
+
+def test_upload_background():
+    """
+    Uploads with background=True return a job id, the result is available from the jobs endpoint
+    """
+    with mock.patch('webinput_session.session.skip_verify_user', new=True):
+        with mock.patch('webinput_session.session.skip_authentication', new=True):
+            with mock.patch('intelmq_webinput_csv.serve.CONFIG', new=CONFIG):
+                result = test.call('POST', intelmq_webinput_csv.serve, '/api/upload/', body={'submit': False,
+                                                                                             'background': True,
+                                                                                             'data': EXAMPLE_DATA_ASNAME + EXAMPLE_DATA_INVALID,
+                                                                                             'dryrun': True,
+                                                                                             'custom': {}
+                                                                                             })
+                assert result.status == '202 Accepted'
+                job_id = result.data['job_id']
+                for _ in range(100):
+                    result = test.call('GET', intelmq_webinput_csv.serve, f'/api/jobs/{job_id}')
+                    assert result.status == '200 OK'
+                    if result.data['status'] not in ('queued', 'running'):
+                        break
+                    sleep(0.05)
+                missing = test.call('GET', intelmq_webinput_csv.serve, '/api/jobs/0000')
+    assert result.data['status'] == 'finished'
+    assert result.data['progress']['input_lines'] == 2
+    assert result.data['result']['input_lines'] == 2
+    assert result.data['result']['input_lines_invalid'] == 1
+    assert missing.status == '404 Not Found'
+
+
+def test_preview_csv_stream():
+    """
+    Test the upload of raw CSV data, parsed by the backend
+    """
+    parameters = {'submit': False,
+                  'dryrun': True,
+                  'columns': ['source.ip', '', 'source.as_name'],
+                  'has_header': True,
+                  'delimiter': ';'}
+    with mock.patch('webinput_session.session.skip_authentication', new=True):
+        with mock.patch('intelmq_webinput_csv.serve.CONFIG', new=CONFIG):
+            result = test.call('POST', intelmq_webinput_csv.serve, '/api/upload/csv',
+                               body='ip;asn;as name\n127.0.0.1;1;Example AS\n\n1270.0.0.1;1;Example AS\n',
+                               headers={'content-type': 'text/csv',
+                                        'X-Webinput-Parameters': dumps(parameters)})
+    assert result.status == '200 OK'
+    assert result.data['input_lines'] == 2
+    assert result.data['input_lines_invalid'] == 1
+    assert list(result.data['errors']) == ['1']
+
+
+def test_target_groups_cached():
+    """
+    The target groups are queried once with a pooled connection, until refreshed
+    """
+    config = CONFIG | {'target_groups': {'database': {}, 'tag_name_query': 'name', 'tag_values_query': 'values'}}
+    with mock.patch('intelmq_webinput_csv.serve.connect') as connect_mock, \
+            mock.patch('intelmq_webinput_csv.serve.contactdb_pool', new=Pool(intelmq_webinput_csv.serve.create_contactdb_connection)), \
+            mock.patch('intelmq_webinput_csv.serve.target_groups_cache', new=TTLCache()), \
+            mock.patch('webinput_session.session.skip_authentication', new=True), \
+            mock.patch('intelmq_webinput_csv.serve.CONFIG', new=config):
+        cursor = connect_mock.return_value.cursor.return_value.__enter__.return_value
+        cursor.fetchall.return_value = [('a', ), ('b', )]
+        cursor.fetchone.return_value = ('Target groups', )
+        for _ in range(2):
+            result = test.call('GET', intelmq_webinput_csv.serve, '/api/mailgen/target_groups')
+            assert result.data == {'tag_name': 'Target groups', 'tag_values': ['a', 'b']}
+        assert cursor.execute.call_count == 2
+        result = test.call('GET', intelmq_webinput_csv.serve, '/api/mailgen/target_groups', refresh=True)
+        assert cursor.execute.call_count == 4
+    connect_mock.assert_called_once()
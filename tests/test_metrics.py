@@ -0,0 +1,84 @@
+"""
+Tests for the timing instrumentation and the metrics
+
+SPDX-FileCopyrightText: 2026 Bundesamt für Sicherheit in der Informationstechnik
+SPDX-License-Identifier: AGPL-3.0-or-later
+Software engineering by Intevation GmbH <https://intevation.de>
+"""
+import os
+from unittest import mock
+
+from hug import test
+
+import intelmq_webinput_csv.serve
+from intelmq_webinput_csv.metrics import Counter, Histogram, Registry, StageTimer
+from .test_main import CONFIG, EXAMPLE_DATA_ASNAME, EXAMPLE_DATA_INVALID
+
+
+def test_histogram():
+    histogram = Histogram('duration_seconds', 'Duration', ('stage', ), buckets=(0.1, 1))
+    for value in (0.05, 0.5, 5):
+        histogram.observe(value, stage='a"b')
+    assert histogram.render() == [
+        '# HELP duration_seconds Duration',
+        '# TYPE duration_seconds histogram',
+        'duration_seconds_bucket{stage="a\\"b",le="0.1"} 1',
+        'duration_seconds_bucket{stage="a\\"b",le="1.0"} 2',
+        'duration_seconds_bucket{stage="a\\"b",le="+Inf"} 3',
+        'duration_seconds_sum{stage="a\\"b"} 5.55',
+        'duration_seconds_count{stage="a\\"b"} 3',
+    ]
+
+
+def test_registry():
+    registry = Registry()
+    counter = registry.register(Counter('rows_total', 'Rows', ('status', )))
+    counter.inc(2, status='valid')
+    counter.inc(status='valid')
+    registry.add_collector(lambda: [('pool_size', 'Size', 'gauge', [({'pool': 'db'}, 4)])])
+    assert registry.render() == ('# HELP rows_total Rows\n# TYPE rows_total counter\nrows_total{status="valid"} 3\n'
+                                 '# HELP pool_size Size\n# TYPE pool_size gauge\npool_size{pool="db"} 4\n')
+    assert registry.render({'pid': 1}).splitlines()[2::3] == ['rows_total{pid="1",status="valid"} 3', 'pool_size{pid="1",pool="db"} 4']
+
+
+def test_stage_timer():
+    with mock.patch('intelmq_webinput_csv.metrics.time.perf_counter', side_effect=[10.0, 10.5, 11.0, 11.0]):
+        timer = StageTimer('test')
+        timer.add('convert', 0.25)
+        timer.add('convert', 0.25)
+        timer.add('bot.my bot', 0.001)
+        with timer.measure('send'):
+            pass
+        timer.finish()
+    assert timer.durations == {'convert': 0.5, 'bot.my bot': 0.001, 'send': 0.5, 'total': 1.0}
+    assert timer.server_timing() == 'convert;dur=500.000, bot.my_bot;dur=1.000, send;dur=500.000, total;dur=1000.000'
+
+
+def test_upload_metrics():
+    """
+    The upload sends the durations in the Server-Timing header, the rows are counted in the metrics
+    """
+    with mock.patch('webinput_session.session.skip_authentication', new=True), \
+            mock.patch('intelmq_webinput_csv.serve.CONFIG', new=CONFIG | {'metrics_enabled': True}), \
+            mock.patch('intelmq_webinput_csv.serve.ROWS', new=Counter('rows', '', ('endpoint', 'status'))) as rows:
+        result = test.call('POST', intelmq_webinput_csv.serve, '/api/upload/', body={'submit': False,
+                                                                                     'data': EXAMPLE_DATA_ASNAME * 2 + EXAMPLE_DATA_INVALID,
+                                                                                     'custom': {},
+                                                                                     'dryrun': True,
+                                                                                     })
+        assert result.status == '200 OK'
+        stages = [metric.split(';')[0] for metric in result.headers_dict['Server-Timing'].split(', ')]
+        assert stages == ['parse', 'convert', 'serialize', 'total']
+        assert rows.values == {('upload', 'valid'): 2, ('upload', 'invalid'): 1}
+
+        result = test.call('GET', intelmq_webinput_csv.serve, '/api/metrics')
+    assert result.status == '200 OK'
+    pid = os.getpid()
+    assert f'webinput_stage_duration_seconds_count{{pid="{pid}",endpoint="upload",stage="convert"}}' in result.data
+    assert f'webinput_pool_size{{pid="{pid}",pool="destination_pipeline"}}' in result.data
+
+
+def test_metrics_disabled():
+    with mock.patch('intelmq_webinput_csv.serve.CONFIG', new=CONFIG):
+        result = test.call('GET', intelmq_webinput_csv.serve, '/api/metrics')
+    assert result.status == '404 Not Found'
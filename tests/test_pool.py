@@ -0,0 +1,41 @@
+"""
+Tests for the resource pool
+
+SPDX-FileCopyrightText: 2026 Bundesamt für Sicherheit in der Informationstechnik
+SPDX-License-Identifier: AGPL-3.0-or-later
+Software engineering by Intevation GmbH <https://intevation.de>
+"""
+from itertools import count
+
+import pytest
+
+from intelmq_webinput_csv.pool import Pool, PoolTimeout
+
+
+def test_pool_reuse():
+    pool = Pool(count().__next__, size=2)
+    with pool.lease() as first:
+        with pool.lease() as second:
+            assert first != second
+    with pool.lease() as third:
+        assert third in (first, second)
+    assert pool.stats() == {'size': 2, 'created': 2, 'idle': 2, 'in_use': 0}
+
+
+def test_pool_timeout():
+    pool = Pool(object, size=1, timeout=0.01)
+    with pool.lease():
+        with pytest.raises(PoolTimeout):
+            pool.acquire()
+
+
+def test_pool_replaces_unhealthy():
+    closed = []
+    pool = Pool(count().__next__, size=1, check=lambda resource: False, close=closed.append)
+    with pytest.raises(ValueError):
+        with pool.lease():
+            raise ValueError
+    # the previous borrower raised, so the resource is checked and replaced
+    with pool.lease() as resource:
+        assert resource == 1
+    assert closed == [0]
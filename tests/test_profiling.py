@@ -0,0 +1,78 @@
+"""
+Tests for the profiling of requests
+
+SPDX-FileCopyrightText: 2026 Bundesamt für Sicherheit in der Informationstechnik
+SPDX-License-Identifier: AGPL-3.0-or-later
+Software engineering by Intevation GmbH <https://intevation.de>
+"""
+from unittest import mock
+
+import pytest
+from hug import test
+
+import intelmq_webinput_csv.serve
+from intelmq_webinput_csv.profiling import Profiler
+from .test_main import CONFIG, EXAMPLE_DATA_ASNAME
+
+
+def test_profiler(tmp_path):
+    profiler = Profiler(tmp_path / 'profiles', top=5)
+    result, profile_id = profiler.call('test', sorted, [3, 1, 2], memory=True, reverse=True)
+    assert result == [3, 2, 1]
+    assert (tmp_path / 'profiles' / f'{profile_id}.prof').exists()
+    summary = (tmp_path / 'profiles' / f'{profile_id}.txt').read_text()
+    assert 'cumulative' in summary
+    assert 'allocation sites' in summary
+
+    with pytest.raises(ZeroDivisionError):
+        profiler.call('error', lambda: 1 / 0)
+    assert len(list((tmp_path / 'profiles').glob('*-error-*.prof'))) == 1
+
+
+def upload(username: str):
+    # the session store is created again at startup
+    with mock.patch('webinput_session.session.session_store'), \
+            mock.patch('webinput_session.session.create_session_store') as create_session_store:
+        create_session_store.return_value.verify_token.return_value = {'username': username}
+        return test.call('POST', intelmq_webinput_csv.serve, '/api/upload/', headers={'Authorization': 'token'},
+                         body={'submit': False,
+                               'data': EXAMPLE_DATA_ASNAME,
+                               'custom': {},
+                               'dryrun': True,
+                               'profile': True,
+                               })
+
+
+def test_upload_profile(tmp_path):
+    """
+    Only the profiling users can request profiles, the id of the profile is part of the result
+    """
+    with mock.patch('intelmq_webinput_csv.serve.CONFIG', new=CONFIG | {'profiling_users': ['admin']}), \
+            mock.patch('intelmq_webinput_csv.serve.profiler', new=Profiler(tmp_path)):
+        result = upload('user')
+        assert result.status == '403 Forbidden'
+
+        result = upload('admin')
+    assert result.status == '200 OK'
+    assert result.data['input_lines_invalid'] == 0
+    assert (tmp_path / f'{result.data["profile_id"]}.prof').exists()
+
+
+def test_upload_profile_conversion(tmp_path):
+    """
+    Profiled uploads are converted in the process, so the conversion is part of the profile
+    """
+    conversion_pool = mock.Mock()
+    with mock.patch('intelmq_webinput_csv.serve.CONFIG', new=CONFIG | {'profiling_users': ['admin'], 'conversion_chunk_size': 1}), \
+            mock.patch('intelmq_webinput_csv.serve.conversion_pool', new=conversion_pool), \
+            mock.patch('intelmq_webinput_csv.serve.profiler', new=Profiler(tmp_path)):
+        result = upload('admin')
+    assert result.status == '200 OK'
+    conversion_pool.submit.assert_not_called()
+    assert 'row_to_event' in (tmp_path / f'{result.data["profile_id"]}.txt').read_text()
+
+
+def test_profile_disabled():
+    with mock.patch('intelmq_webinput_csv.serve.CONFIG', new=CONFIG | {'profiling_users': ['admin']}):
+        result = upload('admin')
+    assert result.status == '403 Forbidden'
@@ -0,0 +1,177 @@
+"""
+Tests for the session store
+
+SPDX-FileCopyrightText: 2026 Bundesamt für Sicherheit in der Informationstechnik
+SPDX-License-Identifier: AGPL-3.0-or-later
+Software engineering by Intevation GmbH <https://intevation.de>
+"""
+import sqlite3
+import threading
+import time
+from unittest import mock
+
+import pytest
+
+from webinput_session.config import Config
+from webinput_session.session import BaseSessionStore, SessionStore, create_session_store
+
+INIT_DB_V1_SQL = """
+CREATE TABLE version (version INTEGER);
+INSERT INTO version (version) VALUES (1);
+CREATE TABLE session (
+    session_id TEXT PRIMARY KEY,
+    modified TIMESTAMP,
+    data BLOB
+);
+CREATE TABLE user(
+    username TEXT PRIMARY KEY,
+    password TEXT,
+    salt TEXT
+);
+INSERT INTO session VALUES ('valid', CURRENT_TIMESTAMP, '{"username": "user"}');
+INSERT INTO session VALUES ('expired', '2000-01-01 00:00:00', '{"username": "user"}');
+"""
+
+
+def test_reauth_cache(tmp_path):
+    """
+    Verified credentials are cached per session, failed verifications are not
+    """
+    store = SessionStore(str(tmp_path / 'session.sqlite'), 3600, reauth_cache_duration=60)
+    store.add_user('user', 'secret')
+    with mock.patch.object(store, 'hash_password', wraps=store.hash_password) as hash_password:
+        assert store.verify_user('user', 'secret', token='a') == {'username': 'user'}
+        assert store.verify_user('user', 'secret', token='a') == {'username': 'user'}
+        assert hash_password.call_count == 1
+        assert store.verify_user('user', 'wrong', token='a') is None
+        assert store.verify_user('user', 'secret', token='b') == {'username': 'user'}
+        assert store.verify_user('user', 'secret') == {'username': 'user'}
+        assert hash_password.call_count == 4
+
+        with mock.patch('webinput_session.session.time.monotonic', return_value=float('inf')):
+            assert store.verify_user('user', 'secret', token='a') == {'username': 'user'}
+        assert hash_password.call_count == 5
+
+
+def test_reauth_cache_size(tmp_path):
+    store = SessionStore(str(tmp_path / 'session.sqlite'), 3600, reauth_cache_size=2)
+    store.add_user('user', 'secret')
+    for token in 'abc':
+        store.verify_user('user', 'secret', token=token)
+    assert [key[0] for key in store.reauth_cache] == ['b', 'c']
+
+
+def test_reauth_cache_password_changed(tmp_path):
+    """
+    Cached verifications are not used anymore once the password changed, also if changed by another process
+    """
+    store = SessionStore(str(tmp_path / 'session.sqlite'), 3600)
+    store.add_user('user', 'secret')
+    assert store.verify_user('user', 'secret', token='a') == {'username': 'user'}
+    # e.g. webinput-adduser
+    SessionStore(str(tmp_path / 'session.sqlite'), 3600).add_user('user', 'changed')
+    assert store.verify_user('user', 'secret', token='a') is None
+    assert not store.reauth_cache
+    assert store.verify_user('user', 'changed', token='a') == {'username': 'user'}
+
+
+def test_session_cache(tmp_path):
+    """
+    Tokens are verified from memory, touches are written in the maintenance
+    """
+    store = SessionStore(str(tmp_path / 'session.sqlite'), 3600, maintenance_interval=60)
+    token = store.new_session({'username': 'user'})
+    assert store.verify_token(token) == {'username': 'user'}
+    with mock.patch.object(store, 'execute', wraps=store.execute) as execute:
+        assert store.verify_token(token) == {'username': 'user'}
+        assert store.verify_token('unknown') is False
+        assert execute.call_count == 1
+    assert token in store.pending_touches
+
+    store.execute("UPDATE session SET expires = 0", ())
+    store.next_maintenance = 0
+    store.maintain()
+    assert not store.pending_touches
+    assert store.execute("SELECT expires > 0 FROM session WHERE session_id = ?", (token, )) == (1, )
+
+    # expired sessions are not valid anymore, even before the maintenance
+    store.execute("UPDATE session SET expires = 0", ())
+    store.session_cache.clear()
+    assert store.verify_token(token) is False
+
+
+def test_concurrent_touches(tmp_path):
+    """
+    Touches of sessions are not lost while they are written from another thread
+    """
+    store = SessionStore(str(tmp_path / 'session.sqlite'), 3600, maintenance_interval=0)
+    tokens = [store.new_session({'username': 'user'}) for _ in range(40)]
+    store.execute("UPDATE session SET expires = ?", (int(time.time()) + 60, ))
+
+    def touch(tokens):
+        for token in tokens:
+            store.verify_token(token)
+    threads = [threading.Thread(target=touch, args=(tokens[index::4], )) for index in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    store.flush_touches()
+    assert store.execute("SELECT count(*) FROM session WHERE expires > ?", (int(time.time()) + 60, )) == (40, )
+
+
+def test_migration_v2(tmp_path):
+    """
+    The expiry time of the sessions is computed from the modification time
+    """
+    dbname = str(tmp_path / 'session.sqlite')
+    with sqlite3.connect(dbname) as con:
+        con.executescript(INIT_DB_V1_SQL)
+    store = SessionStore(dbname, 3600)
+    assert store.execute("SELECT version FROM version", ()) == (2, )
+    assert store.execute("PRAGMA journal_mode", ()) == ('wal', )
+    assert abs(store.execute("SELECT expires FROM session WHERE session_id = 'valid'", ())[0] - time.time() - 3600) < 10
+    assert store.verify_token('valid') == {'username': 'user'}
+    assert store.verify_token('expired') is False
+    assert SessionStore(dbname, 3600).verify_token('valid') == {'username': 'user'}
+
+
+def test_redis_session_store():
+    fakeredis = pytest.importorskip('fakeredis')
+    from webinput_session.redis_session import RedisSessionStore
+
+    client = fakeredis.FakeRedis(decode_responses=True)
+    store = RedisSessionStore('', 3600, client=client)
+    store.add_user('user', 'secret')
+    assert store.verify_user('user', 'secret') == {'username': 'user'}
+    assert store.verify_user('user', 'wrong') is None
+    assert store.verify_user('unknown', 'secret') is None
+
+    token = store.new_session({'username': 'user'})
+    client.expire(f'webinput-session:session:{token}', 10)
+    assert store.verify_token(token) == {'username': 'user'}
+    assert client.ttl(f'webinput-session:session:{token}') > 10
+    client.delete(f'webinput-session:session:{token}')
+    assert store.verify_token(token) is False
+
+
+def test_incomplete_session_store():
+    """
+    Backends must implement all methods of the interface
+    """
+    class IncompleteSessionStore(BaseSessionStore):
+        def get(self, session_id):
+            return None
+
+    with pytest.raises(TypeError):
+        IncompleteSessionStore(3600)
+
+
+def test_create_session_store(tmp_path):
+    config = Config()
+    assert create_session_store(config) is None
+    config.session_store = tmp_path / 'session.sqlite'
+    assert isinstance(create_session_store(config), SessionStore)
+    config.session_backend = 'unknown'
+    with pytest.raises(ValueError):
+        create_session_store(config)
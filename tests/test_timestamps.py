@@ -0,0 +1,58 @@
+"""
+Tests for the timestamp parser
+
+SPDX-FileCopyrightText: 2026 Bundesamt für Sicherheit in der Informationstechnik
+SPDX-License-Identifier: AGPL-3.0-or-later
+Software engineering by Intevation GmbH <https://intevation.de>
+"""
+import dateutil.parser
+import pytest
+
+from intelmq_webinput_csv.timestamps import FORMATS, SAMPLE_SIZE, TimestampParser
+
+VALUES = ['2024-01-31 10:00', '2024-01-31T10:00:00.5Z', '2024-01-31T10:00:00.123456-0130',
+          '2024-01-31 10:00:00 +02:00', '2024/1/2 3:04:05', '01/02/2024 10:00', '01.02.2024 10:00:00',
+          '13.02.2024 10:00', '2024-13-01 10:00', '2024-01-31T24:00:00', '2024-01-31', '01.02.2024',
+          'Sent on 2024-01-31 10:00']
+
+
+def parse_with_dateutil(value: str, timezone: str) -> str:
+    parsed = dateutil.parser.parse(value, fuzzy=True)
+    if not parsed.tzinfo:
+        parsed = dateutil.parser.parse(value + timezone)
+    return parsed.isoformat()
+
+
+@pytest.mark.parametrize('timezone', ['+00:00', '-05:00', '+12:00'])
+def test_same_as_dateutil(timezone):
+    """
+    All values parsed by any format give the same result as dateutil, others are left to dateutil
+    """
+    parser = TimestampParser(timezone)
+    for parser.format in FORMATS:
+        for value in VALUES:
+            result = parser.parse(value)
+            if result is not None:
+                assert result == parse_with_dateutil(value, timezone), value
+
+
+def test_learn_format():
+    parser = TimestampParser('+01:00')
+    for hour in range(SAMPLE_SIZE):
+        value = f'2024-01-31 {hour}:00:00'
+        assert parser.parse(value) is None
+        parser.learn(value, parse_with_dateutil(value, '+01:00'))
+    assert parser.format is FORMATS[0]
+    assert parser.parse('2024-02-01 12:00:00') == '2024-02-01T12:00:00+01:00'
+    assert parser.parse('02/01/2024 12:00:00') is None
+
+
+def test_learn_no_format():
+    """
+    If the samples disagree with a format, it is not used
+    """
+    parser = TimestampParser('+00:00')
+    for _ in range(SAMPLE_SIZE):
+        parser.learn('2024-01-31 10:00:00', '2024-01-31T11:00:00+00:00')
+    assert parser.format is None
+    assert parser.parse('2024-01-31 10:00:00') is None
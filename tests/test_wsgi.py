@@ -0,0 +1,91 @@
+"""
+Tests for the application factory and forked processes
+
+SPDX-FileCopyrightText: 2026 Bundesamt für Sicherheit in der Informationstechnik
+SPDX-License-Identifier: AGPL-3.0-or-later
+Software engineering by Intevation GmbH <https://intevation.de>
+"""
+import os
+import sys
+import threading
+import time
+from unittest import mock
+
+import pytest
+from hug import test
+
+import intelmq_webinput_csv.serve
+from webinput_session import session
+from .test_main import CONFIG
+
+
+def test_create_app():
+    """
+    The bots are imported before the fork, setup is left to the processes
+    """
+    config = CONFIG | {'bots': {'taxonomy': {'module': 'intelmq.bots.experts.taxonomy.expert'}}}
+    with mock.patch('intelmq_webinput_csv.serve.CONFIG', new=config), \
+            mock.patch('intelmq_webinput_csv.serve.gc.freeze') as freeze, \
+            mock.patch('intelmq_webinput_csv.serve.setup') as setup:
+        application = intelmq_webinput_csv.serve.create_app()
+    assert callable(application)
+    freeze.assert_called_once_with()
+    setup.assert_not_called()
+    assert 'intelmq.bots.experts.taxonomy.expert' in sys.modules
+
+
+def test_fork():
+    """
+    The child process does not use the resources of the parent, but creates its own on the first request
+    """
+    with mock.patch('intelmq_webinput_csv.serve.CONFIG', new=CONFIG):
+        assert test.call('GET', intelmq_webinput_csv.serve, '/api/version').status == '200 OK'
+        pool = intelmq_webinput_csv.serve.destination_pipeline_pool
+        pid = os.fork()
+        if pid == 0:
+            status = 0
+            try:
+                if intelmq_webinput_csv.serve.destination_pipeline_pool is not None or session.session_store is not None:
+                    status = 1
+                request = mock.Mock(context={})
+                intelmq_webinput_csv.serve.setup_forked_process(request, mock.Mock())
+                if intelmq_webinput_csv.serve.destination_pipeline_pool in (None, pool):
+                    status = 2
+            finally:
+                os._exit(status)
+        assert os.waitpid(pid, 0)[1] == 0
+    assert intelmq_webinput_csv.serve.destination_pipeline_pool is pool
+
+
+def test_concurrent_setup():
+    """
+    Concurrent first requests of a process create the resources only once, the process counts as set up afterwards
+    """
+    def create_resources():
+        time.sleep(0.1)
+        assert intelmq_webinput_csv.serve.setup_pid is None
+
+    with mock.patch('intelmq_webinput_csv.serve.setup_pid', new=None), \
+            mock.patch('intelmq_webinput_csv.serve.create_resources', side_effect=create_resources) as create:
+        threads = [threading.Thread(target=intelmq_webinput_csv.serve.setup_forked_process, args=(mock.Mock(context={}), mock.Mock()))
+                   for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        create.assert_called_once_with()
+        assert intelmq_webinput_csv.serve.setup_pid == os.getpid()
+
+
+def test_failed_setup():
+    """
+    If creating a resource fails, the next request tries again
+    """
+    with mock.patch('intelmq_webinput_csv.serve.setup_pid', new=None), \
+            mock.patch('intelmq_webinput_csv.serve.create_resources', side_effect=[ConnectionError, None]) as create:
+        with pytest.raises(ConnectionError):
+            intelmq_webinput_csv.serve.setup_forked_process(mock.Mock(context={}), mock.Mock())
+        assert intelmq_webinput_csv.serve.setup_pid is None
+        intelmq_webinput_csv.serve.setup_forked_process(mock.Mock(context={}), mock.Mock())
+        assert create.call_count == 2
+        assert intelmq_webinput_csv.serve.setup_pid == os.getpid()
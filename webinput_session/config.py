@@ -15,10 +15,33 @@ class Config:
 
     """Configuration settings for IntelMQ Webinput Sessions"""
 
+    # sqlite: the sessions are stored in the file session_store
+    # redis: the sessions are stored in the database session_redis_url
+    session_backend: str = "sqlite"
+
     session_store: Optional[Path] = None
 
+    session_redis_url: str = "redis://localhost:6379/5"
+
     session_duration: int = 24 * 3600
 
+    # seconds verified credentials are remembered for a session, 0 disables the cache
+    reauth_cache_duration: int = 300
+
+    reauth_cache_size: int = 1024
+
+    # maximum number of password hashes computed at the same time
+    password_hash_workers: int = 2
+
+    # seconds valid sessions are cached in memory
+    session_cache_duration: int = 60
+
+    # seconds between writing the session touches and expiring old sessions
+    session_maintenance_interval: int = 60
+
+    # number of additional connections to the session store for reading
+    session_read_connections: int = 2
+
     def __init__(self, filename: Optional[str] = None):
         """Load configuration from JSON file"""
         raw = {}
@@ -45,8 +68,32 @@ class Config:
         if not config:
             print("Was not able to load a configfile. Using default values.")
 
+        if "session_backend" in raw:
+            self.session_backend = raw["session_backend"]
+
         if "session_store" in raw:
             self.session_store = Path(raw["session_store"])
 
+        if "session_redis_url" in raw:
+            self.session_redis_url = raw["session_redis_url"]
+
         if "session_duration" in raw:
             self.session_duration = int(raw["session_duration"])
+
+        if "reauth_cache_duration" in raw:
+            self.reauth_cache_duration = int(raw["reauth_cache_duration"])
+
+        if "reauth_cache_size" in raw:
+            self.reauth_cache_size = int(raw["reauth_cache_size"])
+
+        if "password_hash_workers" in raw:
+            self.password_hash_workers = int(raw["password_hash_workers"])
+
+        if "session_cache_duration" in raw:
+            self.session_cache_duration = int(raw["session_cache_duration"])
+
+        if "session_maintenance_interval" in raw:
+            self.session_maintenance_interval = int(raw["session_maintenance_interval"])
+
+        if "session_read_connections" in raw:
+            self.session_read_connections = int(raw["session_read_connections"])
@@ -0,0 +1,68 @@
+"""Session store based on Redis
+
+SPDX-FileCopyrightText: 2026 Bundesamt für Sicherheit in der Informationstechnik
+SPDX-License-Identifier: AGPL-3.0-or-later
+Software engineering by Intevation GmbH <https://intevation.de>
+
+Multiple backends behind a load balancer can share the sessions
+and users of one Redis database.
+"""
+import json
+from typing import Optional, Tuple, Union
+
+import redis
+
+from webinput_session.session import BaseSessionStore
+
+KEY_PREFIX = "webinput-session:"
+
+
+class RedisSessionStore(BaseSessionStore):
+    """Session store based on Redis
+    The sessions expire with the TTL of their keys, which is reset on use.
+    Verifying a token is a single GETEX command, requiring Redis 6.2 or newer.
+
+    The users are stored as hashes with the fields password and salt.
+    client can be given instead of the URL, it must decode the responses.
+    """
+
+    def __init__(self, url: str, max_duration: int, reauth_cache_duration: int = 300,
+                 reauth_cache_size: int = 1024, hash_workers: int = 2,
+                 client: Optional[redis.Redis] = None):
+        super().__init__(max_duration, reauth_cache_duration, reauth_cache_size, hash_workers)
+        if client is None:
+            client = redis.Redis.from_url(url, decode_responses=True)
+        self.redis = client
+
+    #
+    # Methods for session data
+    #
+
+    def get(self, session_id: str) -> Optional[dict]:
+        data = self.redis.get(KEY_PREFIX + "session:" + session_id)
+        if data is not None:
+            return json.loads(data)
+        return None
+
+    def set(self, session_id: str, session_data: dict):
+        self.redis.set(KEY_PREFIX + "session:" + session_id, json.dumps(session_data),
+                       ex=self.max_duration)
+
+    def verify_token(self, token: str) -> Union[bool, dict]:
+        data = self.redis.getex(KEY_PREFIX + "session:" + token, ex=self.max_duration)
+        if data is not None:
+            return json.loads(data)
+        return False
+
+    #
+    # User account methods
+    #
+
+    def store_user(self, username: str, hashed: str, salt: str):
+        self.redis.hset(KEY_PREFIX + "user:" + username, mapping={"password": hashed, "salt": salt})
+
+    def lookup_user(self, username: str) -> Optional[Tuple[str, str, str]]:
+        hashed, salt = self.redis.hmget(KEY_PREFIX + "user:" + username, ["password", "salt"])
+        if hashed is None or salt is None:
+            return None
+        return (username, hashed, salt)
@@ -41,7 +41,12 @@ Design rationale:
 import json
 import os
 import threading
+import time
 import hashlib
+import hmac
+import queue
+from abc import ABC, abstractmethod
+from collections import OrderedDict
 from typing import Tuple, Union, Optional
 from contextlib import contextmanager
 import sqlite3
@@ -55,12 +60,13 @@ from hug.authentication import token
 INIT_DB_SQL = """
 BEGIN;
 CREATE TABLE version (version INTEGER);
-INSERT INTO version (version) VALUES (1);
+INSERT INTO version (version) VALUES (2);
 CREATE TABLE session (
     session_id TEXT PRIMARY KEY,
-    modified TIMESTAMP,
+    expires INTEGER NOT NULL,
     data BLOB
 );
+CREATE INDEX session_expires ON session (expires);
 CREATE TABLE user(
     username TEXT PRIMARY KEY,
     password TEXT,
@@ -69,22 +75,31 @@ CREATE TABLE user(
 COMMIT;
 """
 
+# version 1 stored the modification time instead of the expiry time
+MIGRATE_V2_SQL = [
+    "ALTER TABLE session ADD COLUMN expires INTEGER NOT NULL DEFAULT 0;",
+    "UPDATE session SET expires = CAST(strftime('%s', modified) AS INTEGER) + :max_duration;",
+    "CREATE INDEX session_expires ON session (expires);",
+    "UPDATE version SET version = 2;",
+]
+
+SCHEMA_VERSION = 2
+
 LOOKUP_SESSION_SQL = """
-SELECT data FROM session WHERE session_id = ?;
+SELECT data FROM session WHERE session_id = ? AND expires >= ?;
 """
 
 STORE_SESSION_SQL = """
-INSERT OR REPLACE INTO session (session_id, modified, data)
-VALUES (?, CURRENT_TIMESTAMP, ?);
+INSERT OR REPLACE INTO session (session_id, expires, data)
+VALUES (?, ?, ?);
 """
 
 EXPIRATION_SQL = """
-DELETE FROM session
- WHERE strftime('%s', 'now') - strftime('%s', modified) > ?;
+DELETE FROM session WHERE expires < ?;
 """
 
 TOUCH_SESSION_SQL = """
-UPDATE session SET modified = CURRENT_TIMESTAMP WHERE session_id = ?;
+UPDATE session SET expires = max(expires, ?) WHERE session_id = ?;
 """
 
 ADD_USER_SQL = """
@@ -123,18 +138,160 @@ def token_authentication(*args, **kw):
         return True
 
 
+def create_session_store(c: webinput_session.config.Config) -> Optional['BaseSessionStore']:
+    """Returns the session store configured by the session_backend, None if none is configured"""
+    if c.session_backend == "redis":
+        # redis is only required for this backend
+        from webinput_session.redis_session import RedisSessionStore
+        return RedisSessionStore(c.session_redis_url,
+                                 c.session_duration,
+                                 c.reauth_cache_duration,
+                                 c.reauth_cache_size,
+                                 c.password_hash_workers)
+    if c.session_backend != "sqlite":
+        raise ValueError(f"Unknown session backend {c.session_backend!r}.")
+    if c.session_store is None:
+        return None
+    return SessionStore(str(c.session_store),
+                        c.session_duration,
+                        c.reauth_cache_duration,
+                        c.reauth_cache_size,
+                        c.password_hash_workers,
+                        c.session_cache_duration,
+                        c.session_maintenance_interval,
+                        c.session_read_connections)
+
+
 def initialize_sessions(c: webinput_session.config.Config):
     global config, file_access, session_store
     config = c
     file_access = files.FileAccess(config)
 
-    session_file = config.session_store
-    if session_file is not None:
-        session_store = webinput_session.session.SessionStore(str(session_file),
-                                                              config.session_duration)
+    store = create_session_store(config)
+    if store is not None:
+        session_store = store
+
+
+class BaseSessionStore(ABC):
+    """Interface of the session stores
+
+    The backends store the sessions and users, the verification of the
+    user credentials is common to all of them.
+
+    Successful verifications of user credentials for a session are cached
+    for reauth_cache_duration seconds, for up to reauth_cache_size sessions.
+    The cache only holds an HMAC of the credentials, with a key generated
+    for this instance, and the password hash and salt of the user at the time of
+    the verification. A cached verification is only used while the stored hash
+    and salt are unchanged, so that password changes by other processes, like
+    webinput-adduser, take effect immediately. At most hash_workers password hashes are computed
+    at the same time, further verifications wait for a free slot.
+    """
+
+    def __init__(self, max_duration: int, reauth_cache_duration: int = 300,
+                 reauth_cache_size: int = 1024, hash_workers: int = 2):
+        self.max_duration = max_duration
+        self.reauth_cache_duration = reauth_cache_duration
+        self.reauth_cache_size = reauth_cache_size
+        self.reauth_key = os.urandom(32)
+        # key: (token, credentials digest), value: (expiry time, user data, password hash, salt), oldest first
+        self.reauth_cache = OrderedDict()
+        self.reauth_lock = threading.Lock()
+        self.hash_semaphore = threading.BoundedSemaphore(max(1, hash_workers))
+
+    #
+    # Methods for session data, to be implemented by the backends
+    #
+
+    @abstractmethod
+    def get(self, session_id: str) -> Optional[dict]:
+        """Returns the session data, None for unknown or expired sessions"""
+
+    @abstractmethod
+    def set(self, session_id: str, session_data: dict):
+        """Stores the session data and starts or extends the session"""
+
+    def new_session(self, session_data: dict) -> str:
+        token = os.urandom(16).hex()
+        self.set(token, session_data)
+        return token
+
+    @abstractmethod
+    def verify_token(self, token: str) -> Union[bool, dict]:
+        """Returns the session data and extends the session, False for invalid tokens"""
 
+    #
+    # User account methods
+    #
+
+    @abstractmethod
+    def store_user(self, username: str, hashed: str, salt: str):
+        """Adds the user or replaces the password hash and salt of the user"""
 
-class SessionStore:
+    @abstractmethod
+    def lookup_user(self, username: str) -> Optional[Tuple[str, str, str]]:
+        """Returns username, password hash and salt of the user, None if unknown"""
+
+    def add_user(self, username: str, password: str):
+        hashed, salt = self.hash_password(password)
+        self.store_user(username, hashed, salt)
+
+    def verify_user(self, username: str, password: str,
+                    token: Optional[str] = None) -> Optional[dict]:
+        """
+        Verifies the credentials of the user.
+        If the token of the session is given, the result is cached for this session.
+        """
+        if skip_verify_user:
+            return {"username": username}
+        cache_key = cached = None
+        if token is not None and self.reauth_cache_duration > 0:
+            digest = hmac.new(self.reauth_key, json.dumps([username, password]).encode("utf8"),
+                              hashlib.sha256).digest()
+            cache_key = (token, digest)
+            with self.reauth_lock:
+                cached = self.reauth_cache.get(cache_key)
+                if cached is not None and cached[0] <= time.monotonic():
+                    del self.reauth_cache[cache_key]
+                    cached = None
+        row = self.lookup_user(username)
+        if row is None:
+            return None
+        username, stored_hash, salt = row
+        if cached is not None and cached[2:] == (stored_hash, salt):
+            # the password has not been changed since the verification
+            return dict(cached[1])
+        # pbkdf2_hmac releases the GIL, the semaphore only limits the CPU time spent on hashing
+        with self.hash_semaphore:
+            hashed = self.hash_password(password, bytes.fromhex(salt))[0]
+        if hashed != stored_hash:
+            if cached is not None:
+                with self.reauth_lock:
+                    self.reauth_cache.pop(cache_key, None)
+            return None
+        if cache_key is not None:
+            with self.reauth_lock:
+                self.reauth_cache[cache_key] = (time.monotonic() + self.reauth_cache_duration,
+                                                {"username": username}, stored_hash, salt)
+                self.reauth_cache.move_to_end(cache_key)
+                while len(self.reauth_cache) > self.reauth_cache_size:
+                    self.reauth_cache.popitem(last=False)
+        return {"username": username}
+
+    def hash_password(self, password: str,
+                      salt: Optional[bytes] = None) -> Tuple[str, str]:
+        if salt is None:
+            salt = os.urandom(16)
+        hashed = hashlib.pbkdf2_hmac("sha256", password.encode("utf8"), salt,
+                                     100000)
+        return (hashed.hex(), salt.hex())
+
+    def stats(self) -> dict:
+        """Returns the sizes of the caches, for the metrics"""
+        return {"reauth_cache_entries": len(self.reauth_cache)}
+
+
+class SessionStore(BaseSessionStore):
     """Session store based on SQLite
     The SQLite database is used in autocommit mode avoid blocking
     connections to the same database from other processes. This ensures
@@ -144,32 +301,90 @@ class SessionStore:
     Instances of this class can be used by multiple threads
     simultaneously. Use of the underlying sqlite connection object is
     serialized between threads with a lock.
+    The database is used in WAL mode, so reading does not block writing.
+    Lookups use a pool of read_connections separate connections.
+
+    Valid sessions are cached in memory for session_cache_duration seconds,
+    so that verifying a token usually is a dictionary lookup. Touches of
+    sessions are collected and written to the database together with the
+    expiration of old sessions, at most every maintenance_interval seconds.
     """
 
-    def __init__(self, dbname: str, max_duration: int):
+    def __init__(self, dbname: str, max_duration: int, reauth_cache_duration: int = 300,
+                 reauth_cache_size: int = 1024, hash_workers: int = 2,
+                 session_cache_duration: int = 60, maintenance_interval: int = 60,
+                 read_connections: int = 2):
+        super().__init__(max_duration, reauth_cache_duration, reauth_cache_size, hash_workers)
         self.dbname = dbname
-        self.max_duration = max_duration
         if not os.path.isfile(self.dbname):
             self.init_sqlite_db()
         self.lock = threading.Lock()
         self.connection = self.connect()
+        self.migrate()
+        self.read_connections = queue.LifoQueue()
+        for _ in range(read_connections):
+            self.read_connections.put(self.connect())
+        self.session_cache_duration = session_cache_duration
+        # key: token, value: (expiry time, session data)
+        self.session_cache = {}
+        # key: token, value: unix time of the last use, swapped when written
+        self.pending_touches = {}
+        self.touches_lock = threading.Lock()
+        self.maintenance_interval = maintenance_interval
+        self.next_maintenance = 0.0
+        self.maintenance_lock = threading.Lock()
 
     def connect(self) -> sqlite3.Connection:
-        return sqlite3.connect(self.dbname, check_same_thread=False,
-                               isolation_level=None)
+        con = sqlite3.connect(self.dbname, check_same_thread=False,
+                              isolation_level=None)
+        # with WAL, the database is consistent after crashes also with NORMAL
+        con.execute("PRAGMA synchronous = NORMAL")
+        return con
 
     @contextmanager
     def get_con(self):
         with self.lock:
             yield self.connection
 
+    @contextmanager
+    def get_read_con(self):
+        try:
+            con = self.read_connections.get_nowait()
+        except queue.Empty:
+            # no pool or all connections in use
+            with self.get_con() as con:
+                yield con
+            return
+        try:
+            yield con
+        finally:
+            self.read_connections.put(con)
+
     def init_sqlite_db(self):
         with self.connect() as con:
             con.executescript(INIT_DB_SQL)
 
-    def execute(self, stmt: str, params: tuple) -> Optional[tuple]:
+    def migrate(self):
+        """Updates the database schema to the current version and enables WAL"""
+        with self.get_con() as con:
+            if con.execute("PRAGMA journal_mode").fetchone()[0] != "wal":
+                con.execute("PRAGMA journal_mode = WAL")
+            if con.execute("SELECT version FROM version").fetchone()[0] >= SCHEMA_VERSION:
+                return
+            con.execute("BEGIN IMMEDIATE")
+            try:
+                # another process may have migrated the database in the meantime
+                if con.execute("SELECT version FROM version").fetchone()[0] < 2:
+                    for stmt in MIGRATE_V2_SQL:
+                        con.execute(stmt, {"max_duration": self.max_duration})
+            except BaseException:
+                con.execute("ROLLBACK")
+                raise
+            con.execute("COMMIT")
+
+    def execute(self, stmt: str, params: tuple, read: bool = False) -> Optional[tuple]:
         try:
-            with self.get_con() as con:
+            with (self.get_read_con() if read else self.get_con()) as con:
                 return con.execute(stmt, params).fetchone()
         except sqlite3.OperationalError as exc:
             print(f"SQLite3-Error ({exc}): Possibly missing write permissions to session file (or the folder it is located in).")
@@ -180,54 +395,78 @@ class SessionStore:
     #
 
     def expire_sessions(self):
-        self.execute(EXPIRATION_SQL, (self.max_duration,))
+        self.execute(EXPIRATION_SQL, (int(time.time()),))
+
+    def flush_touches(self):
+        """Writes the collected touches of sessions to the database"""
+        with self.touches_lock:
+            touches, self.pending_touches = self.pending_touches, {}
+        if not touches:
+            return
+        try:
+            with self.get_con() as con:
+                con.executemany(TOUCH_SESSION_SQL,
+                                [(int(used) + self.max_duration, session_id) for session_id, used in touches.items()])
+        except sqlite3.OperationalError as exc:
+            print(f"SQLite3-Error ({exc}): Possibly missing write permissions to session file (or the folder it is located in).")
+
+    def stats(self) -> dict:
+        with self.touches_lock:
+            pending_touches = len(self.pending_touches)
+        return super().stats() | {"session_cache_entries": len(self.session_cache),
+                                  "pending_touches": pending_touches,
+                                  "idle_read_connections": self.read_connections.qsize()}
+
+    def maintain(self):
+        """
+        Writes the touches, expires old sessions and drops outdated cache entries,
+        if the last run is at least maintenance_interval seconds ago
+        """
+        if time.monotonic() < self.next_maintenance or not self.maintenance_lock.acquire(blocking=False):
+            return
+        try:
+            self.next_maintenance = time.monotonic() + self.maintenance_interval
+            self.flush_touches()
+            self.expire_sessions()
+            now = time.monotonic()
+            for session_id, (cached_until, _) in list(self.session_cache.items()):
+                if cached_until <= now:
+                    self.session_cache.pop(session_id, None)
+        finally:
+            self.maintenance_lock.release()
 
     def get(self, session_id: str) -> Optional[dict]:
-        self.expire_sessions()
-        row = self.execute(LOOKUP_SESSION_SQL, (session_id,))
+        self.maintain()
+        row = self.execute(LOOKUP_SESSION_SQL, (session_id, int(time.time())), read=True)
         if row is not None:
             return json.loads(row[0])
         return None
 
     def set(self, session_id: str, session_data: dict):
         self.execute(STORE_SESSION_SQL,
-                     (session_id, json.dumps(session_data)))
-
-    def new_session(self, session_data: dict) -> str:
-        token = os.urandom(16).hex()
-        self.set(token, session_data)
-        return token
+                     (session_id, int(time.time()) + self.max_duration, json.dumps(session_data)))
+        self.session_cache.pop(session_id, None)
 
     def verify_token(self, token: str) -> Union[bool, dict]:
-        session_data = self.get(token)
-        if session_data is not None:
-            self.execute(TOUCH_SESSION_SQL, (token,))
-            return session_data
-        return False
+        now = time.monotonic()
+        cached = self.session_cache.get(token)
+        if cached is None or cached[0] <= now:
+            session_data = self.get(token)
+            if session_data is None:
+                self.session_cache.pop(token, None)
+                return False
+            cached = self.session_cache[token] = (now + self.session_cache_duration, session_data)
+        with self.touches_lock:
+            self.pending_touches[token] = time.time()
+        self.maintain()
+        return cached[1]
 
     #
     # User account methods
     #
 
-    def add_user(self, username: str, password: str):
-        hashed, salt = self.hash_password(password)
+    def store_user(self, username: str, hashed: str, salt: str):
         self.execute(ADD_USER_SQL, (username, hashed, salt))
 
-    def verify_user(self, username: str, password: str) -> Optional[dict]:
-        if skip_verify_user:
-            return {"username": username}
-        row = self.execute(LOOKUP_USER_SQL, (username,))
-        if row is not None:
-            username, stored_hash, salt = row
-            hashed = self.hash_password(password, bytes.fromhex(salt))[0]
-            if hashed == stored_hash:
-                return {"username": username}
-        return None
-
-    def hash_password(self, password: str,
-                      salt: Optional[bytes] = None) -> Tuple[str, str]:
-        if salt is None:
-            salt = os.urandom(16)
-        hashed = hashlib.pbkdf2_hmac("sha256", password.encode("utf8"), salt,
-                                     100000)
-        return (hashed.hex(), salt.hex())
+    def lookup_user(self, username: str) -> Optional[Tuple[str, str, str]]:
+        return self.execute(LOOKUP_USER_SQL, (username,), read=True)